@@ -0,0 +1,119 @@
+# admission_control.py
+"""
+Admission control ở bước signaling (/offer): so số session đang sống, độ sâu queue ASR/executor và
+p95 latency cả lượt gần nhất với giới hạn cấu hình. Quá tải -> từ chối cuộc gọi mới ngay (503 + Retry-After)
+trước khi tạo RTCPeerConnection, thay vì nhận rồi để mọi cuộc gọi cùng timeout.
+Ưu tiên cuộc gọi đang diễn ra: cuộc gọi mới chỉ dùng được ADMISSION_NEW_CALL_HEADROOM của queue/latency,
+còn /offer lại của session đang sống (renegotiate, ICE restart) luôn được nhận.
+"""
+import math
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+from logging_layer import get_logger
+from metrics_layer import (
+    ADMISSION_DECISIONS, active_session_count, executor_queue_depths, model_pool_backlog, recent_stage_quantile
+)
+
+# --- SAFE IMPORT CONFIG ---
+try:
+    from config_db import (
+        ADMISSION_ENABLED, ADMISSION_MAX_TURN_P95_S, ADMISSION_LATENCY_SAMPLES, ADMISSION_LATENCY_MAX_AGE_S,
+        ADMISSION_NEW_CALL_HEADROOM, ADMISSION_RETRY_AFTER_S, ADMISSION_MAX_RETRY_AFTER_S, MAX_ACTIVE_SESSIONS,
+        MAX_EXECUTOR_QUEUE_DEPTH
+    )
+except ImportError:
+    ADMISSION_ENABLED = False
+    ADMISSION_MAX_TURN_P95_S = 4.0
+    ADMISSION_LATENCY_SAMPLES = 20
+    ADMISSION_LATENCY_MAX_AGE_S = 60.0
+    ADMISSION_NEW_CALL_HEADROOM = 0.75
+    ADMISSION_RETRY_AFTER_S = 5
+    ADMISSION_MAX_RETRY_AFTER_S = 60
+    MAX_ACTIVE_SESSIONS = 20
+    MAX_EXECUTOR_QUEUE_DEPTH = 8
+
+
+@dataclass(frozen=True)
+class AdmissionDecision:
+    admitted: bool
+    reason: str                         # "ok" | "in_progress" | "disabled" | "over_session_capacity" | ...
+    retry_after_s: Optional[int] = None
+
+
+def _queue_depth() -> int:
+    """Việc đang chờ: queue executor sâu nhất + lượt ASR đang chờ model Whisper."""
+    return max(executor_queue_depths().values(), default=0) + model_pool_backlog("whisper:")
+
+
+class AdmissionController:
+    """
+    Quyết định nhận/từ chối một /offer. Giới hạn cho cuộc gọi mới:
+      - session: active < max_sessions;
+      - queue:   depth < max_queue_depth * headroom;
+      - latency: p95 lượt gần nhất (trong ADMISSION_LATENCY_MAX_AGE_S) < max_turn_p95_s * headroom;
+                 bỏ qua khi không còn session nào (latency cũ không nói gì về tải hiện tại).
+    Retry-After tăng theo mức quá tải (base * tỉ lệ vượt ngưỡng, chặn trên max_retry_after_s).
+    """
+
+    def __init__(self, enabled: bool = ADMISSION_ENABLED, max_sessions: int = MAX_ACTIVE_SESSIONS,
+                 max_queue_depth: int = MAX_EXECUTOR_QUEUE_DEPTH, max_turn_p95_s: float = ADMISSION_MAX_TURN_P95_S,
+                 headroom: float = ADMISSION_NEW_CALL_HEADROOM, retry_after_s: int = ADMISSION_RETRY_AFTER_S,
+                 max_retry_after_s: int = ADMISSION_MAX_RETRY_AFTER_S,
+                 sessions_fn: Callable[[], int] = active_session_count, queue_fn: Callable[[], int] = _queue_depth,
+                 latency_fn: Optional[Callable[[], Optional[float]]] = None, log_callback: Optional[Callable] = None):
+        self.enabled = enabled
+        self.max_sessions = max_sessions
+        self.max_queue_depth = max_queue_depth
+        self.max_turn_p95_s = max_turn_p95_s
+        self.headroom = headroom
+        self.retry_after_s = retry_after_s
+        self.max_retry_after_s = max_retry_after_s
+        self._sessions_fn = sessions_fn
+        self._queue_fn = queue_fn
+        self._latency_fn = latency_fn or (lambda: recent_stage_quantile("turn", 0.95, ADMISSION_LATENCY_SAMPLES,
+                                                                        max_age_s=ADMISSION_LATENCY_MAX_AGE_S))
+        self._log = get_logger("admission", log_callback)
+        self.rejected = 0
+
+    def _retry_after(self, overload: float) -> int:
+        return int(min(self.max_retry_after_s, math.ceil(self.retry_after_s * max(1.0, overload))))
+
+    def _evaluate(self) -> AdmissionDecision:
+        sessions = self._sessions_fn()
+        if sessions >= self.max_sessions:
+            return AdmissionDecision(False, "over_session_capacity", self._retry_after(1.0))
+        queue_limit = self.max_queue_depth * self.headroom
+        queue = self._queue_fn()
+        if queue_limit > 0 and queue >= queue_limit:
+            return AdmissionDecision(False, "queue_saturated", self._retry_after(queue / queue_limit))
+        latency_limit = self.max_turn_p95_s * self.headroom
+        # Node rảnh: không có lượt mới nào để làm mới p95, từ chối theo latency thì không bao giờ hồi phục
+        p95 = self._latency_fn() if sessions > 0 else None
+        if p95 is not None and latency_limit > 0 and p95 >= latency_limit:
+            return AdmissionDecision(False, "turn_latency_high", self._retry_after(p95 / latency_limit))
+        return AdmissionDecision(True, "ok")
+
+    def admit(self, session_id: str, in_progress: bool = False) -> AdmissionDecision:
+        """Quyết định cho /offer của session_id (in_progress: session đang có peer connection sống)."""
+        if not self.enabled:
+            decision = AdmissionDecision(True, "disabled")
+        elif in_progress:
+            decision = AdmissionDecision(True, "in_progress")
+        else:
+            decision = self._evaluate()
+        ADMISSION_DECISIONS.labels("admit" if decision.admitted else "reject", decision.reason).inc()
+        if not decision.admitted:
+            self.rejected += 1
+            self._log.warning("🚦 [ADMISSION] Từ chối cuộc gọi %s (%s), retry sau %ss.",
+                              session_id, decision.reason, decision.retry_after_s)
+        return decision
+
+    def status(self) -> Dict[str, Any]:
+        decision = self._evaluate() if self.enabled else AdmissionDecision(True, "disabled")
+        return {"enabled": self.enabled, "accepting_new_calls": decision.admitted, "reason": decision.reason,
+                "rejected_total": self.rejected}
+
+
+# Controller dùng chung cho server
+controller = AdmissionController()
@@ -0,0 +1,109 @@
+# asr_fastpath.py
+"""
+Fast path cho câu ngắn: encoder Whisper chạy trên mel cắt theo độ dài clip (bucket cố định)
+thay vì luôn pad tới cửa sổ 30 giây của model.transcribe.
+
+Encoder của Whisper nhận đúng 3000 frame mel (n_audio_ctx = 1500 sau conv stride 2). Với câu 1-4 giây,
+hơn 85% compute encoder nằm ở phần padding. Ở đây:
+  1. pad audio tới bucket gần nhất (ví dụ 2/4/8 giây) -> log-mel (100 frame/giây);
+  2. chạy encoder thủ công với positional_embedding cắt còn bucket*50 vị trí;
+  3. decode bằng whisper.decode trên một bản sao nông của model có dims.n_audio_ctx = bucket*50
+     (DecodingTask nhận audio features đã encode khi shape khớp (n_audio_ctx, n_audio_state)).
+Clip dài hơn bucket lớn nhất -> trả None để dùng model.transcribe như cũ.
+"""
+import copy
+import dataclasses
+import threading
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+# --- SAFE IMPORT CONFIG ---
+try:
+    from config_db import SAMPLE_RATE, ASR_FASTPATH_BUCKETS_S
+except ImportError:
+    SAMPLE_RATE = 16000
+    ASR_FASTPATH_BUCKETS_S = (2, 4, 8)
+
+_MEL_FRAMES_PER_SECOND = 100  # HOP_LENGTH = 160 @ 16kHz
+_CTX_PER_SECOND = 50          # conv2 stride 2
+
+_bucket_models: Dict[Tuple[int, int], Any] = {}
+_bucket_lock = threading.Lock()
+
+
+def supports_fastpath(model: Any) -> bool:
+    """Chỉ áp dụng cho model openai-whisper thật (có encoder/dims)."""
+    return hasattr(model, "dims") and hasattr(model, "encoder")
+
+
+def pick_bucket(n_samples: int, buckets: Sequence[float] = ASR_FASTPATH_BUCKETS_S) -> Optional[float]:
+    """Bucket nhỏ nhất chứa được clip; None nếu clip dài hơn bucket lớn nhất."""
+    seconds = n_samples / SAMPLE_RATE
+    for bucket in sorted(buckets):
+        if seconds <= bucket:
+            return bucket
+    return None
+
+
+def _bucket_model(model: Any, n_ctx: int) -> Any:
+    """Bản sao nông (dùng chung weight) với dims.n_audio_ctx = n_ctx, cache theo (model, n_ctx)."""
+    key = (id(model), n_ctx)
+    with _bucket_lock:
+        fast = _bucket_models.get(key)
+        if fast is None:
+            fast = copy.copy(model)
+            fast.dims = dataclasses.replace(model.dims, n_audio_ctx=n_ctx)
+            _bucket_models[key] = fast
+        return fast
+
+
+def encode_truncated(model: Any, mel) -> Any:
+    """Forward của AudioEncoder nhưng không bắt buộc đủ 1500 vị trí (cắt positional_embedding)."""
+    import torch.nn.functional as F
+    encoder = model.encoder
+    x = F.gelu(encoder.conv1(mel))
+    x = F.gelu(encoder.conv2(x))
+    x = x.permute(0, 2, 1)
+    x = (x + encoder.positional_embedding[:x.shape[1]]).to(x.dtype)
+    for block in encoder.blocks:
+        x = block(x)
+    return encoder.ln_post(x)
+
+
+def transcribe_short(model: Any, audio: np.ndarray, language: str = "vi", fp16: bool = False,
+                     buckets: Sequence[float] = ASR_FASTPATH_BUCKETS_S, **decode_options: Any) -> Optional[Dict[str, Any]]:
+    """
+    Nhận dạng clip ngắn bằng encoder độ dài động. Trả về dict cùng dạng model.transcribe
+    ({"text", "segments": [{"avg_logprob", "no_speech_prob"}], "language", "bucket_s"}),
+    hoặc None nếu không áp dụng được (clip dài / model không phải openai-whisper).
+    decode_options: thêm vào whisper.DecodingOptions (ví dụ temperature, sample_len).
+    """
+    if not supports_fastpath(model):
+        return None
+    bucket = pick_bucket(len(audio), buckets)
+    if bucket is None:
+        return None
+    import torch
+    import whisper
+
+    n_samples = int(bucket * SAMPLE_RATE)
+    n_frames = int(bucket * _MEL_FRAMES_PER_SECOND)
+    padded = np.zeros(n_samples, dtype=np.float32)
+    padded[:len(audio)] = audio
+    device = next(model.parameters()).device
+    mel = whisper.log_mel_spectrogram(torch.from_numpy(padded), model.dims.n_mels, device=device)[:, :n_frames]
+    mel = mel.unsqueeze(0).to(torch.float16 if fp16 else torch.float32)
+
+    with torch.no_grad():
+        features = encode_truncated(model, mel)
+        fast_model = _bucket_model(model, features.shape[1])
+        options = whisper.DecodingOptions(language=language, without_timestamps=True, fp16=fp16, **decode_options)
+        result = whisper.decode(fast_model, features, options)[0]
+    return {
+        "text": result.text,
+        "segments": [{"avg_logprob": result.avg_logprob, "no_speech_prob": result.no_speech_prob,
+                      "compression_ratio": result.compression_ratio}],
+        "language": result.language,
+        "bucket_s": bucket,
+    }
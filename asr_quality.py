@@ -0,0 +1,117 @@
+# asr_quality.py
+"""
+Giảm chất lượng ASR theo tải: khi server bão hòa (queue executor dài hoặc ASR chậm), chuyển dần sang
+tầng rẻ hơn (decode greedy, model nhỏ, cắt audio ngắn hơn) thay vì để mọi cuộc gọi cùng timeout;
+tải giảm thì lên lại từng tầng. Có hysteresis (ngưỡng xuống/lên khác nhau) và thời gian giữ tầng tối thiểu.
+"""
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from logging_layer import get_logger
+from metrics_layer import (
+    ASR_QUALITY_TIER, ASR_QUALITY_TIER_CHANGES, executor_queue_depths, model_pool_backlog, recent_stage_quantile
+)
+
+# --- SAFE IMPORT CONFIG ---
+try:
+    from config_db import (
+        ASR_QUALITY_ADAPTIVE, ASR_QUALITY_TIERS, ASR_QUALITY_LATENCY_TARGET_S, ASR_QUALITY_LATENCY_SAMPLES,
+        ASR_QUALITY_STEP_DOWN_LOAD, ASR_QUALITY_STEP_UP_LOAD, ASR_QUALITY_MIN_DWELL_S, MAX_EXECUTOR_QUEUE_DEPTH
+    )
+except ImportError:
+    ASR_QUALITY_ADAPTIVE = False
+    ASR_QUALITY_TIERS = ({"name": "full", "model": None, "decode": {}, "max_audio_s": None},)
+    ASR_QUALITY_LATENCY_TARGET_S = 1.5
+    ASR_QUALITY_LATENCY_SAMPLES = 20
+    ASR_QUALITY_STEP_DOWN_LOAD = 1.0
+    ASR_QUALITY_STEP_UP_LOAD = 0.5
+    ASR_QUALITY_MIN_DWELL_S = 15.0
+    MAX_EXECUTOR_QUEUE_DEPTH = 8
+
+
+@dataclass(frozen=True)
+class QualityTier:
+    name: str
+    model: Optional[str] = None          # None: model mặc định của ASRServiceWhisper (+ cascade)
+    decode: Dict[str, Any] = field(default_factory=dict)
+    max_audio_s: Optional[float] = None
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "QualityTier":
+        return cls(name=config["name"], model=config.get("model"), decode=dict(config.get("decode") or {}),
+                   max_audio_s=config.get("max_audio_s"))
+
+
+def current_load() -> float:
+    """
+    Tải chuẩn hóa (1.0 = chạm giới hạn): max của độ sâu queue (executor + lượt ASR đang chờ model)
+    so với MAX_EXECUTOR_QUEUE_DEPTH và p95 latency ASR gần nhất so với latency mục tiêu.
+    """
+    queue = max(executor_queue_depths().values(), default=0) + model_pool_backlog("whisper:")
+    load = queue / max(1, MAX_EXECUTOR_QUEUE_DEPTH)
+    asr_p95 = recent_stage_quantile("asr", 0.95, ASR_QUALITY_LATENCY_SAMPLES)
+    if asr_p95 is not None and ASR_QUALITY_LATENCY_TARGET_S > 0:
+        load = max(load, asr_p95 / ASR_QUALITY_LATENCY_TARGET_S)
+    return load
+
+
+class AdaptiveQualityController:
+    """
+    Chọn tầng chất lượng ASR cho lượt kế tiếp. Đánh giá lười mỗi lần current() được gọi:
+    tải >= step_down_load -> xuống một tầng; tải <= step_up_load -> lên một tầng;
+    giữa hai ngưỡng giữ nguyên. Mỗi lần đổi tầng phải cách lần trước ít nhất min_dwell_s.
+    """
+
+    def __init__(self, tiers: Sequence[Dict[str, Any]] = ASR_QUALITY_TIERS, enabled: bool = ASR_QUALITY_ADAPTIVE,
+                 step_down_load: float = ASR_QUALITY_STEP_DOWN_LOAD, step_up_load: float = ASR_QUALITY_STEP_UP_LOAD,
+                 min_dwell_s: float = ASR_QUALITY_MIN_DWELL_S, load_fn: Callable[[], float] = current_load,
+                 log_callback: Optional[Callable] = None):
+        self.tiers: List[QualityTier] = [QualityTier.from_config(t) for t in tiers] or [QualityTier("full")]
+        self.enabled = enabled
+        self.step_down_load = step_down_load
+        self.step_up_load = step_up_load
+        self.min_dwell_s = min_dwell_s
+        self._load_fn = load_fn
+        self._log = get_logger("asr.quality", log_callback)
+        self._lock = threading.Lock()
+        self._index = 0
+        self._changed_at = float("-inf")
+        self.last_load = 0.0
+        ASR_QUALITY_TIER.set(0)
+
+    @property
+    def index(self) -> int:
+        return self._index
+
+    def current(self) -> QualityTier:
+        """Tầng chất lượng cho lượt ASR sắp chạy (cập nhật theo tải hiện tại)."""
+        if not self.enabled or len(self.tiers) == 1:
+            return self.tiers[0]
+        load = self._load_fn()
+        now = time.monotonic()
+        with self._lock:
+            self.last_load = load
+            if now - self._changed_at >= self.min_dwell_s:
+                if load >= self.step_down_load and self._index < len(self.tiers) - 1:
+                    self._set(self._index + 1, "down", load, now)
+                elif load <= self.step_up_load and self._index > 0:
+                    self._set(self._index - 1, "up", load, now)
+            return self.tiers[self._index]
+
+    def _set(self, index: int, direction: str, load: float, now: float):
+        previous = self.tiers[self._index].name
+        self._index, self._changed_at = index, now
+        ASR_QUALITY_TIER.set(index)
+        ASR_QUALITY_TIER_CHANGES.labels(direction).inc()
+        self._log.warning("%s [ASR] Tải %.2f: đổi tầng chất lượng %s -> %s.",
+                          "📉" if direction == "down" else "📈", load, previous, self.tiers[index].name)
+
+    def status(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "tier": self.tiers[self._index].name, "index": self._index,
+                "load": round(self.last_load, 3)}
+
+
+# Controller dùng chung cho cả process (mọi session)
+controller = AdaptiveQualityController()
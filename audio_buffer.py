@@ -0,0 +1,150 @@
+# audio_buffer.py
+import threading
+import weakref
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+from logging_layer import get_logger
+from metrics_layer import AUDIO_BUFFER_BYTES, AUDIO_BUFFER_OVERFLOW_SAMPLES
+
+# --- SAFE IMPORT CONFIG ---
+try:
+    from config_db import SAMPLE_RATE, MAX_UTTERANCE_SECONDS, AUDIO_BUFFER_BUDGET_MB
+except ImportError:
+    SAMPLE_RATE = 16000
+    MAX_UTTERANCE_SECONDS = 30.0
+    AUDIO_BUFFER_BUDGET_MB = 256
+
+_log = get_logger("audio.buffer")
+
+
+class AudioBufferBudgetExceeded(MemoryError):
+    """Tổng bộ nhớ buffer audio của process vượt AUDIO_BUFFER_BUDGET_MB."""
+
+
+# ==================== KẾ TOÁN BỘ NHỚ THEO SESSION ====================
+_usage_lock = threading.Lock()
+_usage_by_session: Dict[str, int] = {}
+_total_bytes = 0
+
+
+def _reserve(owner: str, nbytes: int):
+    global _total_bytes
+    with _usage_lock:
+        budget = int(AUDIO_BUFFER_BUDGET_MB * 1024 * 1024)
+        if _total_bytes + nbytes > budget:
+            raise AudioBufferBudgetExceeded(
+                f"Buffer audio {owner}: cần {nbytes} bytes, đã dùng {_total_bytes}/{budget} bytes."
+            )
+        _usage_by_session[owner] = _usage_by_session.get(owner, 0) + nbytes
+        _total_bytes += nbytes
+        AUDIO_BUFFER_BYTES.set(_total_bytes)
+
+
+def _release(owner: str, nbytes: int):
+    global _total_bytes
+    with _usage_lock:
+        remaining = _usage_by_session.get(owner, 0) - nbytes
+        if remaining > 0:
+            _usage_by_session[owner] = remaining
+        else:
+            _usage_by_session.pop(owner, None)
+        _total_bytes = max(0, _total_bytes - nbytes)
+        AUDIO_BUFFER_BYTES.set(_total_bytes)
+
+
+def memory_usage() -> Dict[str, object]:
+    """Bộ nhớ buffer audio đang cấp phát: tổng và theo session."""
+    with _usage_lock:
+        return {"total_bytes": _total_bytes, "budget_bytes": int(AUDIO_BUFFER_BUDGET_MB * 1024 * 1024),
+                "by_session": dict(_usage_by_session)}
+
+
+# ==================== RING BUFFER ====================
+class AudioRingBuffer:
+    """
+    Buffer PCM int16 cấp phát trước (max_seconds), dùng chung cho recorder WebRTC và mic PyAudio; cấp phát
+    một lần và dùng lại mỗi lượt (clear()).
+    Khi đầy, phần audio mới KHÔNG được ghi (giữ đầu câu nói) và được đếm vào overflow: write() trả về số mẫu
+    bị bỏ, is_full báo cho người gọi kết thúc lượt (giao phần đã ghi cho ASR) thay vì ghi tiếp.
+    segments() trả về view (không copy) theo thứ tự thời gian cho VAD/ASR/ghi WAV.
+    """
+
+    def __init__(self, max_seconds: float = MAX_UTTERANCE_SECONDS, sample_rate: int = SAMPLE_RATE,
+                 channels: int = 1, owner: str = "anonymous"):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.owner = owner
+        self.capacity = int(max_seconds * sample_rate) * channels
+        self.nbytes = self.capacity * np.dtype(np.int16).itemsize
+        _reserve(owner, self.nbytes)
+        # Trả lại quota khi buffer bị thu gom (kể cả khi quên gọi release())
+        self._finalizer = weakref.finalize(self, _release, owner, self.nbytes)
+        self._data = np.zeros(self.capacity, dtype=np.int16)
+        self._size = 0
+        self.overflow_samples = 0
+
+    # ---------- ghi ----------
+    def write(self, samples: Union[np.ndarray, bytes, bytearray, memoryview]) -> int:
+        """Ghi PCM int16 (ndarray hoặc bytes). Trả về số mẫu bị bỏ do buffer đầy (phần cuối của block)."""
+        if not isinstance(samples, np.ndarray):
+            samples = np.frombuffer(samples, dtype=np.int16)
+        n = len(samples)
+        if n == 0:
+            return 0
+        stored = min(n, self.capacity - self._size)
+        self._data[self._size:self._size + stored] = samples[:stored]
+        self._size += stored
+        dropped = n - stored
+        if dropped:
+            if not self.overflow_samples:
+                _log.warning("⚠️ [AudioBuffer] %s vượt giới hạn %.1fs, không ghi thêm audio của lượt này.",
+                             self.owner, self.max_seconds)
+            self.overflow_samples += dropped
+            AUDIO_BUFFER_OVERFLOW_SAMPLES.inc(dropped)
+        return dropped
+
+    def clear(self):
+        """Xóa nội dung để dùng lại cho lượt mới (không cấp phát lại)."""
+        self._size = 0
+        self.overflow_samples = 0
+
+    # ---------- đọc ----------
+    @property
+    def max_seconds(self) -> float:
+        return self.capacity / (self.sample_rate * self.channels)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def duration_seconds(self) -> float:
+        return self._size / (self.sample_rate * self.channels)
+
+    @property
+    def is_full(self) -> bool:
+        return self._size >= self.capacity
+
+    def __len__(self) -> int:
+        return self._size
+
+    def segments(self) -> List[np.ndarray]:
+        """View (không copy) theo thứ tự thời gian (rỗng nếu chưa ghi gì)."""
+        return [self._data[:self._size]] if self._size else []
+
+    def array(self) -> np.ndarray:
+        """Toàn bộ nội dung liền mạch (view, không copy)."""
+        return self._data[:self._size]
+
+    def as_float32(self) -> np.ndarray:
+        """float32 [-1, 1] cho VAD/ASR."""
+        return self.array().astype(np.float32) / 32768.0
+
+    # ---------- giải phóng ----------
+    def release(self):
+        """Trả quota bộ nhớ (buffer không dùng được nữa sau khi gọi)."""
+        self._finalizer()
+        self._data = np.zeros(0, dtype=np.int16)
+        self.capacity = self._size = 0
@@ -0,0 +1,319 @@
+# audio_frontend.py
+import math
+import wave
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+# --- SAFE IMPORT CONFIG ---
+try:
+    from config_db import SAMPLE_RATE
+except ImportError:
+    SAMPLE_RATE = 16000
+
+try:
+    from config_db import (
+        PREGATE_ENABLED, PREGATE_FRAME_MS, PREGATE_ENERGY_FLOOR_DB, PREGATE_LOUD_MARGIN_DB,
+        PREGATE_ZCR_MAX, PREGATE_HANGOVER_MS
+    )
+except ImportError:
+    PREGATE_ENABLED = False
+    PREGATE_FRAME_MS = 30
+    PREGATE_ENERGY_FLOOR_DB = -50.0
+    PREGATE_LOUD_MARGIN_DB = 15.0
+    PREGATE_ZCR_MAX = 0.25
+    PREGATE_HANGOVER_MS = 200
+
+try:
+    from config_db import ENDPOINT_SPEECH_DB, ENDPOINT_MIN_SPEECH_MS, ENDPOINT_SILENCE_MS
+except ImportError:
+    ENDPOINT_SPEECH_DB = -45.0
+    ENDPOINT_MIN_SPEECH_MS = 200
+    ENDPOINT_SILENCE_MS = 700
+
+_INT16_SCALE = 32768.0
+
+
+# ==================== CHUYỂN ĐỔI FRAME ====================
+def frame_to_mono(frame) -> Tuple[np.ndarray, int]:
+    """
+    av.AudioFrame (aiortc) -> (float32 mono [-1, 1], sample_rate thật của frame).
+    Hỗ trợ định dạng packed (interleaved, shape (1, n*ch)) và planar (shape (ch, n)); s16/s32/flt/dbl.
+    """
+    data = frame.to_ndarray()
+    channels = len(frame.layout.channels)
+    if frame.format.is_planar:
+        data = data.reshape(channels, -1)
+    else:
+        data = data.reshape(-1, channels).T
+    if data.dtype == np.int16:
+        samples = data.astype(np.float32) / _INT16_SCALE
+    elif data.dtype == np.int32:
+        samples = data.astype(np.float32) / 2147483648.0
+    else:
+        samples = data.astype(np.float32, copy=False)
+    # Downmix: trung bình các kênh
+    mono = samples[0] if channels == 1 else samples.mean(axis=0)
+    return mono, frame.sample_rate
+
+
+def to_int16(samples: np.ndarray) -> np.ndarray:
+    """float32 [-1, 1] -> int16 (có clip)."""
+    return np.clip(samples * _INT16_SCALE, -32768, 32767).astype(np.int16)
+
+
+# ==================== RESAMPLER ====================
+class PolyphaseResampler:
+    """
+    Resampler hữu tỉ L/M dạng polyphase (FIR windowed-sinc, cửa sổ Kaiser), giữ trạng thái giữa các frame:
+    ghép nhiều frame liên tiếp cho kết quả giống resample cả tín hiệu một lần (không có tiếng 'click' ở biên).
+    Tính toán vector hóa bằng NumPy (gather + nhân ma trận), không cần scipy/ffmpeg.
+    """
+
+    def __init__(self, in_rate: int, out_rate: int, taps_per_phase: int = 24, rolloff: float = 0.92, beta: float = 8.0):
+        g = math.gcd(in_rate, out_rate)
+        self.in_rate, self.out_rate = in_rate, out_rate
+        self.up, self.down = out_rate // g, in_rate // g
+        self.taps = taps_per_phase
+        # FIR thông thấp ở tần số đã upsample (in_rate * up), cắt tại Nyquist của rate thấp hơn
+        n = self.up * taps_per_phase
+        cutoff = rolloff * 0.5 / max(self.up, self.down)
+        t = np.arange(n) - (n - 1) / 2.0
+        h = 2 * cutoff * np.sinc(2 * cutoff * t) * np.kaiser(n, beta)
+        h *= self.up / h.sum()
+        # H[p, j] = h[p + j*up]; đảo chiều theo j để nhân trực tiếp với cửa sổ input tăng dần
+        self._phases = h.reshape(taps_per_phase, self.up).T[:, ::-1].astype(np.float32)
+        self.reset()
+
+    def reset(self):
+        self._history = np.zeros(self.taps - 1, dtype=np.float32)
+        self._in_count = 0   # tổng số mẫu input đã nhận
+        self._out_count = 0  # tổng số mẫu output đã tạo
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """Resample một block mono float32; trả về các mẫu output đã đủ dữ liệu input."""
+        if self.up == self.down:
+            return samples.astype(np.float32, copy=False)
+        buffer = np.concatenate((self._history, samples.astype(np.float32, copy=False)))
+        last_input = self._in_count + len(samples) - 1
+        # Output n cần input tới chỉ số floor(n * down / up) <= last_input
+        n_end = (last_input * self.up + self.up - 1) // self.down + 1
+        if n_end > self._out_count:
+            n = np.arange(self._out_count, n_end, dtype=np.int64)
+            base = (n * self.down) // self.up
+            phase = (n * self.down) % self.up
+            # Cửa sổ input [base - taps + 1, base] theo chỉ số trong buffer
+            start = base - self._in_count
+            idx = start[:, None] + np.arange(self.taps)[None, :]
+            out = np.einsum("ij,ij->i", buffer[idx], self._phases[phase])
+            self._out_count = int(n_end)
+        else:
+            out = np.zeros(0, dtype=np.float32)
+        self._in_count += len(samples)
+        self._history = buffer[len(buffer) - (self.taps - 1):]
+        return out.astype(np.float32, copy=False)
+
+    def flush(self) -> np.ndarray:
+        """Đẩy nốt phần đuôi bị trễ bởi bộ lọc (nửa chiều dài FIR) ở cuối luồng."""
+        return self.process(np.zeros(self.taps // 2, dtype=np.float32))
+
+
+def resample(samples: np.ndarray, in_rate: int, out_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Resample một lần cả tín hiệu (không giữ trạng thái)."""
+    if in_rate == out_rate:
+        return samples.astype(np.float32, copy=False)
+    resampler = PolyphaseResampler(in_rate, out_rate)
+    return np.concatenate((resampler.process(samples), resampler.flush()))
+
+
+# ==================== FRONT-END THEO SESSION ====================
+class AudioFrontEnd:
+    """
+    Stage đầu vào cho audio WebRTC: đọc rate/layout thật của từng frame, downmix về mono
+    và resample về target_rate (16kHz) với trạng thái liên tục giữa các frame.
+    """
+
+    def __init__(self, target_rate: int = SAMPLE_RATE):
+        self.target_rate = target_rate
+        self._resampler: Optional[PolyphaseResampler] = None
+        self.input_rate: Optional[int] = None
+        self.input_channels: Optional[int] = None
+
+    def process_frame(self, frame) -> np.ndarray:
+        """av.AudioFrame -> int16 mono ở target_rate."""
+        mono, rate = frame_to_mono(frame)
+        self.input_channels = len(frame.layout.channels)
+        if rate != self.input_rate:
+            # Rate đổi giữa chừng (hiếm): tạo resampler mới
+            self.input_rate = rate
+            self._resampler = PolyphaseResampler(rate, self.target_rate)
+        return to_int16(self._resampler.process(mono))
+
+    def flush(self) -> np.ndarray:
+        if self._resampler is None:
+            return np.zeros(0, dtype=np.int16)
+        return to_int16(self._resampler.flush())
+
+    def reset(self):
+        """Bắt đầu đoạn audio mới (xóa trạng thái bộ lọc), ví dụ giữa hai lượt nói."""
+        if self._resampler is not None:
+            self._resampler.reset()
+
+
+# ==================== PRE-GATE NĂNG LƯỢNG ====================
+@dataclass
+class GateStats:
+    total_frames: int
+    passed_frames: int
+
+    @property
+    def gated_frames(self) -> int:
+        return self.total_frames - self.passed_frames
+
+    @property
+    def is_silent(self) -> bool:
+        """Cả lượt nói dưới noise floor: bỏ qua VAD/ASR."""
+        return self.passed_frames == 0
+
+
+def energy_gate(audio: np.ndarray, sample_rate: int = SAMPLE_RATE, frame_ms: int = PREGATE_FRAME_MS,
+                floor_db: float = PREGATE_ENERGY_FLOOR_DB, loud_margin_db: float = PREGATE_LOUD_MARGIN_DB,
+                zcr_max: float = PREGATE_ZCR_MAX, hangover_ms: int = PREGATE_HANGOVER_MS) -> Tuple[np.ndarray, GateStats]:
+    """
+    Lọc thô trước Silero (vector hóa, O(n)): chia audio float32 thành frame frame_ms, tính RMS (dBFS)
+    và tỉ lệ zero-crossing. Frame được giữ khi đủ năng lượng, và hoặc ZCR thấp (âm hữu thanh),
+    hoặc to hơn floor_db + loud_margin_db (phụ âm xát). Giữ thêm hangover_ms quanh frame được giữ
+    để không cắt mất đầu/cuối từ. Trả về (audio đã lọc, thống kê).
+    """
+    frame_len = max(1, sample_rate * frame_ms // 1000)
+    total = len(audio) // frame_len
+    if total == 0:
+        return audio[:0], GateStats(0, 0)
+    frames = audio[:total * frame_len].reshape(total, frame_len)
+    rms_db = 10.0 * np.log10(np.einsum("ij,ij->i", frames, frames) / frame_len + 1e-12)
+    sign = np.signbit(frames)
+    zcr = np.count_nonzero(sign[:, 1:] != sign[:, :-1], axis=1) / frame_len
+    keep = (rms_db >= floor_db) & ((zcr <= zcr_max) | (rms_db >= floor_db + loud_margin_db))
+    hangover = hangover_ms // frame_ms
+    if hangover and keep.any():
+        keep = np.convolve(keep, np.ones(2 * hangover + 1, dtype=bool), mode="same") > 0
+    passed = int(np.count_nonzero(keep))
+    if passed == total:
+        return audio, GateStats(total, passed)
+    return frames[keep].reshape(-1), GateStats(total, passed)
+
+
+# ==================== ENDPOINTING (TÁCH LƯỢT PHÍA SERVER) ====================
+class Endpointer:
+    """
+    Phát hiện đầu/cuối lượt nói trên luồng PCM int16 theo năng lượng từng block (frame WebRTC ~20ms).
+    process() trả về "start" khi có tiếng nói liên tục >= min_speech_ms, "end" khi im lặng
+    liên tục >= silence_ms sau đó, ngược lại None.
+    """
+
+    def __init__(self, sample_rate: int = SAMPLE_RATE, speech_db: float = ENDPOINT_SPEECH_DB,
+                 min_speech_ms: int = ENDPOINT_MIN_SPEECH_MS, silence_ms: int = ENDPOINT_SILENCE_MS):
+        self.sample_rate = sample_rate
+        self.speech_db = speech_db
+        self.min_speech_ms = min_speech_ms
+        self.silence_ms = silence_ms
+        self.reset()
+
+    def reset(self):
+        self.in_speech = False
+        self._speech_ms = 0.0
+        self._silence_ms = 0.0
+
+    def mark_speech(self):
+        """Lượt được mở từ bên ngoài khi đã có tiếng nói (barge-in): chỉ còn chờ "end"."""
+        self.reset()
+        self.in_speech = True
+
+    def process(self, samples: np.ndarray) -> Optional[str]:
+        if not len(samples):
+            return None
+        block_ms = 1000.0 * len(samples) / self.sample_rate
+        audio = samples.astype(np.float32) / _INT16_SCALE
+        is_speech = 10.0 * math.log10(float(np.dot(audio, audio)) / len(audio) + 1e-12) >= self.speech_db
+        if not self.in_speech:
+            self._speech_ms = self._speech_ms + block_ms if is_speech else 0.0
+            if self._speech_ms >= self.min_speech_ms:
+                self.in_speech, self._silence_ms = True, 0.0
+                return "start"
+            return None
+        self._silence_ms = 0.0 if is_speech else self._silence_ms + block_ms
+        if self._silence_ms >= self.silence_ms:
+            self.reset()
+            return "end"
+        return None
+
+
+# ==================== CLIP TTS: CẮT LẶNG, FADE, NỐI ====================
+def trim_silence(samples: np.ndarray, sample_rate: int = SAMPLE_RATE, threshold_db: float = -40.0,
+                 frame_ms: int = 10) -> np.ndarray:
+    """Cắt các frame frame_ms dưới threshold_db (dBFS) ở hai đầu clip float32; clip toàn lặng giữ nguyên."""
+    frame_len = max(1, sample_rate * frame_ms // 1000)
+    total = len(samples) // frame_len
+    if total == 0:
+        return samples
+    frames = samples[:total * frame_len].reshape(total, frame_len)
+    rms_db = 10.0 * np.log10(np.einsum("ij,ij->i", frames, frames) / frame_len + 1e-12)
+    voiced = np.flatnonzero(rms_db > threshold_db)
+    if len(voiced) == 0:
+        return samples
+    return samples[voiced[0] * frame_len:(voiced[-1] + 1) * frame_len]
+
+
+def fade_edges(samples: np.ndarray, fade_len: int) -> np.ndarray:
+    """Fade-in/fade-out tuyến tính fade_len mẫu ở hai đầu (trả về bản sao float32)."""
+    out = samples.astype(np.float32, copy=True)
+    fade_len = min(fade_len, len(out) // 2)
+    if fade_len > 0:
+        ramp = np.linspace(0.0, 1.0, fade_len, dtype=np.float32)
+        out[:fade_len] *= ramp
+        out[-fade_len:] *= ramp[::-1]
+    return out
+
+
+def crossfade_concat(clips: Sequence[np.ndarray], gaps: Sequence[int], crossfade_len: int) -> np.ndarray:
+    """
+    Nối các clip float32. gaps[i]: số mẫu lặng chèn trước clip i (i > 0); 0 -> chồng crossfade_len mẫu
+    (cuối clip trước fade-out, đầu clip sau fade-in, cộng dồn) để không có tiếng "tách" ở mối nối.
+    """
+    if not clips:
+        return np.zeros(0, dtype=np.float32)
+    out = np.asarray(clips[0], dtype=np.float32)
+    for clip, gap in zip(clips[1:], gaps[1:]):
+        clip = np.asarray(clip, dtype=np.float32)
+        overlap = min(crossfade_len, len(out), len(clip)) if gap <= 0 else 0
+        if overlap:
+            ramp = np.linspace(0.0, 1.0, overlap, dtype=np.float32)
+            joint = out[-overlap:] * ramp[::-1] + clip[:overlap] * ramp
+            out = np.concatenate([out[:-overlap], joint, clip[overlap:]])
+        else:
+            out = np.concatenate([out, np.zeros(max(0, gap), dtype=np.float32), clip])
+    return out
+
+
+# ==================== ĐỌC FILE ====================
+def load_audio(audio_filepath: Path, target_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    Đọc file audio thành float32 mono ở target_rate.
+    WAV PCM16 (bản ghi của AudioFileRecorder) đọc trực tiếp bằng NumPy, không qua ffmpeg;
+    định dạng khác mới dùng whisper.load_audio (ffmpeg).
+    """
+    try:
+        with wave.open(str(audio_filepath), "rb") as wf:
+            if wf.getsampwidth() != 2:
+                raise wave.Error("chỉ hỗ trợ PCM16")
+            channels, rate = wf.getnchannels(), wf.getframerate()
+            pcm = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+    except (wave.Error, EOFError):
+        import whisper
+        return whisper.load_audio(str(audio_filepath), sr=target_rate)
+    samples = pcm.astype(np.float32) / _INT16_SCALE
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return resample(samples, rate, target_rate)
@@ -3,20 +3,42 @@ import asyncio
 import os
 import json
 import uuid
+import time
 import wave
 import numpy as np
-from typing import Dict, Any, Optional, Callable
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Any, Optional, Callable, List, Tuple
 from pathlib import Path
 import traceback 
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 from aiortc import RTCPeerConnection, RTCSessionDescription, RTCDataChannel, MediaStreamTrack, RTCConfiguration, RTCIceServer
 from aiortc.exceptions import InvalidStateError
+from aiortc.sdp import candidate_from_sdp
 import base64 # 🚨 Bổ sung: Import base64
+from logging_layer import get_logger
+from metrics_layer import (
+    observe_recording, start_metrics_server, metrics_asgi_app, BARGE_INS,
+    active_session_count, executor_queue_depths, recent_stage_latencies
+)
+from tracing_layer import TurnTrace, begin_turn, end_turn, activate, span
+from model_registry import registry as model_registry, MODEL_WARMUP_ON_START
+from audio_frontend import AudioFrontEnd, Endpointer
+from asr_quality import controller as asr_quality_controller
+from audio_buffer import AudioRingBuffer, AudioBufferBudgetExceeded, memory_usage as audio_buffer_memory
+from connection_manager import manager as connections
+from admission_control import controller as admission
+from turn_scheduler import scheduler as turn_scheduler
+import filler_audio
+import tts_splicer
+import cancellation
+from cancellation import CancelToken
 
 # --- Import RTCStreamProcessor ---
 try:
-    from rtc_integration_layer import RTCStreamProcessor, SAMPLE_RATE, INTERNAL_API_KEY 
+    from rtc_integration_layer import RTCStreamProcessor, SAMPLE_RATE, INTERNAL_API_KEY, GTTS_IS_READY
 except ImportError:
     class RTCStreamProcessor:
         def __init__(self, *args, **kwargs): pass
@@ -24,29 +46,65 @@ except ImportError:
             yield (False, {"user_text": "LỖI: RTCStreamProcessor không import được.", "bot_text": "Lỗi hệ thống nội bộ."})
     SAMPLE_RATE = 16000
     INTERNAL_API_KEY = "MOCK_INTERNAL_KEY" 
+    GTTS_IS_READY = False
+
+try:
+    from config_db import MAX_ACTIVE_SESSIONS, MAX_EXECUTOR_QUEUE_DEPTH
+except ImportError:
+    MAX_ACTIVE_SESSIONS = 20
+    MAX_EXECUTOR_QUEUE_DEPTH = 8
+
+try:
+    from config_db import (WEBRTC_ICE_SERVERS, WEBRTC_LAN_MODE, WEBRTC_MAX_PENDING_CANDIDATES,
+                           WEBRTC_PENDING_CANDIDATE_TTL_S, WEBRTC_MAX_PENDING_SESSIONS)
+except ImportError:
+    WEBRTC_ICE_SERVERS = [{"urls": "stun:stun.l.google.com:19302"}]
+    WEBRTC_LAN_MODE = False
+    WEBRTC_MAX_PENDING_CANDIDATES = 32
+    WEBRTC_PENDING_CANDIDATE_TTL_S = 30.0
+    WEBRTC_MAX_PENDING_SESSIONS = 256
+
+try:
+    from config_db import TURN_SEGMENTATION, ENDPOINT_PREROLL_MS
+except ImportError:
+    TURN_SEGMENTATION = "client"
+    ENDPOINT_PREROLL_MS = 300
+
+try:
+    from config_db import BARGE_IN_ENABLED, BARGE_IN_SPEECH_DB, BARGE_IN_MIN_SPEECH_MS, BARGE_IN_PLAYBACK_MARGIN_S
+except ImportError:
+    BARGE_IN_ENABLED = False
+    BARGE_IN_SPEECH_DB = -35.0
+    BARGE_IN_MIN_SPEECH_MS = 300
+    BARGE_IN_PLAYBACK_MARGIN_S = 1.0
+
+try:
+    from config_db import SPECULATIVE_PREFETCH_ENABLED, SPECULATIVE_PARTIAL_INTERVAL_S, SPECULATIVE_PARTIAL_MIN_S
+except ImportError:
+    SPECULATIVE_PREFETCH_ENABLED = False
+    SPECULATIVE_PARTIAL_INTERVAL_S = 1.0
+    SPECULATIVE_PARTIAL_MIN_S = 1.0
 
 # --- Cấu hình ---
 CHANNELS = 1
 SAMPLE_WIDTH = 2
 os.makedirs("temp", exist_ok=True)
-ICE_SERVERS = [{"urls": "stun:stun.l.google.com:19302"}]
-processing_tasks: Dict[str, asyncio.Task] = {}
+# LAN mode: không có STUN/TURN -> aiortc chỉ gom host candidate, setLocalDescription gần như tức thì
+ICE_SERVERS = [] if WEBRTC_LAN_MODE else WEBRTC_ICE_SERVERS
+# Trickle ICE (chiều vào): candidate của client gửi qua /candidate hoặc /ws.
+# session_id -> (thời điểm mở, candidate chờ); thứ tự chèn = cũ nhất trước (TTL + evict)
+_pending_candidates: "OrderedDict[str, Tuple[float, List[Any]]]" = OrderedDict()
 
-def log_info(message: str, color="white"):
-    color_map = {
-        "red": "\033[91m", "green": "\033[92m", "yellow": "\033[93m", 
-        "blue": "\033[94m", "magenta": "\033[95m", "cyan": "\033[96m", "white": "\033[97m"
-    }
-    RESET = "\033[0m"
-    print(f"{color_map.get(color, RESET)}INFO:backend_webrtc_server:[{message}]{RESET}", flush=True)
+# Facade logging_layer: vẫn gọi được log_info(message, color) như trước
+log_info = get_logger("server")
 
 # 🚨 Hàm tiện ích để ghi file WAV (Áp dụng cho cả Input và Output audio)
-def _write_wav_file_safe_helper(file_path_str: str, chunks: list[bytes], wav_params_tuple: tuple):
+def _write_wav_file_safe_helper(file_path_str: str, chunks: list, wav_params_tuple: tuple):
     with wave.open(file_path_str, 'wb') as wf:
         wf.setparams(wav_params_tuple)
         for chunk in chunks:
             wf.writeframes(chunk)
-    log_info(f"[WAV Writer] ✅ Hoàn tất ghi file: {file_path_str}")
+    log_info.debug("[WAV Writer] ✅ Hoàn tất ghi file: %s", file_path_str)
     
 # 🚨 Lấy thông số WAV từ một nơi chung (được sử dụng trong _process_audio_and_respond)
 WAV_PARAMS = (CHANNELS, SAMPLE_WIDTH, SAMPLE_RATE, 0, 'NONE', 'not compressed')
@@ -56,77 +114,242 @@ WAV_PARAMS = (CHANNELS, SAMPLE_WIDTH, SAMPLE_RATE, 0, 'NONE', 'not compressed')
 # GHI ÂM AUDIO TỪ TRACK
 # ======================================================
 class AudioFileRecorder:
-    def __init__(self, pc):
+    """
+    Ghi âm nhiều lượt trên cùng một track: task đọc track chạy suốt cuộc gọi, audio chỉ được ghi vào
+    ring buffer khi đang trong lượt. Lượt mở bằng begin_turn() (tin nhắn client) hoặc tự động khi
+    endpointer phát hiện tiếng nói (sau arm()); đóng bằng stop() hoặc khi endpointer báo hết câu.
+    Mỗi lượt kết thúc ghi một file WAV và gọi callback "stop" (đường dẫn file hoặc None).
+    Barge-in: watch_barge_in() theo dõi tiếng nói người gọi trong lúc bot trả lời (detector riêng, ngưỡng cao hơn);
+    phát hiện tiếng nói -> gọi callback, callback mở lượt mới thì audio pre-roll được đưa vào lượt đó.
+    """
+    def __init__(self, pc, session_id: str = "anonymous", endpointer: Optional[Endpointer] = None):
         self._pc = pc
+        self.session_id = session_id
+        self.endpointer = endpointer
         self._on_stop_callback: Optional[Callable] = None
         self._track: Optional[MediaStreamTrack] = None
         self._file_path: Optional[Path] = None
-        self._stop_event = asyncio.Event()
-        self._chunks: list[bytes] = []
+        # Ring buffer cấp phát trước (MAX_UTTERANCE_SECONDS), cấp phát 1 lần và dùng lại cho mọi lượt
+        self.buffer: Optional[AudioRingBuffer] = None
+        self._frontend = AudioFrontEnd(SAMPLE_RATE)
         self._record_task: Optional[asyncio.Task] = None 
-
-    def start(self, track: MediaStreamTrack, file_path: str):
+        self._finalize_task: Optional[asyncio.Task] = None
+        self._preroll: Deque[np.ndarray] = deque(maxlen=max(1, ENDPOINT_PREROLL_MS // 20))
+        self.listening = False      # đang ghi một lượt
+        self.armed = False          # chế độ VAD: chờ tiếng nói để tự mở lượt
+        self.watching = False       # bot đang trả lời: chờ người gọi nói chen (barge-in)
+        self._barge_in_detector: Optional[Endpointer] = None
+        self._on_barge_in: Optional[Callable[[], bool]] = None
+        self._barge_preroll: Deque[np.ndarray] = deque(maxlen=max(1, (ENDPOINT_PREROLL_MS + BARGE_IN_MIN_SPEECH_MS) // 20))
+        self.turn_index = 0
+        self.stop_requested_ns: Optional[int] = None
+
+    def start(self, track: MediaStreamTrack, file_path: Optional[str] = None):
+        """Bắt đầu đọc track (1 lần mỗi cuộc gọi) và mở lượt đầu tiên (hoặc chờ tiếng nói nếu dùng VAD)."""
         self._track = track
-        self._file_path = Path(file_path)
-        self._stop_event.clear()
-        self._chunks = []
-        self._record_task = asyncio.create_task(self._read_track_and_write()) 
-        log_info(f"[Recorder] Bắt đầu ghi âm: {self._file_path.name}")
-        
+        try:
+            if self.buffer is None:
+                self.buffer = AudioRingBuffer(owner=self.session_id)
+        except AudioBufferBudgetExceeded as e:
+            # Hết quota bộ nhớ: báo on_stop(None) ngay, không đọc track
+            log_info("[Recorder] ❌ Không cấp phát được buffer: %s", "red", e)
+            if self._on_stop_callback:
+                self._on_stop_callback(None)
+            return
+        # Downmix + resample 48kHz (Opus) -> 16kHz mono, giữ trạng thái bộ lọc suốt cuộc gọi
+        self._frontend = AudioFrontEnd(SAMPLE_RATE)
+        self._record_task = asyncio.create_task(self._read_track()) 
+        if self.endpointer is not None:
+            self.arm()
+        else:
+            self.begin_turn(file_path)
+
     def on(self, event: str, callback: Callable):
         if event == "stop": self._on_stop_callback = callback
 
     def _get_wav_params_tuple(self):
          return WAV_PARAMS
 
-    async def _read_track_and_write(self):
+    @property
+    def is_finalizing(self) -> bool:
+        return self._finalize_task is not None and not self._finalize_task.done()
+
+    def begin_turn(self, file_path: Optional[str] = None) -> bool:
+        """Mở lượt mới (dùng lại buffer). False nếu đang ghi, đang ghi file lượt trước hoặc không có buffer."""
+        if self.buffer is None or self.listening or self.is_finalizing:
+            return False
+        self.turn_index += 1
+        self._file_path = Path(file_path or os.path.join("temp", f"{self.session_id}_input_{self.turn_index}.wav"))
+        self.buffer.clear()
+        self.armed = False
+        self.stop_watching()
+        self.listening = True
+        log_info("[Recorder] Bắt đầu ghi âm lượt %s: %s", "white", self.turn_index, self._file_path.name)
+        return True
+
+    def arm(self):
+        """Chế độ VAD: chờ tiếng nói để tự mở lượt kế tiếp."""
+        if self.endpointer is None or self.buffer is None or self.listening:
+            return
+        self.endpointer.reset()
+        self._preroll.clear()
+        self.armed = True
+
+    def watch_barge_in(self, callback: Callable[[], bool]):
+        """Bot bắt đầu trả lời: theo dõi tiếng nói người gọi. callback() trả True nếu đã mở lượt mới."""
+        if self.buffer is None or self.listening:
+            return
+        if self._barge_in_detector is None:
+            self._barge_in_detector = Endpointer(SAMPLE_RATE, BARGE_IN_SPEECH_DB, BARGE_IN_MIN_SPEECH_MS)
+        self._barge_in_detector.reset()
+        self._barge_preroll.clear()
+        self._on_barge_in = callback
+        self.watching = True
+
+    def stop_watching(self):
+        self.watching = False
+        self._on_barge_in = None
+
+    def _barge_in(self):
+        callback = self._on_barge_in
+        self.stop_watching()
+        if callback is not None and callback() and self.listening:
+            # Lượt mới bắt đầu từ trước điểm phát hiện (không mất âm đầu câu)
+            for block in self._barge_preroll:
+                self.buffer.write(block)
+            if self.endpointer is not None:
+                self.endpointer.mark_speech()
+        self._barge_preroll.clear()
+
+    async def _read_track(self):
         try:
-            while not self._stop_event.is_set():
+            while self.buffer is not None:
                 try:
                     packet = await self._track.recv()
-                    audio_data_np = packet.to_ndarray() 
-                    if audio_data_np.dtype == np.float32:
-                        audio_data_np = (audio_data_np * 32767).astype(np.int16)
-                    elif audio_data_np.dtype != np.int16:
-                        audio_data_np = audio_data_np.astype(np.int16)
-                    self._chunks.append(audio_data_np.tobytes())
                 except InvalidStateError:
                     break
                 except Exception as e:
-                    if not self._stop_event.is_set():
-                        log_info(f"[Recorder] Lỗi khi nhận audio packet: {e}", "red")
+                    if self.listening:
+                        log_info("[Recorder] Lỗi khi nhận audio packet: %s", "red", e)
                     break
+                if not (self.listening or self.armed or self.watching):
+                    continue  # giữa các lượt: vẫn đọc track để không dồn packet, bỏ audio
+                samples = self._frontend.process_frame(packet)
+                if self.watching:
+                    self._barge_preroll.append(samples)
+                    if self._barge_in_detector.process(samples) == "start":
+                        self._barge_in()
+                    continue
+                event = self.endpointer.process(samples) if self.endpointer is not None else None
+                if self.armed:
+                    self._preroll.append(samples)
+                    if event == "start" and self.begin_turn():
+                        for block in self._preroll:
+                            self.buffer.write(block)
+                        self._preroll.clear()
+                    continue
+                self.buffer.write(samples)
+                if self.buffer.is_full:
+                    # Chạm MAX_UTTERANCE_SECONDS: kết thúc lượt, giao phần đã ghi cho ASR (không bỏ đầu câu)
+                    log_info("[Recorder] ⚠️ Lượt %s đạt giới hạn %.0fs, kết thúc lượt.", "orange",
+                             self.turn_index, self.buffer.max_seconds)
+                    self.stop()
+                elif event == "end":
+                    self.stop()
         except asyncio.CancelledError:
-            log_info(f"[Recorder] Task đọc track bị hủy.")
+            log_info("[Recorder] Task đọc track bị hủy.")
         finally:
-            if not self._chunks:
-                if self._on_stop_callback and self._file_path:
-                    self._on_stop_callback(None)
-                return
-            try:
-                # 🚨 Sửa đổi: Sử dụng hàm helper bên ngoài
-                await asyncio.to_thread(_write_wav_file_safe_helper, str(self._file_path), self._chunks, self._get_wav_params_tuple())
-                if self._on_stop_callback:
-                    self._on_stop_callback(str(self._file_path))
-            except Exception as e:
-                log_info(f"[Recorder] LỖI GHI FILE: {e}", "red")
-                if self._on_stop_callback:
-                    self._on_stop_callback(None)
+            # Track kết thúc giữa lượt: vẫn xử lý phần đã ghi
+            if self.listening:
+                self.stop()
 
     def stop(self):
-        self._stop_event.set()
+        """Kết thúc lượt hiện tại: ghi WAV và gọi callback "stop" (task đọc track vẫn chạy)."""
+        if not self.listening:
+            return
+        self.stop_requested_ns = time.time_ns()
+        self.listening = False
+        self.buffer.write(self._frontend.flush())
+        self._frontend.reset()
+        self._finalize_task = asyncio.create_task(self._finalize_turn(self._file_path))
+
+    async def _finalize_turn(self, file_path: Path):
+        if self.buffer is None or not len(self.buffer):
+            if self._on_stop_callback:
+                self._on_stop_callback(None)
+            return
+        try:
+            observe_recording(self.buffer.duration_seconds)
+            # Ghi trực tiếp từ view của ring buffer (không join bytes); begin_turn chờ tới khi ghi xong
+            await asyncio.to_thread(_write_wav_file_safe_helper, str(file_path), self.buffer.segments(), self._get_wav_params_tuple())
+            if self._on_stop_callback:
+                self._on_stop_callback(str(file_path))
+        except Exception as e:
+            log_info("[Recorder] LỖI GHI FILE: %s", "red", e)
+            if self._on_stop_callback:
+                self._on_stop_callback(None)
+
+    def close(self):
+        """Kết thúc cuộc gọi: dừng đọc track và giải phóng ring buffer (trả quota bộ nhớ của session)."""
+        self.listening = self.armed = False
+        self.stop_watching()
         if self._record_task:
             self._record_task.cancel()
+        if self.buffer is not None:
+            self.buffer.release()
+            self.buffer = None
 
 
 # ======================================================
 # HÀM XỬ LÝ CHÍNH
 # ======================================================
-async def _process_audio_and_respond(session_id, dm_processor, pc, data_channel, record_file, api_key):
-    """Xử lý file audio, ghi audio phản hồi ra file, và gửi tín hiệu."""
+@dataclass
+class BotSpeech:
+    """Phản hồi của bot trong một lượt: barge-in cần biết bot đang nói gì và đã phát được bao lâu."""
+    turn: int
+    on_start: Optional[Callable[[], None]] = None                 # chunk TTS đầu tiên
+    on_delivered: Optional[Callable[["BotSpeech"], None]] = None  # đã gửi end_of_session (client bắt đầu phát)
+    bot_text: Optional[str] = None
+    audio_s: float = 0.0
+    delivered_at: Optional[float] = None
+
+    @property
+    def heard_s(self) -> float:
+        """Ước lượng số giây phản hồi người gọi đã nghe (0 nếu audio chưa tới client)."""
+        if self.delivered_at is None:
+            return 0.0
+        return max(0.0, min(self.audio_s, time.monotonic() - self.delivered_at))
+
+
+def _dc_send(data_channel, payload: Dict[str, Any]):
+    """Gửi JSON qua Data Channel, ghi span 'dc_send' vào trace của turn."""
+    with span("dc_send", message_type=payload.get("type", "")):
+        data_channel.send(json.dumps(payload))
+
+
+async def _process_audio_and_respond(session_id, dm_processor, pc, data_channel, record_file, api_key,
+                                     turn_trace: Optional[TurnTrace] = None, dialog_manager=None, turn: int = 0,
+                                     cancel_token: Optional[CancelToken] = None, speech: Optional[BotSpeech] = None):
+    """Chạy một turn trong trace của nó và export trace khi kết thúc (task này sở hữu lượt: bind token hủy ở đây)."""
+    with activate(turn_trace), cancellation.bound(cancel_token):
+        try:
+            await _process_turn(session_id, dm_processor, pc, data_channel, record_file, api_key, dialog_manager, turn,
+                                cancel_token, speech)
+        finally:
+            end_turn(turn_trace)
+
+
+def _output_file_name(session_id: str, turn: int) -> str:
+    # Mỗi lượt một tên file để trình duyệt không phát lại bản cache của lượt trước
+    return f"{session_id}_output_{turn}.wav" if turn else f"{session_id}_output.wav"
+
+
+async def _process_turn(session_id, dm_processor, pc, data_channel, record_file, api_key, dialog_manager=None, turn: int = 0,
+                        cancel_token: Optional[CancelToken] = None, speech: Optional[BotSpeech] = None):
+    """Xử lý file audio của một lượt (DM của cuộc gọi nếu có), ghi audio phản hồi ra file, và gửi tín hiệu."""
     # ... (các đoạn kiểm tra kết nối không thay đổi)
     if data_channel is None:
-        log_info(f"[{session_id}] ❌ Data Channel None, bỏ qua xử lý.", "red")
+        log_info("[%s] ❌ Data Channel None, bỏ qua xử lý.", "red", session_id)
         return
     
     # Chờ mở DC
@@ -135,11 +358,11 @@ async def _process_audio_and_respond(session_id, dm_processor, pc, data_channel,
         start_time = asyncio.get_event_loop().time()
         while data_channel.readyState != 'open':
             if asyncio.get_event_loop().time() - start_time > timeout:
-                log_info(f"[{session_id}] ❌ Data Channel chưa mở sau {timeout}s.", "red")
+                log_info("[%s] ❌ Data Channel chưa mở sau %ss.", "red", session_id, timeout)
                 return
             await asyncio.sleep(0.1)
     except Exception as e:
-        log_info(f"[{session_id}] Lỗi khi chờ DC: {e}", "red")
+        log_info("[%s] Lỗi khi chờ DC: %s", "red", session_id, e)
         return
     
     if not record_file or not os.path.exists(record_file):
@@ -150,12 +373,14 @@ async def _process_audio_and_respond(session_id, dm_processor, pc, data_channel,
         return
 
     try:
-        data_channel.send(json.dumps({"type": "start_processing"}))
+        _dc_send(data_channel, {"type": "start_processing"})
 
         stream_generator = dm_processor.handle_rtc_session(
             record_file=Path(record_file),
             session_id=session_id,
-            api_key=api_key
+            api_key=api_key,
+            dialog_manager=dialog_manager,
+            cancel_token=cancel_token
         )
         
         # 🚨 Bổ sung: Các biến để thu thập dữ liệu
@@ -165,37 +390,58 @@ async def _process_audio_and_respond(session_id, dm_processor, pc, data_channel,
         # 🚨 Sửa đổi: Thu thập audio chunks và gửi text response
         async for is_audio, data in stream_generator:
             if data_channel.readyState != 'open':
-                log_info(f"[{session_id}] DC đóng, dừng stream.", "orange")
+                log_info("[%s] DC đóng, dừng stream.", "orange", session_id)
                 break
             
+            if not is_audio and data.get("type") == "filler":
+                # Câu đệm trong lúc chờ DB/LLM: client phát ngay, phản hồi thật nối tiếp sau (bot đã bắt đầu nói)
+                if speech is not None and speech.on_start:
+                    speech.on_start()
+                _dc_send(data_channel, {"type": "filler", "turn": turn, "text": data["text"],
+                                        "audio_path": f"/filler_audio/{data['file_name']}", "duration_s": data["duration_s"]})
+                continue
             if is_audio:
+                if speech is not None and not audio_chunks_binary and speech.on_start:
+                    # Bot bắt đầu trả lời: từ đây người gọi có thể nói chen (barge-in)
+                    speech.on_start()
                 # Chuyển Base64 thành binary và thu thập
                 audio_chunks_binary.append(base64.b64decode(data)) 
             else:
                 # Gửi kết quả ASR/NLU sớm
                 text_data = data
+                if speech is not None and "bot_text" in data:
+                    speech.bot_text = data["bot_text"]
                 response_data = {"type": "text_response_partial", **data}
-                data_channel.send(json.dumps(response_data))
+                _dc_send(data_channel, response_data)
         
-        output_file_name = f"{session_id}_output.wav"
+        output_file_name = _output_file_name(session_id, turn)
         output_file_path = os.path.join("temp", output_file_name)
         
         if audio_chunks_binary:
             # Ghi file phản hồi ra thư mục temp (chung với input file)
             await asyncio.to_thread(_write_wav_file_safe_helper, output_file_path, audio_chunks_binary, WAV_PARAMS)
-            log_info(f"[{session_id}] ✅ Đã ghi file phản hồi TTS: {output_file_name}", "green")
+            log_info("[%s] ✅ Đã ghi file phản hồi TTS: %s", "green", session_id, output_file_name)
+            # Chỉ giữ file phản hồi của lượt mới nhất trong cuộc gọi
+            previous_output = os.path.join("temp", _output_file_name(session_id, turn - 1)) if turn > 1 else None
+            if previous_output and os.path.exists(previous_output):
+                os.remove(previous_output)
             
         # 🚨 Gửi tín hiệu hoàn tất và đường dẫn file
         if data_channel.readyState == 'open':
             final_response = {
                 "type": "end_of_session", 
+                "turn": turn,
                 "bot_audio_path": f"/audio_files/{output_file_name}" if audio_chunks_binary else None
             }
-            data_channel.send(json.dumps(final_response))
+            _dc_send(data_channel, final_response)
+            if speech is not None and audio_chunks_binary:
+                speech.audio_s = sum(len(chunk) for chunk in audio_chunks_binary) / (SAMPLE_RATE * SAMPLE_WIDTH * CHANNELS)
+                speech.delivered_at = time.monotonic()
+                if speech.on_delivered:
+                    speech.on_delivered(speech)
 
     except Exception as e:
-        log_info(f"[{session_id}] ❌ Lỗi xử lý chung: {e}", "red")
-        log_info(traceback.format_exc(), "red")
+        log_info.exception("[%s] ❌ Lỗi xử lý chung: %s", session_id, e)
         try:
             if data_channel and data_channel.readyState == 'open':
                 data_channel.send(json.dumps({"type": "error", "error": str(e)}))
@@ -205,12 +451,9 @@ async def _process_audio_and_respond(session_id, dm_processor, pc, data_channel,
         # 🚨 GIỮ LẠI PHẦN XÓA FILE GHI ÂM ĐẦU VÀO
         if os.path.exists(record_file):
             os.remove(record_file)
-            log_info(f"[{session_id}] ✅ Đã xóa file ghi âm đầu vào: {os.path.basename(record_file)}", "green")
+            log_info("[%s] ✅ Đã xóa file ghi âm đầu vào: %s", "green", session_id, os.path.basename(record_file))
             
         # File phản hồi (output_file_path) sẽ được giữ lại
-        
-        if session_id in processing_tasks:
-            del processing_tasks[session_id]
 
 
 # ======================================================
@@ -219,6 +462,139 @@ async def _process_audio_and_respond(session_id, dm_processor, pc, data_channel,
 app = FastAPI()
 dm = RTCStreamProcessor(log_callback=log_info)
 
+@app.on_event("startup")
+async def on_startup():
+    # Metrics Prometheus trên PROMETHEUS_PORT (ngoài route /metrics của chính server)
+    start_metrics_server()
+    # Tải + warm-up VAD/Whisper trong thread nền: server nhận kết nối ngay
+    if MODEL_WARMUP_ON_START:
+        model_registry.start_warmup()
+    # Sweeper đóng PC không kết nối / idle / quá thời gian sống
+    connections.start()
+    # Câu đệm render sẵn (cache đĩa) trong thread nền
+    dm.start_prerender()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await connections.stop()
+
+def _health_report() -> Dict[str, Any]:
+    """Trạng thái model, capacity, queue và latency gần nhất (dùng chung cho /healthz và /readyz)."""
+    sessions = active_session_count()
+    queues = executor_queue_depths()
+    models = model_registry.status()
+    reasons = []
+    if not models["ready"]:
+        reasons.append("models_not_ready")
+    if sessions >= MAX_ACTIVE_SESSIONS:
+        reasons.append("over_session_capacity")
+    if any(depth > MAX_EXECUTOR_QUEUE_DEPTH for depth in queues.values()):
+        reasons.append("executor_queue_saturated")
+    return {
+        "ready": not reasons,
+        "reasons": reasons,
+        "models": models,
+        "tts_ready": GTTS_IS_READY,
+        "sessions": {"active": sessions, "capacity": MAX_ACTIVE_SESSIONS, "processing": connections.status()["processing"]},
+        "connections": connections.status(),
+        "executor_queue_depth": {"depths": queues, "max": MAX_EXECUTOR_QUEUE_DEPTH},
+        "stage_latency": recent_stage_latencies(),
+        "asr_quality": asr_quality_controller.status(),
+        "turn_scheduler": turn_scheduler.status(),
+        "fillers": filler_audio.status(),
+        "tts_splice": tts_splicer.status(),
+        "admission": admission.status(),
+        "audio_buffers": {k: v for k, v in audio_buffer_memory().items() if k != "by_session"},
+    }
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: process còn sống (luôn 200), kèm báo cáo trạng thái."""
+    return {"status": "ok", **_health_report()}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: 503 khi model chưa tải/warm-up xong hoặc node quá tải."""
+    report = _health_report()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
+def _parse_candidate(payload: Dict[str, Any]):
+    """{"candidate": "candidate:...", "sdpMid", "sdpMLineIndex"} -> RTCIceCandidate; None = end-of-candidates."""
+    candidate_sdp = payload.get("candidate")
+    if not candidate_sdp:
+        return None
+    candidate = candidate_from_sdp(candidate_sdp.split(":", 1)[1] if candidate_sdp.startswith("candidate:") else candidate_sdp)
+    candidate.sdpMid = payload.get("sdpMid")
+    candidate.sdpMLineIndex = payload.get("sdpMLineIndex")
+    return candidate
+
+def _prune_pending_candidates():
+    """Bỏ hàng chờ quá WEBRTC_PENDING_CANDIDATE_TTL_S (offer không bao giờ tới)."""
+    deadline = time.monotonic() - WEBRTC_PENDING_CANDIDATE_TTL_S
+    while _pending_candidates:
+        session_id, (opened_at, _) = next(iter(_pending_candidates.items()))
+        if opened_at >= deadline:
+            break
+        _pending_candidates.popitem(last=False)
+        log_info.debug("[%s] Hết hạn hàng chờ ICE candidate", session_id)
+
+def _open_pending_candidates(session_id: str):
+    """Mở hàng chờ cho session đang đàm phán (WS signaling vừa mở hoặc /offer đang xử lý)."""
+    _prune_pending_candidates()
+    if session_id in _pending_candidates:
+        return
+    while len(_pending_candidates) >= WEBRTC_MAX_PENDING_SESSIONS:
+        evicted, _ = _pending_candidates.popitem(last=False)
+        log_info.warning("[%s] ⚠️ Quá %d session chờ candidate: bỏ hàng chờ cũ nhất", evicted, WEBRTC_MAX_PENDING_SESSIONS)
+    _pending_candidates[session_id] = (time.monotonic(), [])
+
+async def _add_remote_candidate(session_id: str, payload: Dict[str, Any]) -> str:
+    """Thêm candidate của client vào PC của session; giữ chờ nếu /offer chưa xử lý xong.
+
+    Chỉ giữ chờ cho session đã mở hàng chờ (_open_pending_candidates); session lạ -> "unknown_session".
+    """
+    candidate = _parse_candidate(payload)
+    if candidate is None:
+        # End-of-candidates: aiortc không cần báo, bỏ qua
+        return "end_of_candidates"
+    conn = connections.get(session_id)
+    pc = conn.pc if conn is not None else None
+    if pc is None or pc.remoteDescription is None:
+        _prune_pending_candidates()
+        entry = _pending_candidates.get(session_id)
+        if entry is None:
+            return "unknown_session"
+        pending = entry[1]
+        if len(pending) >= WEBRTC_MAX_PENDING_CANDIDATES:
+            return "dropped"
+        pending.append(candidate)
+        return "queued"
+    await pc.addIceCandidate(candidate)
+    return "added"
+
+async def _flush_pending_candidates(session_id: str, pc: RTCPeerConnection):
+    _, pending = _pending_candidates.pop(session_id, (0.0, []))
+    for candidate in pending:
+        try:
+            await pc.addIceCandidate(candidate)
+        except Exception as e:
+            log_info.warning("[%s] ⚠️ Bỏ qua ICE candidate lỗi: %s", session_id, e)
+
+@app.post("/candidate")
+async def candidate(request: Request):
+    """Trickle ICE: client gửi từng candidate sau khi đã gửi offer (không chờ gom xong)."""
+    params = await request.json()
+    session_id = params.get("session_id")
+    if not session_id:
+        return JSONResponse({"error": "missing session_id"}, status_code=400)
+    try:
+        status = await _add_remote_candidate(session_id, params)
+    except (ValueError, IndexError, TypeError, AttributeError) as e:
+        return JSONResponse({"error": f"invalid candidate: {e}"}, status_code=400)
+    if status == "unknown_session":
+        return JSONResponse({"error": "unknown session_id", "status": status}, status_code=404)
+    return {"status": status}
+
 @app.post("/offer")
 async def offer(request: Request):
 # ... (hàm offer không thay đổi)
@@ -227,12 +603,40 @@ async def offer(request: Request):
     session_id = params.get("session_id", str(uuid.uuid4()))
     client_api_key = params.get("api_key", INTERNAL_API_KEY)
 
-    ice_servers_objects = [RTCIceServer(urls=s["urls"]) for s in ICE_SERVERS]
+    # Quá tải: từ chối ngay trước khi tạo PC. Chỉ cuộc gọi đang diễn ra được ưu tiên, và chỉ khi peer chứng minh
+    # được quyền sở hữu session (peer_token trong answer trước); session_id do client gửi thì không đủ
+    existing = connections.get(session_id)
+    in_progress = existing is not None and existing.owned_by(params.get("peer_token"))
+    decision = admission.admit(session_id, in_progress=in_progress)
+    if not decision.admitted:
+        return JSONResponse({"error": "over_capacity", "reason": decision.reason,
+                             "retry_after_s": decision.retry_after_s},
+                            status_code=503, headers={"Retry-After": str(decision.retry_after_s)})
+    if existing is not None and not in_progress:
+        # Không thay cuộc gọi đang sống của peer khác
+        log_info.warning("[%s] ⚠️ /offer trùng session_id đang sống nhưng sai peer_token: từ chối", session_id)
+        return JSONResponse({"error": "session_in_use"}, status_code=409)
+
+    ice_servers_objects = [RTCIceServer(**s) for s in ICE_SERVERS]
     config = RTCConfiguration(iceServers=ice_servers_objects)
     pc = RTCPeerConnection(configuration=config)
-
-    recorder = AudioFileRecorder(pc)
+    # Candidate trickle trong lúc setRemoteDescription chưa xong vẫn được giữ chờ
+    _open_pending_candidates(session_id)
+    # Manager giữ PC + recorder + task của cuộc gọi và đóng tất cả khi PC failed/closed hoặc quá hạn
+    conn = connections.register(session_id, pc)
+    # Cuộc gọi cũ bị thay (cùng session_id) không được xóa hàng chờ của offer mới
+    conn.on_close(lambda: connections.get(session_id) is None and _pending_candidates.pop(session_id, None))
+    # Tách lượt: client gửi start/stop_recording, hoặc server tự endpoint theo năng lượng ("vad")
+    turn_segmentation = params.get("turn_segmentation", TURN_SEGMENTATION)
+    recorder = AudioFileRecorder(pc, session_id, Endpointer(SAMPLE_RATE) if turn_segmentation == "vad" else None)
+    conn.recorder = recorder
     data_channel_holder = None
+    turn_trace: Optional[TurnTrace] = None
+    # DialogManager sống suốt cuộc gọi (history/state giữ nguyên giữa các lượt)
+    session_dm = None
+    # Phản hồi của bot ở lượt gần nhất (barge-in)
+    current_speech: Optional[BotSpeech] = None
+    playback_timer: Optional[asyncio.TimerHandle] = None
 
     @pc.on("datachannel")
     def on_datachannel(channel):
@@ -241,69 +645,184 @@ async def offer(request: Request):
 
         @channel.on("open")
         def on_open():
-            log_info(f"[{session_id}] ✅ Data Channel mở thành công")
+            log_info("[%s] ✅ Data Channel mở thành công", "white", session_id)
 
         @channel.on("close")
         def on_close():
-            log_info(f"[{session_id}] ❌ Data Channel đã đóng")
-            if session_id in processing_tasks:
-                processing_tasks[session_id].cancel()
+            log_info("[%s] ❌ Data Channel đã đóng", "white", session_id)
+            conn.cancel_processing("hangup")
 
         @channel.on("message")
         def on_message(message):
+            nonlocal turn_trace
+            conn.touch()
             if isinstance(message, str):
                 try:
                     data = json.loads(message)
                     if data.get("type") == "stop_recording":
+                        turn_trace = begin_turn(session_id)
                         recorder.stop()
+                    elif data.get("type") == "start_recording":
+                        # Lượt mới trên cùng peer connection (không cần /offer lại)
+                        if recorder.endpointer is not None:
+                            recorder.arm()
+                        elif not recorder.begin_turn():
+                            log_info("[%s] ⚠️ Chưa mở được lượt mới (đang ghi hoặc đang lưu lượt trước).", "orange", session_id)
+                    elif data.get("type") == "playback_ended":
+                        # Client phát xong phản hồi: thôi theo dõi barge-in
+                        recorder.stop_watching()
                     elif data.get("type") == "cancel_processing":
-                        if session_id in processing_tasks:
-                            processing_tasks[session_id].cancel()
-                            log_info(f"[{session_id}] Hủy xử lý theo yêu cầu.", "orange")
+                        if conn.cancel_processing("cancel_processing"):
+                            log_info("[%s] Hủy xử lý theo yêu cầu.", "orange", session_id)
                 except Exception:
                     pass
 
+    def get_session_dm():
+        nonlocal session_dm
+        if session_dm is None:
+            session_dm = dm.create_dialog_manager(client_api_key)
+        return session_dm
+
+    async def speculate_loop():
+        """Người gọi còn đang nói: ASR tạm mỗi SPECULATIVE_PARTIAL_INTERVAL_S audio -> DM tra DB sớm (prefetch)."""
+        turn, transcribed_s = 0, 0.0
+        while recorder.buffer is not None:
+            await asyncio.sleep(SPECULATIVE_PARTIAL_INTERVAL_S / 2)
+            if not recorder.listening or recorder.buffer is None:
+                continue
+            if recorder.turn_index != turn:
+                turn, transcribed_s = recorder.turn_index, 0.0
+            duration = recorder.buffer.duration_seconds
+            if duration < SPECULATIVE_PARTIAL_MIN_S or duration - transcribed_s < SPECULATIVE_PARTIAL_INTERVAL_S:
+                continue
+            transcribed_s = duration
+            try:
+                await dm.speculate(get_session_dm(), recorder.buffer.as_float32())
+            except Exception as e:
+                log_info.debug("[%s] ⚠️ Lỗi ASR tạm (prefetch): %s", session_id, e)
+
+    def on_turn_done(_task: Optional[asyncio.Task]):
+        """Mọi nhánh kết thúc lượt (kể cả lượt bị bỏ qua) đều phải gọi: chế độ VAD cần arm lại cho lượt sau."""
+        conn.touch()
+        # Chế độ VAD: xử lý xong lượt thì chờ câu nói tiếp theo
+        if recorder.endpointer is not None:
+            recorder.arm()
+
+    def on_speech_start():
+        if BARGE_IN_ENABLED:
+            recorder.watch_barge_in(on_barge_in)
+
+    def on_speech_delivered(speech: BotSpeech):
+        # Client không báo playback_ended: thôi theo dõi khi audio chắc chắn đã phát xong
+        nonlocal playback_timer
+        if playback_timer is not None:
+            playback_timer.cancel()
+        playback_timer = asyncio.get_event_loop().call_later(
+            speech.audio_s + BARGE_IN_PLAYBACK_MARGIN_S, lambda: current_speech is speech and recorder.stop_watching())
+
+    def on_barge_in() -> bool:
+        """Người gọi nói chen: hủy TTS đang tổng hợp, báo client dừng phát, ghi vào history, mở lượt mới."""
+        speech = current_speech
+        phase = "playback" if speech is not None and speech.delivered_at is not None else "synthesis"
+        heard_s = speech.heard_s if speech is not None else 0.0
+        BARGE_INS.labels(phase).inc()
+        conn.cancel_processing("barge_in")
+        log_info("[%s] ✋ Barge-in (%s, bot đã nói %.1fs): mở lượt mới.", "yellow", session_id, phase, heard_s)
+        if data_channel_holder is not None and data_channel_holder.readyState == "open":
+            _dc_send(data_channel_holder, {"type": "barge_in", "turn": speech.turn if speech else recorder.turn_index,
+                                           "heard_s": round(heard_s, 2)})
+        if session_dm is not None:
+            conn.track_task(asyncio.create_task(
+                dm.record_barge_in(session_dm, speech.bot_text if speech else None, heard_s)))
+        conn.touch()
+        return recorder.begin_turn()
+
+    def on_stop(saved_path):
+        nonlocal turn_trace, current_speech
+        trace = turn_trace or begin_turn(session_id)
+        turn_trace = None
+        trace.record_span("recorder_stop", recorder.stop_requested_ns or trace.root.start_ns, time.time_ns(),
+                          saved=bool(saved_path), turn=recorder.turn_index)
+        if not data_channel_holder:
+            log_info("[%s] ❌ Không có data_channel, bỏ qua xử lý.", "red", session_id)
+            end_turn(trace)
+            on_turn_done(None)
+            return
+        if not saved_path:
+            log_info("[%s] ❌ Ghi âm thất bại.", "red", session_id)
+            end_turn(trace)
+            on_turn_done(None)
+            return
+        turn_dm = get_session_dm()
+
+        # Token hủy của lượt: cancel_processing / gác máy / barge-in dừng cả phần việc đang chạy trong thread
+        cancel_token = CancelToken(session_id)
+        current_speech = BotSpeech(recorder.turn_index, on_start=on_speech_start, on_delivered=on_speech_delivered)
+        task = asyncio.create_task(
+            _process_audio_and_respond(session_id, dm, pc, data_channel_holder, saved_path, client_api_key, trace,
+                                       turn_dm, recorder.turn_index, cancel_token, current_speech)
+        )
+        conn.set_processing_task(task, cancel_token)
+        task.add_done_callback(on_turn_done)
+
+    recorder.on("stop", on_stop)
+
     @pc.on("track")
     def on_track(track):
         if track.kind == "audio":
-            path = os.path.join("temp", f"{session_id}_input.wav")
-            recorder.start(track, path)
-
-            def on_stop(saved_path):
-                nonlocal data_channel_holder
-                if not data_channel_holder:
-                    log_info(f"[{session_id}] ❌ Không có data_channel, bỏ qua xử lý.", "red")
-                    return
-                if not saved_path:
-                    log_info(f"[{session_id}] ❌ Ghi âm thất bại.", "red")
-                    return
-
-                task = asyncio.create_task(
-                    _process_audio_and_respond(session_id, dm, pc, data_channel_holder, saved_path, client_api_key)
-                )
-                processing_tasks[session_id] = task
+            # Track sống suốt cuộc gọi; recorder dùng lại cho mọi lượt
+            recorder.start(track)
+            if SPECULATIVE_PREFETCH_ENABLED:
+                conn.track_task(asyncio.create_task(speculate_loop()))
 
-            recorder.on("stop", on_stop)
-
-    await pc.setRemoteDescription(offer)
-    answer = await pc.createAnswer()
-    await pc.setLocalDescription(answer)
-    return {"sdp": pc.localDescription.sdp, "type": pc.localDescription.type}
+    try:
+        await pc.setRemoteDescription(offer)
+        # Candidate client đã trickle trước khi offer tới
+        await _flush_pending_candidates(session_id, pc)
+        answer = await pc.createAnswer()
+        # aiortc gom xong candidate của server trong setLocalDescription (không trickle chiều ra được);
+        # LAN mode chỉ có host candidate nên bước này không phải chờ STUN
+        await pc.setLocalDescription(answer)
+    except Exception as e:
+        # SDP lỗi: không để PC nửa vời sống tới connect timeout
+        log_info.warning("[%s] ❌ Lỗi đàm phán SDP: %s", session_id, e)
+        await connections.close(session_id, "negotiation_failed")
+        return JSONResponse({"error": f"invalid offer: {e}"}, status_code=400)
+    return {"sdp": pc.localDescription.sdp, "type": pc.localDescription.type, "peer_token": conn.peer_token}
 
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket, session_id: str = "default_session"):
+    """Kênh signaling: {"type": "candidate", "candidate", "sdpMid", "sdpMLineIndex"} (trickle ICE từ client)."""
     await websocket.accept()
+    # WS signaling mở trước /offer (client gửi candidate ngay khi gom được)
+    if connections.get(session_id) is None:
+        _open_pending_candidates(session_id)
     try:
         while True:
-            await websocket.receive_text()
+            message = await websocket.receive_text()
+            try:
+                data = json.loads(message)
+                if data.get("type") == "candidate":
+                    await _add_remote_candidate(session_id, data)
+            except (ValueError, IndexError, TypeError, AttributeError) as e:
+                await websocket.send_text(json.dumps({"type": "error", "error": f"invalid candidate: {e}"}))
     except WebSocketDisconnect:
         pass
     except Exception:
         pass
+    finally:
+        # Offer không bao giờ tới: không giữ candidate chờ
+        if connections.get(session_id) is None:
+            _pending_candidates.pop(session_id, None)
+
+_metrics_app = metrics_asgi_app()
+if _metrics_app is not None:
+    app.mount("/metrics", _metrics_app, name="metrics")
 
 # 🚨 Bổ sung: Mount thư mục 'temp' để phục vụ file audio phản hồi
 app.mount("/audio_files", StaticFiles(directory="temp"), name="audio_files") 
+app.mount("/filler_audio", StaticFiles(directory=str(filler_audio.cache.cache_dir)), name="filler_audio")
 app.mount("/", StaticFiles(directory=".", html=True), name="static")
 
 if __name__ == "__main__":
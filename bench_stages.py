@@ -0,0 +1,397 @@
+# bench_stages.py
+"""
+Microbenchmark từng stage của pipeline với model giả lập (không cần mạng, không tải model thật).
+
+Whisper / Silero VAD / gTTS được thay bằng fake có chi phí cố định (--model-cost-ms) để đo
+phần code của chúng ta: DialogManager, NLUClientMock, ResponseGenerator, chunking của
+TTSServiceGTTS.synthesize_stream, AudioFileRecorder và luồng ASR (VAD + transcribe).
+Mỗi stage báo ops/sec, latency p50/p95 và bộ nhớ (tracemalloc) trên mỗi op.
+
+Ví dụ:
+    python bench_stages.py                              # chạy tất cả, in JSON
+    python bench_stages.py --save bench_baseline.json   # lưu baseline
+    python bench_stages.py --baseline bench_baseline.json --max-regression 0.25
+    python bench_stages.py --only dm nlu --min-time 2
+Exit code 1 khi có stage chậm hơn baseline quá ngưỡng (hoặc tốn bộ nhớ hơn quá ngưỡng).
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+import wave
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+SEED = 1234
+
+
+# ==================== FAKE MODELS (chi phí cố định) ====================
+class FixedCost:
+    """Chi phí cố định cho mỗi lần gọi model giả lập (sleep, không tốn CPU)."""
+    seconds = 0.0
+
+    @classmethod
+    def spend(cls):
+        if cls.seconds > 0:
+            time.sleep(cls.seconds)
+
+
+class FakeWhisperModel:
+    """Thay cho whisper model: trả transcript cố định."""
+    def __init__(self, text: str = "chào bạn, cho tôi hỏi giá sản phẩm A"):
+        self.text = text
+
+    def transcribe(self, audio, **kwargs) -> Dict[str, Any]:
+        FixedCost.spend()
+        return {"text": self.text, "segments": [{"avg_logprob": -0.2, "no_speech_prob": 0.01}], "language": "vi"}
+
+    def half(self): return self
+    def to(self, device): return self
+
+
+class FakeSileroVAD:
+    """Thay cho Silero (giao diện numpy của model_registry): toàn bộ audio được coi là tiếng nói."""
+    engine = "fake"
+
+    def speech_timestamps(self, audio, sampling_rate=SAMPLE_RATE, threshold=0.3):
+        FixedCost.spend()
+        return [{"start": 0, "end": len(audio)}]
+
+    def collect_chunks(self, timestamps, audio):
+        return audio[timestamps[0]["start"]:timestamps[-1]["end"]]
+
+
+def install_fake_models():
+    """Đăng ký model giả lập vào model_registry (không đọc đĩa, không gọi mạng)."""
+    from model_registry import registry
+    from config_db import WHISPER_MODEL_NAME, ASR_CASCADE_FIRST_MODEL
+    registry.register("vad", FakeSileroVAD(), source="bench")
+    for name in {WHISPER_MODEL_NAME, ASR_CASCADE_FIRST_MODEL}:
+        registry.register(f"whisper:{name}", FakeWhisperModel(), source="bench")
+
+
+def silent_log(message, color=None, *args):
+    pass
+
+
+# ==================== FIXTURES ====================
+def make_wav_bytes(seconds: float, seed: int = SEED) -> bytes:
+    """WAV 16kHz mono: sóng sin + nhiễu cố định theo seed."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    signal = 0.3 * np.sin(2 * np.pi * 220 * t) + 0.02 * rng.standard_normal(t.shape)
+    pcm = (signal * 32767).astype(np.int16)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(SAMPLE_RATE)
+        wf.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+class FakeAudioFrame:
+    """Giống av.AudioFrame của aiortc: 20ms, s16 interleaved."""
+    def __init__(self, samples: np.ndarray, sample_rate: int, channels: int):
+        self._samples = samples
+        self.sample_rate = sample_rate
+        self.samples = samples.shape[-1] // channels
+        self.layout = types.SimpleNamespace(name="stereo" if channels == 2 else "mono",
+                                            channels=[None] * channels)
+        self.format = types.SimpleNamespace(name="s16", is_planar=False)
+
+    def to_ndarray(self) -> np.ndarray:
+        return self._samples
+
+
+class FakeTrack:
+    """MediaStreamTrack giả lập phát N frame rồi kết thúc."""
+    kind = "audio"
+
+    def __init__(self, frames: List[FakeAudioFrame]):
+        self._frames = frames
+        self._index = 0
+
+    async def recv(self):
+        if self._index >= len(self._frames):
+            from aiortc.mediastreams import MediaStreamError
+            raise MediaStreamError
+        frame = self._frames[self._index]
+        self._index += 1
+        return frame
+
+
+def make_track_frames(seconds: float, sample_rate: int = 48000, channels: int = 2) -> List[FakeAudioFrame]:
+    rng = np.random.default_rng(SEED)
+    per_frame = sample_rate // 50
+    frames = []
+    for _ in range(int(seconds * 50)):
+        samples = (rng.standard_normal(per_frame * channels) * 3000).astype(np.int16).reshape(1, -1)
+        frames.append(FakeAudioFrame(samples, sample_rate, channels))
+    return frames
+
+
+# ==================== BENCHMARK REGISTRY ====================
+@dataclass
+class Benchmark:
+    name: str
+    setup: Callable[[], Any]
+    run: Callable[[Any], None]
+
+
+BENCHMARKS: Dict[str, Benchmark] = {}
+
+
+def benchmark(name: str, setup: Callable[[], Any]):
+    def decorator(func: Callable[[Any], None]):
+        BENCHMARKS[name] = Benchmark(name, setup, func)
+        return func
+    return decorator
+
+
+def _run_async(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+# --- DialogManager ---
+def _setup_dm():
+    from dialog_manager import DialogManager
+    return DialogManager(log_callback=silent_log, mode="RTC", api_key="BENCH_KEY")
+
+
+@benchmark("dm.process_audio_file", _setup_dm)
+def bench_dm(dm):
+    dm.history.clear()
+    dm.process_audio_file("bench_input.wav", "chào bạn")
+
+
+# --- NLUClientMock ---
+_NLU_CONFIG = {"intents": [
+    {"intent_name": "ask_price", "keywords": ["giá", "bao nhiêu"]},
+    {"intent_name": "ask_promotion", "keywords": ["khuyến mãi", "giảm giá", "ưu đãi"]},
+    {"intent_name": "order_product", "keywords": ["đặt mua", "mua", "đặt hàng"]},
+    {"intent_name": "check_order_status", "keywords": ["đơn hàng", "ord"]},
+    {"intent_name": "small_talk", "keywords": ["chào", "cảm ơn"]},
+]}
+_NLU_TEXTS = ["Giá của chiếc Vision bao nhiêu?", "Hiện giờ đang có chương trình khuyến mãi nào không?",
+              "Đơn hàng ORD123 đã giao chưa?", "Báo thời tiết."]
+
+
+def _setup_nlu():
+    from nlu_connector import NLUClientMock
+    return NLUClientMock(silent_log, _NLU_CONFIG)
+
+
+@benchmark("nlu.mock_get_intent", _setup_nlu)
+def bench_nlu(nlu):
+    for text in _NLU_TEXTS:
+        nlu.get_intent(text)
+
+
+# --- ResponseGenerator ---
+def _setup_response():
+    from config_db import SCENARIOS_CONFIG
+    from response_generator import ResponseGenerator
+    random.seed(SEED)
+    return ResponseGenerator(silent_log, SCENARIOS_CONFIG, "MOCK", "MOCK", "MOCK", "BENCH_KEY")
+
+
+_DB_RESULT = {"customer_data": None,
+              "product_data": {"product_name": "Sản phẩm A (điện thoại)", "price": "5,000,000 VNĐ", "discount": "10"}}
+
+
+@benchmark("response.generate", _setup_response)
+def bench_response(generator):
+    generator.generate_response("chào bạn", "chao_hoi", {}, _DB_RESULT, "START", [])
+    generator.generate_response("giá sản phẩm A", "query_product_info", {}, _DB_RESULT, "START", [])
+    generator.generate_response("thời tiết", "ask_weather", {}, _DB_RESULT, "START", [])
+
+
+# --- TTSServiceGTTS.synthesize_stream (chunking + base64, gTTS được thay bằng WAV cố định) ---
+def _setup_tts():
+    from rtc_integration_layer import TTSServiceGTTS
+    service = TTSServiceGTTS(silent_log)
+    wav = make_wav_bytes(2.0)
+
+    def fake_synthesize(text):
+        FixedCost.spend()
+        return wav
+    service._synthesize_blocking = fake_synthesize
+    return service
+
+
+@benchmark("tts.synthesize_stream", _setup_tts)
+def bench_tts(service):
+    async def consume():
+        async for _ in service.synthesize_stream("Sản phẩm A hiện có giá 5,000,000 VNĐ."):
+            pass
+    _run_async(consume())
+
+
+# --- AudioFileRecorder (1 giây audio 48kHz stereo, 50 frame) ---
+def _setup_recorder():
+    tmp_dir = Path(tempfile.mkdtemp(prefix="bench_recorder_"))
+    return {"frames": make_track_frames(1.0), "path": tmp_dir / "bench_input.wav"}
+
+
+@benchmark("recorder.read_track", _setup_recorder)
+def bench_recorder(fixture):
+    from backend_webrtc_server import AudioFileRecorder
+
+    async def record():
+        done = asyncio.Event()
+        recorder = AudioFileRecorder(pc=None)
+        recorder.on("stop", lambda path: done.set())
+        recorder.start(FakeTrack(fixture["frames"]), str(fixture["path"]))
+        await asyncio.wait_for(done.wait(), 10)
+    _run_async(record())
+
+
+# --- ASR (VAD + transcribe, model giả lập) ---
+def _setup_asr():
+    from rtc_integration_layer import ASRServiceWhisper
+    tmp = Path(tempfile.mkdtemp(prefix="bench_asr_")) / "utterance.wav"
+    tmp.write_bytes(make_wav_bytes(3.0))
+    return {"service": ASRServiceWhisper(silent_log), "path": tmp}
+
+
+@benchmark("asr.transcribe", _setup_asr)
+def bench_asr(fixture):
+    async def consume():
+        async for _ in fixture["service"].transcribe(fixture["path"]):
+            pass
+    _run_async(consume())
+
+
+# ==================== RUNNER ====================
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run_benchmark(bench: Benchmark, min_time: float, warmup: int, memory_ops: int) -> Dict[str, Any]:
+    random.seed(SEED)
+    np.random.seed(SEED)
+    state = bench.setup()
+    for _ in range(warmup):
+        bench.run(state)
+
+    timings: List[float] = []
+    deadline = time.perf_counter() + min_time
+    while time.perf_counter() < deadline or len(timings) < 5:
+        start = time.perf_counter()
+        bench.run(state)
+        timings.append(time.perf_counter() - start)
+
+    # Bộ nhớ: peak trong một op và phần giữ lại (retained) sau memory_ops op
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        bench.run(state)
+        _, peak = tracemalloc.get_traced_memory()
+        for _ in range(memory_ops - 1):
+            bench.run(state)
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    total = sum(timings)
+    return {
+        "ops": len(timings),
+        "ops_per_sec": round(len(timings) / total, 2) if total else None,
+        "mean_ms": round(statistics.fmean(timings) * 1000, 4),
+        "p50_ms": round(_percentile(timings, 0.50) * 1000, 4),
+        "p95_ms": round(_percentile(timings, 0.95) * 1000, 4),
+        "peak_kib_per_op": round((peak - base) / 1024, 2),
+        "retained_bytes_per_op": round((current - base) / max(1, memory_ops), 1),
+    }
+
+
+def compare_to_baseline(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any],
+                        max_regression: float, max_memory_regression: float) -> List[str]:
+    """Trả về danh sách regression vượt ngưỡng (ngưỡng riêng theo stage trong baseline['thresholds'] nếu có)."""
+    failures = []
+    thresholds = baseline.get("thresholds", {})
+    for name, current in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+        limit = thresholds.get(name, {}).get("max_regression", max_regression)
+        if previous.get("ops_per_sec") and current.get("ops_per_sec"):
+            drop = 1 - current["ops_per_sec"] / previous["ops_per_sec"]
+            current["ops_per_sec_change"] = round(-drop, 4)
+            if drop > limit:
+                failures.append(f"{name}: ops/sec giảm {drop:.1%} (ngưỡng {limit:.0%})")
+        memory_limit = thresholds.get(name, {}).get("max_memory_regression", max_memory_regression)
+        if previous.get("peak_kib_per_op", 0) > 0:
+            growth = current["peak_kib_per_op"] / previous["peak_kib_per_op"] - 1
+            if growth > memory_limit:
+                failures.append(f"{name}: peak memory tăng {growth:.1%} (ngưỡng {memory_limit:.0%})")
+    return failures
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Microbenchmark từng stage với model giả lập.")
+    parser.add_argument("--only", nargs="*", help="Chỉ chạy stage có tên bắt đầu bằng các prefix này.")
+    parser.add_argument("--min-time", type=float, default=1.0, help="Thời gian đo tối thiểu mỗi stage (giây).")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--memory-ops", type=int, default=20)
+    parser.add_argument("--model-cost-ms", type=float, default=0.0, help="Chi phí cố định mỗi lần gọi model giả lập.")
+    parser.add_argument("--baseline", help="File JSON baseline để so sánh.")
+    parser.add_argument("--max-regression", type=float, default=0.20, help="Ngưỡng giảm ops/sec (0.2 = 20%%).")
+    parser.add_argument("--max-memory-regression", type=float, default=0.50)
+    parser.add_argument("--save", help="Lưu kết quả làm baseline mới.")
+    parser.add_argument("--list", action="store_true", help="Liệt kê các stage.")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.list:
+        print("\n".join(BENCHMARKS))
+        return 0
+
+    FixedCost.seconds = args.model_cost_ms / 1000.0
+    os.environ.setdefault("VOICEBOT_LOG_LEVEL", "CRITICAL")
+    os.environ.setdefault("VOICEBOT_TRACE_EXPORTER", "NONE")
+    install_fake_models()
+
+    selected = [b for name, b in BENCHMARKS.items()
+                if not args.only or any(name.startswith(prefix) for prefix in args.only)]
+    results = {b.name: run_benchmark(b, args.min_time, args.warmup, args.memory_ops) for b in selected}
+
+    report = {"benchmark": "stages", "model_cost_ms": args.model_cost_ms,
+              "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}
+    failures: List[str] = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            failures = compare_to_baseline(results, json.load(f), args.max_regression, args.max_memory_regression)
+        report["regressions"] = failures
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    for failure in failures:
+        print(f"❌ REGRESSION {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,345 @@
+# bench_webrtc_load.py
+"""
+Benchmark tải cho backend_webrtc_server.
+
+Khởi chạy server (uvicorn, process riêng) rồi cho N client aiortc đồng thời phát lại
+file WAV (ví dụ user.wav) qua /offer + Data Channel, giống frontend_webrtc_client.html.
+Kết quả (JSON) gồm percentile latency của turn, time-to-first-audio, CPU server trên
+mỗi session và mức concurrency tối đa còn đạt SLO, để so sánh giữa các bản release.
+
+Ví dụ:
+    python bench_webrtc_load.py --wav user.wav --levels 1,2,4,8 --output bench_result.json
+    python bench_webrtc_load.py --url http://10.0.0.5:8000 --levels 4 --turns 3
+    python bench_webrtc_load.py --levels 4 --turns 5 --reuse-connection   # nhiều lượt trên một peer connection
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+import wave
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import httpx
+from aiortc import RTCPeerConnection, RTCSessionDescription
+from aiortc.contrib.media import MediaPlayer
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+# ==================== KẾT QUẢ ====================
+@dataclass
+class TurnResult:
+    ok: bool
+    turn_latency_s: Optional[float] = None      # stop_recording -> end_of_session
+    ttfa_s: Optional[float] = None              # stop_recording -> byte audio phản hồi đầu tiên
+    error: Optional[str] = None
+
+
+@dataclass
+class LevelResult:
+    concurrency: int
+    turns: List[TurnResult] = field(default_factory=list)
+    wall_time_s: float = 0.0
+    server_cpu_s: Optional[float] = None
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """p50/p90/p95/p99/max (ms) theo nearest-rank."""
+    if not values:
+        return {"p50": None, "p90": None, "p95": None, "p99": None, "max": None}
+    ordered = sorted(values)
+
+    def rank(q: float) -> float:
+        index = max(0, min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1))
+        return round(ordered[index] * 1000, 1)
+
+    return {"p50": rank(0.50), "p90": rank(0.90), "p95": rank(0.95), "p99": rank(0.99),
+            "max": round(ordered[-1] * 1000, 1)}
+
+
+def wav_duration_seconds(path: str) -> float:
+    with wave.open(path, "rb") as wf:
+        return wf.getnframes() / float(wf.getframerate())
+
+
+# ==================== SERVER ====================
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _process_cpu_seconds(pid: int) -> Optional[float]:
+    """CPU time (user+system) của process server; dùng psutil hoặc /proc khi không có psutil."""
+    if psutil is not None:
+        try:
+            times = psutil.Process(pid).cpu_times()
+            return times.user + times.system
+        except Exception:
+            return None
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except Exception:
+        return None
+
+
+class LocalServer:
+    """Chạy backend_webrtc_server:app bằng uvicorn trong process con."""
+    def __init__(self, port: int):
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        self.proc: Optional[subprocess.Popen] = None
+
+    async def __aenter__(self) -> "LocalServer":
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "backend_webrtc_server:app",
+             "--host", "127.0.0.1", "--port", str(self.port), "--log-level", "warning"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        deadline = time.monotonic() + 120  # server có thể phải tải model
+        async with httpx.AsyncClient() as client:
+            while time.monotonic() < deadline:
+                if self.proc.poll() is not None:
+                    raise RuntimeError(f"Server thoát sớm (exit code {self.proc.returncode}).")
+                try:
+                    # Chờ /readyz: warm-up model xong thì mới đo (hoặc warm-up kết thúc mà model lỗi)
+                    response = await client.get(self.url + "/readyz", timeout=1.0)
+                    if response.status_code == 200 or not response.json()["models"]["warmup_running"]:
+                        return self
+                except (httpx.HTTPError, ValueError, KeyError):
+                    pass
+                await asyncio.sleep(0.5)
+        raise TimeoutError("Server không sẵn sàng sau 120s.")
+
+    async def __aexit__(self, *exc):
+        if self.proc and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+
+    def cpu_seconds(self) -> Optional[float]:
+        return _process_cpu_seconds(self.proc.pid) if self.proc else None
+
+
+# ==================== CLIENT ====================
+async def _await_turn_end(http: httpx.AsyncClient, events: "asyncio.Queue[Dict[str, Any]]", stop_at: float,
+                          timeout_s: float) -> TurnResult:
+    """Chờ end_of_session của lượt vừa dừng và byte audio phản hồi đầu tiên."""
+    while True:
+        remaining = timeout_s - (time.perf_counter() - stop_at)
+        event = await asyncio.wait_for(events.get(), max(0.01, remaining))
+        if event.get("type") == "error":
+            return TurnResult(ok=False, error=str(event.get("error")))
+        if event.get("type") == "end_of_session":
+            turn_latency = time.perf_counter() - stop_at
+            audio_path = event.get("bot_audio_path")
+            if not audio_path:
+                return TurnResult(ok=False, turn_latency_s=turn_latency, error="no bot audio")
+            async with http.stream("GET", audio_path) as audio_response:
+                async for _ in audio_response.aiter_bytes():
+                    return TurnResult(ok=True, turn_latency_s=turn_latency, ttfa_s=time.perf_counter() - stop_at)
+            return TurnResult(ok=False, turn_latency_s=turn_latency, error="empty bot audio")
+
+
+async def run_client_call(base_url: str, wav_path: str, turns: int, timeout_s: float) -> List[TurnResult]:
+    """
+    Một cuộc gọi: /offer, phát WAV qua track, rồi `turns` lượt nối tiếp trên cùng peer connection
+    (start_recording -> phát hết utterance -> stop_recording -> chờ end_of_session và audio phản hồi).
+    """
+    pc = RTCPeerConnection()
+    # Nhiều lượt: phát lặp để track không kết thúc giữa cuộc gọi
+    player = MediaPlayer(wav_path, loop=turns > 1)
+    events: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+    channel_open = asyncio.Event()
+    results: List[TurnResult] = []
+    try:
+        pc.addTrack(player.audio)
+        channel = pc.createDataChannel("chat")
+
+        @channel.on("open")
+        def on_open():
+            channel_open.set()
+
+        @channel.on("message")
+        def on_message(message):
+            if isinstance(message, str):
+                try:
+                    events.put_nowait(json.loads(message))
+                except ValueError:
+                    pass
+
+        await pc.setLocalDescription(await pc.createOffer())
+        async with httpx.AsyncClient(base_url=base_url, timeout=timeout_s) as http:
+            response = await http.post("/offer", json={
+                "sdp": pc.localDescription.sdp, "type": pc.localDescription.type,
+                "session_id": str(uuid.uuid4()), "api_key": "BENCH_KEY",
+            })
+            if response.status_code != 200:
+                return [TurnResult(ok=False, error=f"/offer HTTP {response.status_code}")]
+            answer = response.json()
+            await pc.setRemoteDescription(RTCSessionDescription(sdp=answer["sdp"], type=answer["type"]))
+
+            await asyncio.wait_for(channel_open.wait(), timeout_s)
+            for turn in range(turns):
+                if turn:
+                    channel.send(json.dumps({"type": "start_recording"}))
+                # Phát lại toàn bộ utterance theo thời gian thực rồi mới báo dừng (giống người dùng bấm Stop)
+                await asyncio.sleep(wav_duration_seconds(wav_path))
+                stop_at = time.perf_counter()
+                channel.send(json.dumps({"type": "stop_recording"}))
+                results.append(await _await_turn_end(http, events, stop_at, timeout_s))
+                if not results[-1].ok:
+                    break
+            return results
+    except asyncio.TimeoutError:
+        return results + [TurnResult(ok=False, error="timeout")]
+    except Exception as e:
+        return results + [TurnResult(ok=False, error=f"{type(e).__name__}: {e}")]
+    finally:
+        await pc.close()
+
+
+async def run_client_turn(base_url: str, wav_path: str, timeout_s: float) -> TurnResult:
+    """Một cuộc gọi một lượt: /offer, phát WAV, stop_recording, chờ end_of_session và audio phản hồi."""
+    return (await run_client_call(base_url, wav_path, 1, timeout_s))[0]
+
+
+async def run_level(base_url: str, wav_files: List[str], concurrency: int, turns_per_client: int,
+                    timeout_s: float, server: Optional[LocalServer], reuse_connection: bool = False) -> LevelResult:
+    """
+    Chạy `concurrency` client song song, mỗi client `turns_per_client` lượt nối tiếp:
+    mỗi lượt một cuộc gọi mới, hoặc tất cả trên một peer connection (reuse_connection).
+    """
+    result = LevelResult(concurrency=concurrency)
+
+    async def client_loop(index: int):
+        if reuse_connection:
+            wav = wav_files[index % len(wav_files)]
+            result.turns.extend(await run_client_call(base_url, wav, turns_per_client, timeout_s))
+            return
+        for turn in range(turns_per_client):
+            wav = wav_files[(index + turn) % len(wav_files)]
+            result.turns.append(await run_client_turn(base_url, wav, timeout_s))
+
+    cpu_before = server.cpu_seconds() if server else None
+    started = time.perf_counter()
+    await asyncio.gather(*(client_loop(i) for i in range(concurrency)))
+    result.wall_time_s = time.perf_counter() - started
+    cpu_after = server.cpu_seconds() if server else None
+    if cpu_before is not None and cpu_after is not None:
+        result.server_cpu_s = cpu_after - cpu_before
+    return result
+
+
+def summarize(level: LevelResult) -> Dict[str, Any]:
+    ok_turns = [t for t in level.turns if t.ok]
+    sessions = len(level.turns)
+    return {
+        "concurrency": level.concurrency,
+        "sessions": sessions,
+        "errors": sessions - len(ok_turns),
+        "error_rate": round((sessions - len(ok_turns)) / sessions, 4) if sessions else 0.0,
+        "error_samples": sorted({t.error for t in level.turns if t.error})[:5],
+        # Cuộc gọi bị admission control từ chối (503 nhanh), khác với timeout
+        "rejected": sum(1 for t in level.turns if t.error == "/offer HTTP 503"),
+        "turn_latency_ms": percentiles([t.turn_latency_s for t in ok_turns]),
+        "time_to_first_audio_ms": percentiles([t.ttfa_s for t in ok_turns if t.ttfa_s is not None]),
+        "server_cpu_s_per_session": round(level.server_cpu_s / sessions, 4)
+        if level.server_cpu_s is not None and sessions else None,
+        "wall_time_s": round(level.wall_time_s, 3),
+    }
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+async def main_async(args) -> Dict[str, Any]:
+    levels = [int(x) for x in args.levels.split(",") if x.strip()]
+    wav_files = args.wav
+
+    async def run_all(base_url: str, server: Optional[LocalServer]) -> List[Dict[str, Any]]:
+        summaries = []
+        for concurrency in levels:
+            summary = summarize(await run_level(base_url, wav_files, concurrency, args.turns, args.timeout, server,
+                                                args.reuse_connection))
+            summaries.append(summary)
+            print(json.dumps(summary, ensure_ascii=False), file=sys.stderr, flush=True)
+            p95 = summary["turn_latency_ms"]["p95"]
+            if summary["error_rate"] > args.max_error_rate or p95 is None or p95 > args.slo_p95_ms:
+                if args.stop_on_breach:
+                    break
+        return summaries
+
+    if args.url:
+        summaries = await run_all(args.url.rstrip("/"), None)
+    else:
+        async with LocalServer(args.port or _free_port()) as server:
+            summaries = await run_all(server.url, server)
+
+    sustainable = [s["concurrency"] for s in summaries
+                   if s["error_rate"] <= args.max_error_rate
+                   and s["turn_latency_ms"]["p95"] is not None
+                   and s["turn_latency_ms"]["p95"] <= args.slo_p95_ms]
+    return {
+        "benchmark": "webrtc_load",
+        "git_revision": _git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "wav_files": wav_files,
+        "turns_per_client": args.turns,
+        "reuse_connection": args.reuse_connection,
+        "slo_p95_ms": args.slo_p95_ms,
+        "max_error_rate": args.max_error_rate,
+        "levels": summaries,
+        "max_sustainable_concurrency": max(sustainable) if sustainable else 0,
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Load benchmark cho backend_webrtc_server.")
+    parser.add_argument("--wav", nargs="+", default=["user.wav"], help="File WAV phát lại (xoay vòng giữa các client).")
+    parser.add_argument("--levels", default="1,2,4,8", help="Các mức concurrency, ví dụ 1,2,4,8,16.")
+    parser.add_argument("--turns", type=int, default=2, help="Số cuộc gọi nối tiếp của mỗi client ở mỗi mức.")
+    parser.add_argument("--reuse-connection", action="store_true",
+                        help="Mọi lượt của một client dùng chung một peer connection (start_recording/stop_recording).")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Timeout mỗi cuộc gọi (giây).")
+    parser.add_argument("--slo-p95-ms", type=float, default=3000.0, help="SLO p95 latency để tính concurrency tối đa.")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--stop-on-breach", action="store_true", help="Dừng tăng tải khi vượt SLO.")
+    parser.add_argument("--url", help="Dùng server có sẵn thay vì tự khởi chạy.")
+    parser.add_argument("--port", type=int, help="Port cho server tự khởi chạy (mặc định: port trống).")
+    parser.add_argument("--output", help="Ghi JSON kết quả ra file (mặc định: stdout).")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    report = asyncio.run(main_async(args))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+# cancellation.py
+"""
+Hủy hợp tác cho một lượt nói. task.cancel() chỉ dừng coroutine đang await; việc đã giao cho thread
+(VAD, Whisper, DM, gTTS) vẫn chạy tới hết. CancelToken của lượt được gắn vào contextvars (to_thread và
+run_in_context copy context sang thread), code blocking gọi check_cancelled() ở các điểm dừng:
+  - VAD/KWS: trước và sau từng bước;
+  - Whisper: forward pre-hook trên encoder/decoder (mỗi bước decode), giữa các tầng cascade;
+  - DM: giữa NLU -> DB -> response (state chỉ ghi sau khi có response);
+  - TTS: giữa các đoạn gTTS và trước khi chuyển đổi audio.
+TurnCancelled kế thừa asyncio.CancelledError: không bị các khối `except Exception` nuốt mất.
+Thời gian worker đã bỏ ra cho lượt bị hủy được cộng vào voicebot_cancelled_work_seconds_total.
+"""
+import asyncio
+import contextvars
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from metrics_layer import CANCELLED_WORK_SECONDS, CANCEL_RELEASE_SECONDS, TURNS_CANCELLED
+
+
+class TurnCancelled(asyncio.CancelledError):
+    """Lượt đã bị hủy (người gọi gác máy, cancel_processing...)."""
+
+
+class CancelToken:
+    """Cờ hủy của một lượt, đọc được từ mọi thread; cộng dồn thời gian worker theo stage."""
+
+    def __init__(self, session_id: str = ""):
+        self.session_id = session_id
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self.reason: Optional[str] = None
+        self.cancelled_at: Optional[float] = None
+        self.work_seconds: Dict[str, float] = {}
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "cancelled") -> bool:
+        """Đánh dấu hủy (idempotent). Công việc đã làm trước đó của lượt được tính là lãng phí."""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self.cancelled_at = time.monotonic()
+            self._event.set()
+            for stage, seconds in self.work_seconds.items():
+                CANCELLED_WORK_SECONDS.labels(stage).inc(seconds)
+        TURNS_CANCELLED.labels(reason).inc()
+        return True
+
+    def check(self):
+        if self._event.is_set():
+            raise TurnCancelled(self.reason)
+
+    def add_work(self, stage: str, seconds: float):
+        with self._lock:
+            if self._event.is_set():
+                CANCELLED_WORK_SECONDS.labels(stage).inc(seconds)
+            self.work_seconds[stage] = self.work_seconds.get(stage, 0.0) + seconds
+
+    @property
+    def wasted_seconds(self) -> float:
+        return sum(self.work_seconds.values()) if self.cancelled else 0.0
+
+
+_current_token: contextvars.ContextVar[Optional[CancelToken]] = contextvars.ContextVar("voicebot_cancel_token", default=None)
+
+
+def bind(token: Optional[CancelToken]) -> "contextvars.Token[Optional[CancelToken]]":
+    """
+    Gắn token vào context hiện tại; các thread tạo sau đó nhìn thấy token này. Chỉ gọi trong task sở hữu lượt
+    (không gọi trong async generator: context của generator là context của task đang tiêu thụ nó).
+    """
+    return _current_token.set(token)
+
+
+def unbind(binding: "contextvars.Token[Optional[CancelToken]]"):
+    _current_token.reset(binding)
+
+
+@contextmanager
+def bound(token: Optional[CancelToken]) -> Iterator[Optional[CancelToken]]:
+    """bind() trong khối with, trả lại token cũ khi ra khỏi khối."""
+    binding = bind(token)
+    try:
+        yield token
+    finally:
+        unbind(binding)
+
+
+def current_token() -> Optional[CancelToken]:
+    return _current_token.get()
+
+
+def check_cancelled():
+    """Điểm dừng: raise TurnCancelled nếu lượt hiện tại đã bị hủy (no-op khi không có token)."""
+    token = _current_token.get()
+    if token is not None:
+        token.check()
+
+
+@contextmanager
+def tracked_work(stage: str) -> Iterator[None]:
+    """Đo thời gian worker của một stage; nếu lượt bị hủy trong lúc chạy, ghi thời gian từ lúc hủy tới lúc nhả worker."""
+    token = _current_token.get()
+    if token is not None:
+        token.check()
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        if token is not None:
+            end = time.monotonic()
+            token.add_work(stage, end - start)
+            if token.cancelled_at is not None and token.cancelled_at >= start:
+                CANCEL_RELEASE_SECONDS.labels(stage).observe(end - token.cancelled_at)
+
+
+def tracked(stage: str, func: Callable[..., Any]) -> Callable[..., Any]:
+    """Bọc hàm blocking (chạy trong thread) bằng tracked_work(stage)."""
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        with tracked_work(stage):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+# ==================== TORCH ====================
+_hooked_modules: "weakref.WeakSet[Any]" = weakref.WeakSet()
+_hook_lock = threading.Lock()
+
+
+def _checkpoint_hook(module: Any, args: Any):
+    check_cancelled()
+
+
+def install_checkpoints(model: Any):
+    """Forward pre-hook trên encoder/decoder của model Whisper: mỗi forward là một điểm dừng (idempotent)."""
+    for name in ("encoder", "decoder"):
+        module = getattr(model, name, None)
+        if module is None or not hasattr(module, "register_forward_pre_hook"):
+            continue
+        with _hook_lock:
+            if module not in _hooked_modules:
+                module.register_forward_pre_hook(_checkpoint_hook)
+                _hooked_modules.add(module)
@@ -29,11 +29,186 @@ class ConfigDB:
 
     # --- CONFIG ASR/NLU ---
     WHISPER_MODEL_NAME = "small"
+    # Fast path câu ngắn (asr_fastpath.py): encoder theo bucket độ dài thay vì pad 30 giây
+    # Tắt mặc định: chưa đo WER trên model thật (chỉ kiểm tra trên model ngẫu nhiên); bật bằng VOICEBOT_ASR_FASTPATH=1
+    ASR_FASTPATH_ENABLED = os.environ.get("VOICEBOT_ASR_FASTPATH", "0") == "1"
+    ASR_FASTPATH_BUCKETS_S = (2, 4, 8)
+    # ASR cascade: decode bằng model nhỏ trước, chỉ decode lại bằng WHISPER_MODEL_NAME khi kém tin cậy
+    # Tắt mặc định: ngưỡng chưa hiệu chỉnh trên dữ liệu thật; bật bằng VOICEBOT_ASR_CASCADE=1
+    ASR_CASCADE_ENABLED = os.environ.get("VOICEBOT_ASR_CASCADE", "0") == "1"
+    ASR_CASCADE_FIRST_MODEL = "tiny"
+    ASR_CASCADE_MIN_AVG_LOGPROB = -0.6
+    ASR_CASCADE_MAX_NO_SPEECH_PROB = 0.5
+    # Giảm chất lượng ASR theo tải (asr_quality.py): tầng 0 = chất lượng đầy đủ, tầng sau rẻ hơn.
+    # model None = giữ WHISPER_MODEL_NAME (+ cascade); decode: tham số whisper.DecodingOptions;
+    # max_audio_s: chỉ nhận dạng N giây đầu của lượt nói.
+    # Tắt mặc định: chưa đo WER của các tầng giảm chất lượng trên dữ liệu thật; bật bằng VOICEBOT_ASR_QUALITY_ADAPTIVE=1
+    ASR_QUALITY_ADAPTIVE = os.environ.get("VOICEBOT_ASR_QUALITY_ADAPTIVE", "0") == "1"
+    ASR_QUALITY_TIERS = (
+        {"name": "full", "model": None, "decode": {}, "max_audio_s": None},
+        {"name": "greedy", "model": None, "decode": {"temperature": 0.0}, "max_audio_s": 15.0},
+        {"name": "small_model", "model": "tiny", "decode": {"temperature": 0.0}, "max_audio_s": 8.0},
+        {"name": "minimal", "model": "tiny", "decode": {"temperature": 0.0, "sample_len": 48}, "max_audio_s": 4.0},
+    )
+    # Tải = max(queue executor / MAX_EXECUTOR_QUEUE_DEPTH, p95 ASR gần nhất / latency mục tiêu)
+    ASR_QUALITY_LATENCY_TARGET_S = 1.5
+    ASR_QUALITY_LATENCY_SAMPLES = 20
+    ASR_QUALITY_STEP_DOWN_LOAD = 1.0   # tải >= ngưỡng -> xuống một tầng
+    ASR_QUALITY_STEP_UP_LOAD = 0.5     # tải <= ngưỡng -> lên một tầng (hysteresis)
+    ASR_QUALITY_MIN_DWELL_S = 15.0     # thời gian tối thiểu giữa hai lần đổi tầng
     NLU_CONFIDENCE_THRESHOLD = 0.6 
+    # Keyword spotting (keyword_spotter.py): câu lệnh cố định khớp template -> bỏ qua Whisper + NLU
+    # Tắt mặc định: chưa đo tỉ lệ khớp nhầm trên dữ liệu thật; bật bằng VOICEBOT_KWS=1
+    KWS_ENABLED = os.environ.get("VOICEBOT_KWS", "0") == "1"
+    KWS_PHRASES = {
+        "chao_hoi": ["xin chào", "chào bạn", "alo"],
+        "tam_biet": ["tạm biệt", "chào tạm biệt"],
+        "small_talk": ["cảm ơn", "cảm ơn bạn"],
+    }
+    KWS_MAX_SECONDS = 2.5    # audio sau VAD dài hơn -> luôn qua ASR
+    KWS_MAX_DISTANCE = 0.35  # khoảng cách DTW (cosine, chia độ dài đường đi)
+    KWS_MIN_MARGIN = 0.15    # tốt hơn intent đứng thứ hai ít nhất 15%
+    # Prefetch suy đoán (speculative_prefetch.py): NLU trên transcript tạm (ASR định kỳ khi người gọi còn nói,
+    # transcript tầng cascade bị decode lại); intent + entity ổn định -> tra DB sớm, transcript cuối xác nhận/bỏ
+    SPECULATIVE_PREFETCH_ENABLED = os.environ.get("VOICEBOT_SPECULATIVE_PREFETCH", "0") == "1"
+    SPECULATIVE_PARTIAL_INTERVAL_S = 1.0   # ASR tạm mỗi khi lượt ghi thêm được chừng này giây audio
+    SPECULATIVE_PARTIAL_MIN_S = 1.0        # lượt ngắn hơn: không chạy ASR tạm
+    SPECULATIVE_PARTIAL_MODEL = "tiny"     # ASR tạm chỉ chạy khi model này đang rảnh (không làm chậm lượt thật)
+    SPECULATIVE_STABLE_PARTIALS = 2        # số transcript tạm liên tiếp cùng intent + entity
+    SPECULATIVE_MAX_AGE_S = 10.0           # kết quả prefetch cũ hơn -> bỏ, tra lại
+    SPECULATIVE_PREFETCH_WORKERS = 2
+    # Câu đệm che độ trễ (filler_audio.py): intent dự kiến chậm (DB/LLM) -> client phát ngay câu đệm render sẵn,
+    # phản hồi thật nối tiếp sau
+    FILLER_ENABLED = os.environ.get("VOICEBOT_FILLER", "0") == "1"
+    FILLER_THRESHOLD_S = 1.2       # thời gian dự kiến từ lúc có intent tới chunk TTS đầu tiên
+    FILLER_EWMA_ALPHA = 0.3
+    # Dự kiến ban đầu (giây) cho intent chưa có số đo; intent không có ở đây -> chờ có số đo thật
+    FILLER_INTENT_PRIORS_S = {"query_product_info": 1.5, "query_customer_info": 1.5, "check_order_status": 1.5}
+    FILLER_PHRASES = {
+        "default": ["Dạ, em kiểm tra ngay ạ.", "Dạ, anh chị chờ em một chút ạ."],
+        "check_order_status": ["Dạ, em kiểm tra đơn hàng ngay ạ."],
+    }
+    FILLER_CACHE_DIR = "filler_cache"
+    FILLER_FADE_MS = 20
+    # Ghép TTS theo mẫu (tts_splicer.py): phản hồi DB theo mẫu -> nối clip render sẵn (câu mang, tên trong catalog,
+    # từ đọc số) thay vì gọi gTTS cả câu
+    TTS_SPLICE_ENABLED = os.environ.get("VOICEBOT_TTS_SPLICE", "0") == "1"
+    TTS_SPLICE_CACHE_DIR = "tts_clip_cache"
+    # Giá trị slot không phải số được render trước (tên sản phẩm/khách hàng trong DB); giá trị khác render khi gặp lần đầu
+    TTS_SPLICE_CATALOG = ["Sản phẩm A (điện thoại)", "Sản phẩm B (laptop)", "Nguyễn Văn A", "Đã giao hàng hôm qua"]
+    TTS_SPLICE_CROSSFADE_MS = 15   # chồng giữa các từ đọc số
+    TTS_SPLICE_GAP_MS = 60         # lặng giữa câu mang và slot
+    TTS_SPLICE_SENTENCE_GAP_MS = 300
     
     # --- CONFIG AUDIO IO ---
     SAMPLE_RATE = 16000 # 16kHz
+    # Ring buffer ghi âm (audio_buffer.py): độ dài tối đa 1 lượt nói và tổng bộ nhớ cho phép
+    MAX_UTTERANCE_SECONDS = 30.0
+    AUDIO_BUFFER_BUDGET_MB = 256
+    # Pre-gate năng lượng + zero-crossing trước Silero VAD (audio_frontend.energy_gate)
+    PREGATE_ENABLED = os.environ.get("VOICEBOT_PREGATE", "0") == "1"
+    PREGATE_FRAME_MS = 30
+    PREGATE_ENERGY_FLOOR_DB = -50.0  # dBFS, dưới mức này coi là im lặng
+    PREGATE_LOUD_MARGIN_DB = 15.0    # to hơn floor + margin thì giữ bất kể ZCR
+    PREGATE_ZCR_MAX = 0.25
+    PREGATE_HANGOVER_MS = 200
+    # Tách lượt trong một cuộc gọi WebRTC: "client" (tin nhắn start/stop_recording) | "vad" (endpointing phía server)
+    TURN_SEGMENTATION = os.environ.get("VOICEBOT_TURN_SEGMENTATION", "client")
+    ENDPOINT_SPEECH_DB = -45.0     # dBFS, block to hơn mức này là tiếng nói
+    ENDPOINT_MIN_SPEECH_MS = 200   # tiếng nói liên tục tối thiểu để mở lượt
+    ENDPOINT_SILENCE_MS = 700      # im lặng liên tục để đóng lượt
+    ENDPOINT_PREROLL_MS = 300      # audio giữ lại trước điểm mở lượt
+    # Barge-in: vẫn chạy VAD trên track vào khi bot đang tổng hợp/phát phản hồi; người gọi nói chen -> hủy TTS, mở lượt mới
+    BARGE_IN_ENABLED = os.environ.get("VOICEBOT_BARGE_IN", "0") == "1"
+    BARGE_IN_SPEECH_DB = -35.0     # cao hơn ENDPOINT_SPEECH_DB: tiếng vọng của loa (sau AEC) không kích hoạt
+    BARGE_IN_MIN_SPEECH_MS = 300
+    BARGE_IN_PLAYBACK_MARGIN_S = 1.0  # client không báo playback_ended: ngừng theo dõi sau độ dài audio + margin
     
+    # --- CONFIG LOGGING (logging_layer.py) ---
+    # DEBUG chỉ bật khi cần điều tra; ở production message DEBUG không được format.
+    LOG_LEVEL_DEFAULT = os.environ.get("VOICEBOT_LOG_LEVEL", "INFO")
+    # Lọc theo module, ví dụ {"rtc": "DEBUG", "dm": "WARNING"}
+    LOG_MODULE_LEVELS = {}
+    LOG_QUEUE_SIZE = 10000
+
+    # --- CONFIG METRICS (metrics_layer.py) ---
+    # Tách khỏi port 8000 của FastAPI/uvicorn
+    PROMETHEUS_PORT = int(os.environ.get("PROMETHEUS_PORT", "9100"))
+    APP_SERVICE_NAME = "HybridVoiceBot"
+    STAGE_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0)
+
+    # Số mẫu latency gần nhất mỗi stage (cho /healthz, /readyz)
+    RECENT_LATENCY_WINDOW = 200
+
+    # --- CONFIG WEBRTC (backend_webrtc_server.py) ---
+    WEBRTC_ICE_SERVERS = [{"urls": "stun:stun.l.google.com:19302"}]
+    # LAN: chỉ host candidate (không hỏi STUN) -> answer trả về ngay, hợp với client cùng mạng nội bộ
+    WEBRTC_LAN_MODE = os.environ.get("VOICEBOT_WEBRTC_LAN_MODE", "0") == "1"
+    # Số candidate tối đa giữ chờ mỗi session khi /offer chưa tới (trickle ICE)
+    WEBRTC_MAX_PENDING_CANDIDATES = 32
+    # Hàng chờ candidate chỉ mở cho session đang đàm phán (WS signaling mở hoặc /offer đang xử lý);
+    # quá TTL hoặc vượt số session tối đa -> bỏ hàng chờ cũ nhất
+    WEBRTC_PENDING_CANDIDATE_TTL_S = 30.0
+    WEBRTC_MAX_PENDING_SESSIONS = 256
+    # Vòng đời peer connection (connection_manager.py): quá hạn -> đóng PC và giải phóng session
+    CONN_CONNECT_TIMEOUT_S = 30.0    # chưa tới trạng thái connected sau /offer
+    CONN_IDLE_TIMEOUT_S = float(os.environ.get("VOICEBOT_CONN_IDLE_TIMEOUT_S", "300"))
+    CONN_MAX_LIFETIME_S = float(os.environ.get("VOICEBOT_CONN_MAX_LIFETIME_S", "3600"))
+    CONN_SWEEP_INTERVAL_S = 5.0
+    # PC đã đóng còn trong bộ nhớ quá lâu (sau gc) -> tính là leak
+    CONN_LEAK_GRACE_S = 60.0
+
+    # --- CONFIG CAPACITY (/readyz) ---
+    # Vượt quá ngưỡng -> /readyz trả 503 để load balancer không gửi thêm cuộc gọi
+    MAX_ACTIVE_SESSIONS = int(os.environ.get("VOICEBOT_MAX_ACTIVE_SESSIONS", "20"))
+    MAX_EXECUTOR_QUEUE_DEPTH = int(os.environ.get("VOICEBOT_MAX_EXECUTOR_QUEUE_DEPTH", "8"))
+
+    # --- CONFIG ADMISSION (/offer, admission_control.py) ---
+    # Quá tải -> /offer trả 503 + Retry-After ngay, thay vì nhận cuộc gọi rồi để mọi người cùng timeout
+    ADMISSION_ENABLED = os.environ.get("VOICEBOT_ADMISSION_ENABLED", "0") == "1"
+    ADMISSION_MAX_TURN_P95_S = float(os.environ.get("VOICEBOT_ADMISSION_MAX_TURN_P95_S", "4.0"))
+    ADMISSION_LATENCY_SAMPLES = 20
+    # Mẫu latency cũ hơn thế này không tính (node rảnh lâu thì p95 cũ không còn chặn cuộc gọi mới)
+    ADMISSION_LATENCY_MAX_AGE_S = 60.0
+    # Cuộc gọi mới chỉ được dùng phần này của queue/latency; phần còn lại dành cho lượt của cuộc gọi đang diễn ra
+    ADMISSION_NEW_CALL_HEADROOM = 0.75
+    ADMISSION_RETRY_AFTER_S = 5
+    ADMISSION_MAX_RETRY_AFTER_S = 60
+
+    # --- CONFIG TURN SCHEDULER (turn_scheduler.py) ---
+    # Weighted fair queuing giữa các tenant (api_key) trước ASR và DM; trong một tenant: audio ngắn chạy trước
+    TURN_SCHED_ENABLED = os.environ.get("VOICEBOT_TURN_SCHED_ENABLED", "0") == "1"
+    # Số bản Whisper nạp cho mỗi model (model_registry nạp một bản dùng chung; ModelPool capacity=1)
+    ASR_MODEL_INSTANCES = 1
+    # Số lượt chạy đồng thời mỗi stage (ASR: không vượt số bản model; DM: khớp ThreadPoolExecutor 1 worker)
+    TURN_SCHED_CONCURRENCY = {"asr": ASR_MODEL_INSTANCES, "dm": 1}
+    TURN_SCHED_DEFAULT_WEIGHT = 1.0
+    # None: không giới hạn số lượt đồng thời của một tenant (ngoài capacity của stage)
+    TURN_SCHED_DEFAULT_MAX_CONCURRENCY = None
+    # api_key -> {"name": nhãn metrics, "weight": trọng số, "max_concurrency": trần lượt đồng thời mỗi stage}
+    TURN_SCHED_TENANTS = {}
+
+    # --- CONFIG TRACING (tracing_layer.py) ---
+    # FILE (OTLP JSON lines) | OTLP_HTTP (gửi tới collector) | MEMORY (collector stub) | NONE
+    # Mặc định: gửi OTLP_HTTP nếu có đặt OTLP_ENDPOINT, ngược lại không export
+    OTLP_ENDPOINT = os.environ.get("OTLP_ENDPOINT", "")
+    TRACE_EXPORTER = os.environ.get("VOICEBOT_TRACE_EXPORTER", "OTLP_HTTP" if OTLP_ENDPOINT else "NONE")
+    TRACE_FILE_PATH = "traces/otlp_traces.jsonl"
+    TRACE_FILE_MAX_BYTES = 50 * 1024 * 1024   # FILE: vượt kích thước này -> xoay sang .1, .2...
+    TRACE_FILE_BACKUPS = 3
+
+    # --- CONFIG MODEL REGISTRY (model_registry.py) ---
+    # Thư mục artifact cục bộ: models/silero-vad/ (repo clone) và models/whisper/<tên>.pt.
+    # Không có trong artifact dir -> dùng cache sẵn có (~/.cache/whisper, cache torch.hub) trước khi báo lỗi.
+    # Deploy không có cache và không cho tải: đặt VOICEBOT_MODEL_DIR trỏ tới weight đã chuẩn bị sẵn.
+    MODEL_ARTIFACT_DIR = os.environ.get("VOICEBOT_MODEL_DIR", "models")
+    # False: không bao giờ gọi mạng (GitHub/OpenAI CDN) khi tải model; True: tải vào cache chuẩn của whisper/torch.hub
+    ALLOW_MODEL_DOWNLOAD = os.environ.get("VOICEBOT_ALLOW_MODEL_DOWNLOAD", "0") == "1"
+    MODEL_WARMUP_ON_START = True
+    # VAD: "onnx" (onnxruntime, không cần torch) | "torch" (torch.hub) | "auto" (onnx nếu có weight + onnxruntime)
+    # Mặc định "torch" như trước; "onnx"/"auto" bật khi đã so kết quả VAD hai engine trên dữ liệu thật
+    VAD_ENGINE = os.environ.get("VOICEBOT_VAD_ENGINE", "torch")
+
     # --- CONFIG DIALOG MANAGER ---
     INITIAL_STATE = "START" 
     SCENARIOS_CONFIG = { 
@@ -62,7 +237,110 @@ TTS_VOICE_NAME_DEFAULT = ConfigDB.TTS_VOICE_NAME_DEFAULT
 
 NLU_CONFIDENCE_THRESHOLD = ConfigDB.NLU_CONFIDENCE_THRESHOLD
 WHISPER_MODEL_NAME = ConfigDB.WHISPER_MODEL_NAME
+ASR_FASTPATH_ENABLED = ConfigDB.ASR_FASTPATH_ENABLED
+ASR_FASTPATH_BUCKETS_S = ConfigDB.ASR_FASTPATH_BUCKETS_S
+ASR_CASCADE_ENABLED = ConfigDB.ASR_CASCADE_ENABLED
+ASR_CASCADE_FIRST_MODEL = ConfigDB.ASR_CASCADE_FIRST_MODEL
+ASR_CASCADE_MIN_AVG_LOGPROB = ConfigDB.ASR_CASCADE_MIN_AVG_LOGPROB
+ASR_CASCADE_MAX_NO_SPEECH_PROB = ConfigDB.ASR_CASCADE_MAX_NO_SPEECH_PROB
+ASR_QUALITY_ADAPTIVE = ConfigDB.ASR_QUALITY_ADAPTIVE
+ASR_QUALITY_TIERS = ConfigDB.ASR_QUALITY_TIERS
+ASR_QUALITY_LATENCY_TARGET_S = ConfigDB.ASR_QUALITY_LATENCY_TARGET_S
+ASR_QUALITY_LATENCY_SAMPLES = ConfigDB.ASR_QUALITY_LATENCY_SAMPLES
+ASR_QUALITY_STEP_DOWN_LOAD = ConfigDB.ASR_QUALITY_STEP_DOWN_LOAD
+ASR_QUALITY_STEP_UP_LOAD = ConfigDB.ASR_QUALITY_STEP_UP_LOAD
+ASR_QUALITY_MIN_DWELL_S = ConfigDB.ASR_QUALITY_MIN_DWELL_S
+KWS_ENABLED = ConfigDB.KWS_ENABLED
+KWS_PHRASES = ConfigDB.KWS_PHRASES
+KWS_MAX_SECONDS = ConfigDB.KWS_MAX_SECONDS
+KWS_MAX_DISTANCE = ConfigDB.KWS_MAX_DISTANCE
+KWS_MIN_MARGIN = ConfigDB.KWS_MIN_MARGIN
+SPECULATIVE_PREFETCH_ENABLED = ConfigDB.SPECULATIVE_PREFETCH_ENABLED
+SPECULATIVE_PARTIAL_INTERVAL_S = ConfigDB.SPECULATIVE_PARTIAL_INTERVAL_S
+SPECULATIVE_PARTIAL_MIN_S = ConfigDB.SPECULATIVE_PARTIAL_MIN_S
+SPECULATIVE_PARTIAL_MODEL = ConfigDB.SPECULATIVE_PARTIAL_MODEL
+SPECULATIVE_STABLE_PARTIALS = ConfigDB.SPECULATIVE_STABLE_PARTIALS
+SPECULATIVE_MAX_AGE_S = ConfigDB.SPECULATIVE_MAX_AGE_S
+SPECULATIVE_PREFETCH_WORKERS = ConfigDB.SPECULATIVE_PREFETCH_WORKERS
+FILLER_ENABLED = ConfigDB.FILLER_ENABLED
+FILLER_THRESHOLD_S = ConfigDB.FILLER_THRESHOLD_S
+FILLER_EWMA_ALPHA = ConfigDB.FILLER_EWMA_ALPHA
+FILLER_INTENT_PRIORS_S = ConfigDB.FILLER_INTENT_PRIORS_S
+FILLER_PHRASES = ConfigDB.FILLER_PHRASES
+FILLER_CACHE_DIR = ConfigDB.FILLER_CACHE_DIR
+FILLER_FADE_MS = ConfigDB.FILLER_FADE_MS
+TTS_SPLICE_ENABLED = ConfigDB.TTS_SPLICE_ENABLED
+TTS_SPLICE_CACHE_DIR = ConfigDB.TTS_SPLICE_CACHE_DIR
+TTS_SPLICE_CATALOG = ConfigDB.TTS_SPLICE_CATALOG
+TTS_SPLICE_CROSSFADE_MS = ConfigDB.TTS_SPLICE_CROSSFADE_MS
+TTS_SPLICE_GAP_MS = ConfigDB.TTS_SPLICE_GAP_MS
+TTS_SPLICE_SENTENCE_GAP_MS = ConfigDB.TTS_SPLICE_SENTENCE_GAP_MS
 SAMPLE_RATE = ConfigDB.SAMPLE_RATE
+MAX_UTTERANCE_SECONDS = ConfigDB.MAX_UTTERANCE_SECONDS
+AUDIO_BUFFER_BUDGET_MB = ConfigDB.AUDIO_BUFFER_BUDGET_MB
+PREGATE_ENABLED = ConfigDB.PREGATE_ENABLED
+PREGATE_FRAME_MS = ConfigDB.PREGATE_FRAME_MS
+PREGATE_ENERGY_FLOOR_DB = ConfigDB.PREGATE_ENERGY_FLOOR_DB
+PREGATE_LOUD_MARGIN_DB = ConfigDB.PREGATE_LOUD_MARGIN_DB
+PREGATE_ZCR_MAX = ConfigDB.PREGATE_ZCR_MAX
+PREGATE_HANGOVER_MS = ConfigDB.PREGATE_HANGOVER_MS
+TURN_SEGMENTATION = ConfigDB.TURN_SEGMENTATION
+ENDPOINT_SPEECH_DB = ConfigDB.ENDPOINT_SPEECH_DB
+ENDPOINT_MIN_SPEECH_MS = ConfigDB.ENDPOINT_MIN_SPEECH_MS
+ENDPOINT_SILENCE_MS = ConfigDB.ENDPOINT_SILENCE_MS
+ENDPOINT_PREROLL_MS = ConfigDB.ENDPOINT_PREROLL_MS
+BARGE_IN_ENABLED = ConfigDB.BARGE_IN_ENABLED
+BARGE_IN_SPEECH_DB = ConfigDB.BARGE_IN_SPEECH_DB
+BARGE_IN_MIN_SPEECH_MS = ConfigDB.BARGE_IN_MIN_SPEECH_MS
+BARGE_IN_PLAYBACK_MARGIN_S = ConfigDB.BARGE_IN_PLAYBACK_MARGIN_S
+
+LOG_LEVEL_DEFAULT = ConfigDB.LOG_LEVEL_DEFAULT
+LOG_MODULE_LEVELS = ConfigDB.LOG_MODULE_LEVELS
+LOG_QUEUE_SIZE = ConfigDB.LOG_QUEUE_SIZE
+
+PROMETHEUS_PORT = ConfigDB.PROMETHEUS_PORT
+APP_SERVICE_NAME = ConfigDB.APP_SERVICE_NAME
+STAGE_LATENCY_BUCKETS = ConfigDB.STAGE_LATENCY_BUCKETS
+RECENT_LATENCY_WINDOW = ConfigDB.RECENT_LATENCY_WINDOW
+
+WEBRTC_ICE_SERVERS = ConfigDB.WEBRTC_ICE_SERVERS
+WEBRTC_LAN_MODE = ConfigDB.WEBRTC_LAN_MODE
+WEBRTC_MAX_PENDING_CANDIDATES = ConfigDB.WEBRTC_MAX_PENDING_CANDIDATES
+WEBRTC_PENDING_CANDIDATE_TTL_S = ConfigDB.WEBRTC_PENDING_CANDIDATE_TTL_S
+WEBRTC_MAX_PENDING_SESSIONS = ConfigDB.WEBRTC_MAX_PENDING_SESSIONS
+CONN_CONNECT_TIMEOUT_S = ConfigDB.CONN_CONNECT_TIMEOUT_S
+CONN_IDLE_TIMEOUT_S = ConfigDB.CONN_IDLE_TIMEOUT_S
+CONN_MAX_LIFETIME_S = ConfigDB.CONN_MAX_LIFETIME_S
+CONN_SWEEP_INTERVAL_S = ConfigDB.CONN_SWEEP_INTERVAL_S
+CONN_LEAK_GRACE_S = ConfigDB.CONN_LEAK_GRACE_S
+
+MAX_ACTIVE_SESSIONS = ConfigDB.MAX_ACTIVE_SESSIONS
+MAX_EXECUTOR_QUEUE_DEPTH = ConfigDB.MAX_EXECUTOR_QUEUE_DEPTH
+ADMISSION_ENABLED = ConfigDB.ADMISSION_ENABLED
+ADMISSION_MAX_TURN_P95_S = ConfigDB.ADMISSION_MAX_TURN_P95_S
+ADMISSION_LATENCY_SAMPLES = ConfigDB.ADMISSION_LATENCY_SAMPLES
+ADMISSION_LATENCY_MAX_AGE_S = ConfigDB.ADMISSION_LATENCY_MAX_AGE_S
+ADMISSION_NEW_CALL_HEADROOM = ConfigDB.ADMISSION_NEW_CALL_HEADROOM
+ADMISSION_RETRY_AFTER_S = ConfigDB.ADMISSION_RETRY_AFTER_S
+ADMISSION_MAX_RETRY_AFTER_S = ConfigDB.ADMISSION_MAX_RETRY_AFTER_S
+
+TURN_SCHED_ENABLED = ConfigDB.TURN_SCHED_ENABLED
+ASR_MODEL_INSTANCES = ConfigDB.ASR_MODEL_INSTANCES
+TURN_SCHED_CONCURRENCY = ConfigDB.TURN_SCHED_CONCURRENCY
+TURN_SCHED_DEFAULT_WEIGHT = ConfigDB.TURN_SCHED_DEFAULT_WEIGHT
+TURN_SCHED_DEFAULT_MAX_CONCURRENCY = ConfigDB.TURN_SCHED_DEFAULT_MAX_CONCURRENCY
+TURN_SCHED_TENANTS = ConfigDB.TURN_SCHED_TENANTS
+
+TRACE_EXPORTER = ConfigDB.TRACE_EXPORTER
+TRACE_FILE_PATH = ConfigDB.TRACE_FILE_PATH
+TRACE_FILE_MAX_BYTES = ConfigDB.TRACE_FILE_MAX_BYTES
+TRACE_FILE_BACKUPS = ConfigDB.TRACE_FILE_BACKUPS
+OTLP_ENDPOINT = ConfigDB.OTLP_ENDPOINT
+
+MODEL_ARTIFACT_DIR = ConfigDB.MODEL_ARTIFACT_DIR
+ALLOW_MODEL_DOWNLOAD = ConfigDB.ALLOW_MODEL_DOWNLOAD
+MODEL_WARMUP_ON_START = ConfigDB.MODEL_WARMUP_ON_START
+VAD_ENGINE = ConfigDB.VAD_ENGINE
 
 SCENARIOS_CONFIG = ConfigDB.SCENARIOS_CONFIG
 INITIAL_STATE = ConfigDB.INITIAL_STATE
\ No newline at end of file
@@ -36,16 +36,14 @@ class DBConnector:
         return db_response
 
 # --- METRICS (metrics_layer.py) ---
-PROMETHEUS_PORT = 8000
-APP_SERVICE_NAME = "HybridVoiceBot"
+from config_db import PROMETHEUS_PORT, APP_SERVICE_NAME
+import metrics_layer
 
 def record_session_start(nlu_mode, db_mode):
-    # Giả lập hàm ghi metric (cần thư viện prometheus_client thực tế)
-    pass 
+    metrics_layer.record_session_start(nlu_mode, db_mode)
 
 def record_session_error(nlu_mode, db_mode):
-    # Giả lập hàm ghi metric (cần thư viện prometheus_client thực tế)
-    pass
+    metrics_layer.record_session_error(nlu_mode, db_mode)
 
 # --- KHỞI TẠO THƯ MỤC CẦN THIẾT ---
 if not os.path.exists("data"):
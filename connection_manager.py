@@ -0,0 +1,249 @@
+# connection_manager.py
+"""
+Quản lý vòng đời RTCPeerConnection theo session: đăng ký mọi PC tạo ra trong /offer, theo dõi
+connectionstatechange, áp timeout (chưa kết nối / idle / thời gian sống tối đa) và đóng + giải phóng
+mọi thứ gắn với session (PC, recorder, task xử lý, callback dọn dẹp) đúng một lần.
+Metrics: số PC/task đang sống và số PC đã đóng nhưng vẫn còn trong bộ nhớ (leak).
+"""
+import asyncio
+import gc
+import secrets
+import time
+import weakref
+from typing import Any, Callable, Dict, List, Optional
+
+from logging_layer import get_logger
+from metrics_layer import (
+    PEER_CONNECTIONS_LIVE, PEER_CONNECTIONS_LEAKED, CONNECTION_TASKS_LIVE, PEER_CONNECTIONS_CLOSED,
+    session_opened, session_closed
+)
+
+# --- SAFE IMPORT CONFIG ---
+try:
+    from config_db import CONN_CONNECT_TIMEOUT_S, CONN_IDLE_TIMEOUT_S, CONN_MAX_LIFETIME_S, CONN_SWEEP_INTERVAL_S, CONN_LEAK_GRACE_S
+except ImportError:
+    CONN_CONNECT_TIMEOUT_S = 30.0
+    CONN_IDLE_TIMEOUT_S = 300.0
+    CONN_MAX_LIFETIME_S = 3600.0
+    CONN_SWEEP_INTERVAL_S = 5.0
+    CONN_LEAK_GRACE_S = 60.0
+
+_log = get_logger("connections")
+
+
+class ManagedConnection:
+    """Một cuộc gọi: PC + recorder + task đang chạy + callback dọn dẹp."""
+
+    def __init__(self, session_id: str, pc: Any):
+        self.session_id = session_id
+        self.pc = pc
+        self.recorder: Any = None
+        self.created_at = time.monotonic()
+        self.last_activity = self.created_at
+        self.connected_at: Optional[float] = None
+        self.processing_task: Optional[asyncio.Task] = None
+        self.cancel_token: Any = None
+        self.tasks: "weakref.WeakSet[asyncio.Task]" = weakref.WeakSet()
+        self._on_close: List[Callable[[], Any]] = []
+        self.closed = False
+        # Bí mật cấp cho peer trong answer: /offer lại cùng session_id phải gửi kèm mới được coi là cùng cuộc gọi
+        self.peer_token = secrets.token_urlsafe(16)
+
+    def owned_by(self, peer_token: Optional[str]) -> bool:
+        """True nếu peer_token khớp token đã cấp cho peer của cuộc gọi này."""
+        return bool(peer_token) and secrets.compare_digest(str(peer_token), self.peer_token)
+
+    def touch(self):
+        """Đánh dấu có hoạt động (tin nhắn data channel, lượt nói...) để tính idle timeout."""
+        self.last_activity = time.monotonic()
+
+    def on_close(self, callback: Callable[[], Any]):
+        self._on_close.append(callback)
+
+    def track_task(self, task: asyncio.Task) -> asyncio.Task:
+        """Task gắn với cuộc gọi: bị hủy khi cuộc gọi đóng."""
+        self.tasks.add(task)
+        return task
+
+    def set_processing_task(self, task: asyncio.Task, cancel_token: Any = None):
+        """Task xử lý lượt hiện tại (hủy được qua cancel_processing); tự gỡ khi xong."""
+        self.processing_task = self.track_task(task)
+        self.cancel_token = cancel_token
+
+        def clear(done: asyncio.Task):
+            if self.processing_task is done:
+                self.processing_task = None
+                self.cancel_token = None
+        task.add_done_callback(clear)
+
+    def cancel_processing(self, reason: str = "cancelled") -> bool:
+        """Hủy lượt đang xử lý: đặt token (dừng việc trong thread ở điểm kiểm tra kế tiếp) rồi hủy task."""
+        task = self.processing_task
+        if task is None or task.done():
+            return False
+        if self.cancel_token is not None:
+            self.cancel_token.cancel(reason)
+        task.cancel()
+        return True
+
+    def live_tasks(self) -> int:
+        return sum(1 for task in list(self.tasks) if not task.done())
+
+
+class ConnectionManager:
+    """
+    Registry các cuộc gọi WebRTC. close() là điểm dọn dẹp duy nhất:
+    hủy task, đóng recorder, chạy callback on_close, await pc.close(), giảm bộ đếm session.
+    Sweeper nền đóng PC không kết nối được sau connect_timeout_s, idle quá idle_timeout_s
+    hoặc sống quá max_lifetime_s.
+    """
+
+    def __init__(self, connect_timeout_s: float = CONN_CONNECT_TIMEOUT_S, idle_timeout_s: float = CONN_IDLE_TIMEOUT_S,
+                 max_lifetime_s: float = CONN_MAX_LIFETIME_S, sweep_interval_s: float = CONN_SWEEP_INTERVAL_S,
+                 leak_grace_s: float = CONN_LEAK_GRACE_S):
+        self.connect_timeout_s = connect_timeout_s
+        self.idle_timeout_s = idle_timeout_s
+        self.max_lifetime_s = max_lifetime_s
+        self.sweep_interval_s = sweep_interval_s
+        self.leak_grace_s = leak_grace_s
+        self._connections: Dict[str, ManagedConnection] = {}
+        # PC đã đóng -> thời điểm đóng (weak). Còn sống sau leak_grace_s và sau một lượt gc -> leak
+        # (vẫn còn tham chiếu mạnh ở đâu đó). Trong grace period có thể chỉ là rác vòng chưa thu gom.
+        self._closed_pcs: "weakref.WeakKeyDictionary[Any, float]" = weakref.WeakKeyDictionary()
+        self._last_gc = float("-inf")
+        self._sweeper: Optional[asyncio.Task] = None
+        PEER_CONNECTIONS_LIVE.set_function(lambda: len(self._connections))
+        PEER_CONNECTIONS_LEAKED.set_function(self.leaked_count)
+        CONNECTION_TASKS_LIVE.set_function(self.live_task_count)
+
+    # ---------- đăng ký ----------
+    def register(self, session_id: str, pc: Any) -> ManagedConnection:
+        """Đăng ký PC mới của session (session_id trùng: đóng cuộc gọi cũ trước)."""
+        previous = self._connections.get(session_id)
+        if previous is not None:
+            # Đóng đúng cuộc gọi cũ (close(session_id) sau khi đăng ký sẽ trúng cuộc gọi mới)
+            asyncio.ensure_future(self.close_connection(previous, "replaced"))
+        conn = ManagedConnection(session_id, pc)
+        self._connections[session_id] = conn
+        session_opened()
+
+        @pc.on("connectionstatechange")
+        async def on_connectionstatechange():
+            state = pc.connectionState
+            if state == "connected" and conn.connected_at is None:
+                conn.connected_at = time.monotonic()
+                conn.touch()
+            elif state in ("failed", "closed"):
+                await self.close_connection(conn, state)
+
+        return conn
+
+    def get(self, session_id: str) -> Optional[ManagedConnection]:
+        return self._connections.get(session_id)
+
+    def __len__(self) -> int:
+        return len(self._connections)
+
+    # ---------- đóng ----------
+    async def close(self, session_id: str, reason: str = "closed"):
+        conn = self._connections.get(session_id)
+        if conn is not None:
+            await self.close_connection(conn, reason)
+
+    async def close_connection(self, conn: ManagedConnection, reason: str):
+        if conn.closed:
+            return
+        conn.closed = True
+        if self._connections.get(conn.session_id) is conn:
+            del self._connections[conn.session_id]
+        session_closed()
+        PEER_CONNECTIONS_CLOSED.labels(reason).inc()
+        _log("🔌 [CONN] Đóng cuộc gọi %s (%s, sống %.1fs).", "yellow",
+             conn.session_id, reason, time.monotonic() - conn.created_at)
+
+        conn.cancel_processing("hangup")
+        for task in list(conn.tasks):
+            if not task.done():
+                task.cancel()
+        if conn.recorder is not None:
+            conn.recorder.close()
+        for callback in conn._on_close:
+            try:
+                callback()
+            except Exception as e:
+                _log.warning("⚠️ [CONN] Lỗi callback đóng %s: %s", conn.session_id, e)
+        conn._on_close.clear()
+        try:
+            await conn.pc.close()
+        except Exception as e:
+            _log.warning("⚠️ [CONN] Lỗi khi đóng PC %s: %s", conn.session_id, e)
+        # Handler của PC giữ closure (conn, recorder, DM...): gỡ để PC được thu gom ngay, không chờ GC vòng
+        remove_listeners = getattr(conn.pc, "remove_all_listeners", None)
+        if remove_listeners is not None:
+            remove_listeners()
+        self._closed_pcs[conn.pc] = time.monotonic()
+
+    async def close_all(self, reason: str = "shutdown"):
+        await asyncio.gather(*(self.close_connection(c, reason) for c in list(self._connections.values())))
+
+    # ---------- timeout ----------
+    def expired_reason(self, conn: ManagedConnection, now: float) -> Optional[str]:
+        if conn.connected_at is None and now - conn.created_at > self.connect_timeout_s:
+            return "connect_timeout"
+        if now - conn.created_at > self.max_lifetime_s:
+            return "max_lifetime"
+        if conn.processing_task is None and now - conn.last_activity > self.idle_timeout_s:
+            return "idle_timeout"
+        return None
+
+    async def sweep(self):
+        now = time.monotonic()
+        for conn in list(self._connections.values()):
+            reason = self.expired_reason(conn, now)
+            if reason:
+                await self.close_connection(conn, reason)
+        # PC đóng quá grace mà vẫn sống: thu gom rác vòng trước khi tính là leak (tối đa mỗi grace một lần)
+        if self._overdue_closed(now) and now - self._last_gc >= self.leak_grace_s:
+            self._last_gc = now
+            gc.collect()
+            leaked = self.leaked_count()
+            if leaked:
+                _log.warning("⚠️ [CONN] %d peer connection đã đóng vẫn chưa được giải phóng.", leaked)
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval_s)
+            try:
+                await self.sweep()
+            except Exception as e:
+                _log.warning("⚠️ [CONN] Lỗi sweeper: %s", e)
+
+    def start(self):
+        """Chạy sweeper nền (gọi trong event loop, idempotent)."""
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        await self.close_all()
+
+    # ---------- thống kê ----------
+    def _overdue_closed(self, now: float) -> int:
+        return sum(1 for closed_at in list(self._closed_pcs.values()) if now - closed_at > self.leak_grace_s)
+
+    def leaked_count(self) -> int:
+        """PC đã đóng quá leak_grace_s nhưng vẫn chưa được thu gom."""
+        return self._overdue_closed(time.monotonic())
+
+    def live_task_count(self) -> int:
+        return sum(conn.live_tasks() for conn in list(self._connections.values()))
+
+    def status(self) -> Dict[str, Any]:
+        return {"live": len(self._connections), "leaked": self.leaked_count(), "tasks": self.live_task_count(),
+                "processing": sum(1 for c in list(self._connections.values()) if c.processing_task is not None)}
+
+
+# Manager dùng chung cho server
+manager = ConnectionManager()
@@ -103,6 +103,16 @@ class SystemIntegrationManager:
     def query_internal_product_data(self, *args, **kwargs):
         return self.manager.query_internal_product_data(*args, **kwargs)
 
+    # Tra cứu theo kết quả NLU (DialogManager và prefetch suy đoán dùng chung)
+    def query_data(self, intent: str, entities: Dict[str, Any]) -> Dict[str, Any]:
+        """Gom các tra cứu intent cần: khách hàng/đơn hàng (customer_id, order_id) và sản phẩm (product_sku, product_name)."""
+        customer_id = entities.get("customer_id") or entities.get("order_id")
+        product = entities.get("product_sku") or entities.get("product_name")
+        return {
+            "customer_data": self.query_external_customer_data(str(customer_id)) if customer_id else None,
+            "product_data": self.query_internal_product_data(str(product)) if product else None,
+        }
+
     # Proxy phương thức ghi Log mới
     def log_interaction(self, *args, **kwargs):
         return self.manager.log_interaction(*args, **kwargs)
\ No newline at end of file
@@ -8,6 +8,11 @@ import traceback
 from typing import Dict, Any, Tuple, List, Optional, Callable, Literal
 import wave 
 
+from logging_layer import get_logger
+from tracing_layer import span, current_trace_id
+from cancellation import check_cancelled
+from speculative_prefetch import SpeculativePrefetcher
+
 # ----------------------------
 # Safe import / config handling
 # ----------------------------
@@ -22,7 +27,7 @@ class NLUModule:
     def __init__(self, mode: str, api_key: str, log_callback: Callable):
         self.mode = mode
         self.log = log_callback
-        self.log(f"⚠️ [NLU] Sử dụng NLU Module MOCK (fallback).", "orange")
+        self.log("⚠️ [NLU] Sử dụng NLU Module MOCK (fallback).", "orange")
         
     def run_nlu(self, text: str) -> Dict[str, Any]:
          if "chào" in text.lower():
@@ -35,7 +40,7 @@ class NLUModule:
 class IntentWhitelist:
     def __init__(self, log_callback: Callable): 
         self.log = log_callback
-        self.log(f"⚠️ [Whitelist] Sử dụng IntentWhitelist MOCK.", "orange")
+        self.log("⚠️ [Whitelist] Sử dụng IntentWhitelist MOCK.", "orange")
     def is_intent_supported(self, intent: str) -> bool: return True
     def get_unsupported_response(self) -> str: return "Lỗi: Intent Whitelist không hoạt động (Mock)."
 
@@ -72,7 +77,7 @@ except ImportError as e:
         """Mock Response Generator để tránh lỗi TypeError khi import thất bại."""
         def __init__(self, log_callback: Callable, config: Dict[str, Any], llm_mode: str, tts_mode: str, db_mode: str, api_key: str): 
              self.log = log_callback
-             self.log(f"⚠️ [RG Fallback] Sử dụng Response Generator Mock (vì lỗi import).", "orange")
+             self.log("⚠️ [RG Fallback] Sử dụng Response Generator Mock (vì lỗi import).", "orange")
              class MockTTSClient:
                  def synthesize_stream(self, text: str):
                       async def mock_stream(): 
@@ -100,7 +105,7 @@ except ImportError as e:
     class SystemIntegrationManager:
         def __init__(self, db_mode: str, log_callback: Callable): 
             self._log = log_callback
-            self._log(f"⚠️ [DB] Sử dụng SystemIntegrationManager MOCK (vì lỗi import).")
+            self._log("⚠️ [DB] Sử dụng SystemIntegrationManager MOCK (vì lỗi import).")
             
         def query_data(self, intent: str, entities: Dict[str, Any]) -> Dict[str, Any]:
             return {"customer_data": None, "product_data": None}
@@ -126,16 +131,21 @@ class DialogManager:
     def __init__(self, log_callback: Optional[Callable] = None, mode: str = "RTC", api_key: str = ""):
         self.session_id = str(uuid.uuid4())
         self.mode = mode
-        self.log = log_callback or print
+        self.log = get_logger("dm", log_callback)
         self.api_key = api_key
         self.current_state = INITIAL_STATE # Start state machine
         self.tts_mode = globals().get('TTS_MODE_DEFAULT', 'MOCK') # Chế độ TTS mặc định
         
         # Khả năng ghi nhớ hội thoại (Conversation History)
         self.history: List[Dict[str, str]] = [] 
+        self._nlu_cache: Optional[Tuple[str, Dict[str, Any]]] = None
+        # Cache NLU được đọc/ghi từ thread ASR (cascade, speculate) và thread DM
+        self._nlu_cache_lock = threading.Lock()
         
         # 1. Khởi tạo DB Manager
         self.db_manager = SystemIntegrationManager(globals().get('DB_MODE_DEFAULT', 'MOCK'), self.log)
+        # Prefetch DB suy đoán từ transcript tạm (speculate), dùng/bỏ trong _query_db của câu cuối
+        self._prefetch = SpeculativePrefetcher(self.db_manager.query_data)
         
         # 2. Khởi tạo Response Generator
         self.response_generator = ResponseGenerator(
@@ -159,17 +169,46 @@ class DialogManager:
         self.log("⚙️ [DM] Đã tải xong cấu hình. State ban đầu: " + self.current_state, "blue")
 
     def _run_nlu_mock(self, text: str) -> Dict[str, Any]:
-        """Chạy NLU module (có thể là mock hoặc real)"""
-        return self.nlu.run_nlu(text)
+        """Chạy NLU module (có thể là mock hoặc real). Kết quả câu gần nhất được cache (ASR cascade đã chấm trước)."""
+        with self._nlu_cache_lock:
+            cached = self._nlu_cache
+        if cached is not None and cached[0] == text:
+            return dict(cached[1])
+        result = self.nlu.run_nlu(text)
+        with self._nlu_cache_lock:
+            self._nlu_cache = (text, result)
+        return dict(result)
+
+    def nlu_confidence(self, text: str) -> float:
+        """Confidence NLU cho một transcript ứng viên (ASR cascade dùng để quyết định có decode lại không)."""
+        with span("nlu", source="asr_cascade"):
+            return float(self._run_nlu_mock(text).get("confidence", 0.0))
+
+    def speculate(self, partial_text: str) -> bool:
+        """
+        Transcript tạm (người gọi còn đang nói / tầng cascade sắp decode lại): chạy NLU (có cache) và
+        tra DB sớm nếu intent + entity đã ổn định. Không đổi state/history. True nếu vừa gửi lookup.
+        """
+        if not self._prefetch.enabled or not partial_text or partial_text == "[NO SPEECH DETECTED]":
+            return False
+        with span("nlu", source="speculative"):
+            nlu_result = self._run_nlu_mock(partial_text)
+        return self._prefetch.observe(nlu_result)
 
     def _query_db(self, user_input_asr: str, nlu_result: Dict[str, Any]) -> Dict[str, Any]:
-        """Tra cứu DB/System dựa trên kết quả NLU."""
-        self.log(f"🔎 [DB] Tra cứu DB với intent: {nlu_result['intent']}", "yellow")
+        """Tra cứu DB/System dựa trên kết quả NLU (dùng kết quả prefetch nếu transcript tạm đã đoán đúng)."""
+        self.log.debug("🔎 [DB] Tra cứu DB với intent: %s", nlu_result['intent'], color="yellow")
         
         # Thay thế bằng logic tra cứu thực tế trong SystemIntegrationManager
-        db_result = self.db_manager.query_data(nlu_result["intent"], nlu_result["entities"])
-
-        self.log(f"✅ [DB] Kết quả tra cứu: {db_result}", "yellow")
+        with span("db", intent=nlu_result["intent"]) as db_span:
+            db_result = self._prefetch.take(nlu_result["intent"], nlu_result["entities"])
+            if db_result is None:
+                db_result = self.db_manager.query_data(nlu_result["intent"], nlu_result["entities"])
+            elif db_span is not None:
+                db_span.set_attribute("prefetched", True)
+
+        # db_result có thể lớn: chỉ format khi bật DEBUG
+        self.log.debug("✅ [DB] Kết quả tra cứu: %s", db_result, color="yellow")
         return db_result
 
     def _update_state(self, intent: str, nlu_result: Dict[str, Any], current_state: str) -> str:
@@ -181,7 +220,7 @@ class DialogManager:
         elif intent == "no_match" or intent == "fallback_error":
             # Không thay đổi state nếu là fallback, trừ khi có logic đặc biệt
             pass 
-        self.log(f"🔄 [State] Cập nhật state: {current_state} -> {new_state}", "cyan")
+        self.log.debug("🔄 [State] Cập nhật state: %s -> %s", current_state, new_state, color="cyan")
         return new_state
 
     def _handle_low_confidence_or_no_speech(self, user_input_asr: str, confidence: float) -> Dict[str, Any]:
@@ -194,7 +233,7 @@ class DialogManager:
             self.log("🔇 [NLU] Không phát hiện tiếng nói. Trả về phản hồi tĩnh.", "orange")
             response_text = "Tôi không nghe rõ bạn nói gì. Bạn có thể nói lại không?"
         else:
-            self.log(f"⚠️ [NLU] Confidence thấp ({confidence:.2f}). Trả về phản hồi tĩnh.", "orange")
+            self.log("⚠️ [NLU] Confidence thấp (%.2f). Trả về phản hồi tĩnh.", "orange", confidence)
             response_text = "Xin lỗi, tôi chưa hiểu rõ ý bạn. Bạn có thể nói rõ hơn không?"
 
         # 2. Tạo mock nlu result
@@ -208,26 +247,38 @@ class DialogManager:
         """Hàm hỗ trợ để Ghi Log, ghi nhớ và định dạng kết quả trả về."""
         end_time = time.time()
         
-        # Ghi nhớ cuộc hội thoại vào history
-        self.history.append({"user": user_input_asr, "bot": response_text})
+        # Ghi nhớ cuộc hội thoại vào history (kèm nguồn intent nếu không đến từ NLU, để audit)
+        turn = {"user": user_input_asr, "bot": response_text}
+        if nlu_result.get("source"):
+            turn["source"] = nlu_result["source"]
+        self.history.append(turn)
         
         latency = end_time - start_time
-        log_message = (
-            f"⚡️ [DM] Hoàn tất phiên ({latency:.2f}s) | Intent: {nlu_result['intent']} | State: {self.current_state}\n"
-            f"       Lịch sử: {len(self.history)} lượt | ASR: '{user_input_asr[:50]}...' | BOT: '{response_text[:50]}...'"
+        self.log.info(
+            "⚡️ [DM] Hoàn tất phiên (%.2fs) | Intent: %s | State: %s\n"
+            "       Lịch sử: %d lượt | ASR: '%s...' | BOT: '%s...'",
+            latency, nlu_result['intent'], self.current_state,
+            len(self.history), user_input_asr[:50], response_text[:50],
+            color="green"
         )
-        self.log(log_message, "green")
         
         return {
             "response_text": response_text,
             "tts_mode": self.tts_mode,
             "latency": latency,
-            "full_history_len": len(self.history)
+            "trace_id": current_trace_id(),
+            "full_history_len": len(self.history),
+            "intent": nlu_result["intent"],
+            "kws": nlu_result.get("source") == "kws"
         }
 
 
-    def _process_and_update_context(self, user_input_asr: str) -> Dict[str, Any]:
-        """Luồng xử lý chính: ASR -> NLU -> DB/State -> Response."""
+    def _process_and_update_context(self, user_input_asr: str, nlu_override: Optional[Dict[str, Any]] = None,
+                                    on_intent: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """
+        Luồng xử lý chính: ASR -> NLU -> DB/State -> Response (nlu_override: intent có sẵn, bỏ qua NLU).
+        on_intent: gọi khi intent hợp lệ đã biết, ngay trước DB/Response (ví dụ phát câu đệm nếu dự kiến chậm).
+        """
         start_time = time.time()
         response_text = ""
         nlu_result: Dict[str, Any] = {"intent": "fallback_error", "entities": {}, "confidence": 0.0}
@@ -236,8 +287,17 @@ class DialogManager:
              return self._handle_low_confidence_or_no_speech(user_input_asr, 0.0)
 
         try:
-            # 1. NLU Module
-            nlu_result = self._run_nlu_mock(user_input_asr)
+            # Điểm dừng giữa các stage: lượt bị hủy (TurnCancelled) không bị except Exception bên dưới bắt
+            check_cancelled()
+            # 1. NLU Module (hoặc intent từ keyword spotting)
+            if nlu_override is not None:
+                with span("nlu", source=nlu_override.get("source", "override")):
+                    nlu_result = dict(nlu_override)
+                self.log("🎯 [NLU] Dùng intent '%s' từ %s, bỏ qua NLU.", "blue",
+                         nlu_result["intent"], nlu_result.get("source", "override"))
+            else:
+                with span("nlu"):
+                    nlu_result = self._run_nlu_mock(user_input_asr)
             current_intent = nlu_result["intent"]
             
             # 2. Xử lý Fallback/Low Confidence
@@ -249,38 +309,68 @@ class DialogManager:
                 response_text = self.intent_whitelist.get_unsupported_response()
                 nlu_result["intent"] = "unsupported_topic_block"
                 nlu_result["confidence"] = 1.0 
-                self.log(f"🛑 [Whitelist] Intent '{current_intent}' không được hỗ trợ. Chặn xử lý nghiệp vụ.", "red")
+                self.log("🛑 [Whitelist] Intent '%s' không được hỗ trợ. Chặn xử lý nghiệp vụ.", "red", current_intent)
                 return self._log_and_return(start_time, response_text, user_input_asr, nlu_result)
 
 
+            if on_intent is not None:
+                try:
+                    on_intent(nlu_result)
+                except Exception as e:
+                    self.log.warning("⚠️ [DM] Lỗi callback on_intent: %s", e)
+
             # 4. Tra cứu DB và State Update
+            check_cancelled()
             db_query_result = self._query_db(user_input_asr, nlu_result)
-            self.current_state = self._update_state(current_intent, nlu_result, self.current_state)
+            new_state = self._update_state(current_intent, nlu_result, self.current_state)
 
             # 5. Response Generation
+            check_cancelled()
             response_text = "Đã xảy ra lỗi trong quá trình xử lý phản hồi."
             try:
-                response_text = self.response_generator.generate_response(
-                    user_input_asr, 
-                    nlu_result["intent"], 
-                    nlu_result["entities"], 
-                    db_query_result, 
-                    self.current_state,
-                    self.history # Truyền History
-                )
+                with span("response"):
+                    response_text = self.response_generator.generate_response(
+                        user_input_asr, 
+                        nlu_result["intent"], 
+                        nlu_result["entities"], 
+                        db_query_result, 
+                        new_state,
+                        self.history # Truyền History
+                    )
             except Exception as e:
-                 self.log(f"❌ [DM] Lỗi Response Generation: {e}", "red")
+                 self.log.exception("❌ [DM] Lỗi Response Generation: %s", e)
                  response_text = f"Đã xảy ra lỗi hệ thống khi tạo phản hồi: {e}"
+            # Lượt bị hủy trước điểm này không để lại state/history nửa vời
+            check_cancelled()
+            self.current_state = new_state
 
         except Exception as e:
-            self.log(f"⚠️ [NLU] Lỗi NLU, chuyển về no_match. Lỗi: {e}. Traceback: {traceback.format_exc()}", "orange")
+            self.log.exception("⚠️ [NLU] Lỗi NLU, chuyển về no_match. Lỗi: %s", e, color="orange")
             return self._handle_low_confidence_or_no_speech(user_input_asr, 0.0)
         
         return self._log_and_return(start_time, response_text, user_input_asr, nlu_result)
 
 
-    def process_audio_file(self, record_file: str, user_input_asr: str) -> Dict[str, Any]:
-        """Hàm công khai được gọi từ RTCStreamProcessor."""
+    def record_barge_in(self, bot_text: Optional[str], heard_s: float = 0.0):
+        """
+        Người gọi nói chen khi bot đang trả lời: đánh dấu lượt bị ngắt trong history (bot đã nói được heard_s giây)
+        để lượt sau biết phản hồi trước chưa được nghe hết. DM chưa kịp trả lời -> thêm một mục rỗng.
+        """
+        last = self.history[-1] if self.history else None
+        if last is not None and bot_text and last.get("bot") == bot_text and not last.get("interrupted"):
+            last.update(interrupted=True, heard_s=round(heard_s, 2))
+        else:
+            self.history.append({"user": "", "bot": bot_text or "", "interrupted": True, "heard_s": round(heard_s, 2)})
+        self.log("✋ [DM] Người gọi ngắt lời sau %.1fs phản hồi.", "yellow", heard_s)
+
+    def process_audio_file(self, record_file: str, user_input_asr: str,
+                           nlu_override: Optional[Dict[str, Any]] = None,
+                           on_intent: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """
+        Hàm công khai được gọi từ RTCStreamProcessor.
+        nlu_override: kết quả NLU có sẵn (ví dụ keyword spotting, source="kws"), lượt được đánh dấu trong kết quả/history.
+        on_intent: callback (chạy trong thread DM) khi intent đã biết, trước DB/Response.
+        """
         
         # Tải lại API Key nếu có (dùng cho LLM)
         if self.mode == "RTC" and self.api_key:
@@ -290,5 +380,9 @@ class DialogManager:
             elif hasattr(self.response_generator, 'api_key'):
                  self.response_generator.api_key = self.api_key
         
-        self.log(f"🚀 [DM] Bắt đầu xử lý file audio: {os.path.basename(record_file)} | ASR: '{user_input_asr}'", "blue")
-        return self._process_and_update_context(user_input_asr)
\ No newline at end of file
+        self.log.debug("🚀 [DM] Bắt đầu xử lý file audio: %s | ASR: '%s'", os.path.basename(record_file), user_input_asr, color="blue")
+        try:
+            return self._process_and_update_context(user_input_asr, nlu_override, on_intent)
+        finally:
+            # Prefetch của lượt này (không khớp hoặc không cần DB) không mang sang lượt sau
+            self._prefetch.reset()
\ No newline at end of file
@@ -0,0 +1,159 @@
+# eval_asr.py
+"""
+So sánh WER/RTF giữa đường padded (model.transcribe, cửa sổ 30 giây) và fast path câu ngắn
+(asr_fastpath.transcribe_short) trên một tập test tiếng Việt.
+
+Manifest JSONL, mỗi dòng: {"audio_filepath": "data/vi_test/0001.wav", "text": "chào bạn"}
+(đường dẫn tương đối tính từ thư mục chứa manifest).
+
+Ví dụ:
+    python eval_asr.py --manifest data/vi_test/manifest.jsonl
+    python eval_asr.py --manifest data/vi_test/manifest.jsonl --model tiny --buckets 2 4 8 --output asr_eval.json
+    python eval_asr.py --manifest ... --max-wer-delta 0.02   # exit 1 nếu fast path kém hơn quá 2 điểm WER
+"""
+import argparse
+import json
+import re
+import statistics
+import sys
+import time
+import unicodedata
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from audio_frontend import load_audio
+from asr_fastpath import transcribe_short, pick_bucket
+
+try:
+    from config_db import SAMPLE_RATE, WHISPER_MODEL_NAME, ASR_FASTPATH_BUCKETS_S
+except ImportError:
+    SAMPLE_RATE = 16000
+    WHISPER_MODEL_NAME = "small"
+    ASR_FASTPATH_BUCKETS_S = (2, 4, 8)
+
+
+# ==================== WER ====================
+def normalize_text(text: str) -> List[str]:
+    """Chuẩn hóa để tính WER: NFC, chữ thường, bỏ dấu câu (giữ dấu thanh tiếng Việt)."""
+    text = unicodedata.normalize("NFC", text).lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return text.split()
+
+
+def edit_distance(ref: List[str], hyp: List[str]) -> int:
+    previous = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        current = [i] + [0] * len(hyp)
+        for j, h in enumerate(hyp, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (r != h))
+        previous = current
+    return previous[-1]
+
+
+def corpus_wer(pairs: List[Dict[str, Any]]) -> float:
+    errors = sum(edit_distance(p["ref"], p["hyp"]) for p in pairs)
+    words = sum(len(p["ref"]) for p in pairs)
+    return errors / words if words else 0.0
+
+
+# ==================== EVAL ====================
+def load_manifest(path: Path, limit: Optional[int]) -> List[Dict[str, Any]]:
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                audio_path = Path(item["audio_filepath"])
+                item["audio_filepath"] = audio_path if audio_path.is_absolute() else path.parent / audio_path
+                items.append(item)
+    return items[:limit] if limit else items
+
+
+def _run(fn) -> Dict[str, Any]:
+    start = time.perf_counter()
+    result = fn()
+    return {"result": result, "seconds": time.perf_counter() - start}
+
+
+def summarize(rows: List[Dict[str, Any]], key: str) -> Dict[str, Any]:
+    pairs = [{"ref": r["ref"], "hyp": r[key]["hyp"]} for r in rows]
+    audio_seconds = sum(r["duration_s"] for r in rows)
+    compute_seconds = sum(r[key]["seconds"] for r in rows)
+    latencies = sorted(r[key]["seconds"] * 1000 for r in rows)
+    return {
+        "wer": round(corpus_wer(pairs), 4),
+        "rtf": round(compute_seconds / audio_seconds, 4) if audio_seconds else None,
+        "p50_ms": round(statistics.median(latencies), 1) if latencies else None,
+        "utterances": len(rows),
+    }
+
+
+def evaluate(model, items: List[Dict[str, Any]], buckets, fp16: bool, language: str = "vi") -> Dict[str, Any]:
+    rows = []
+    for item in items:
+        audio = load_audio(item["audio_filepath"], SAMPLE_RATE)
+        padded = _run(lambda: model.transcribe(audio, language=language, fp16=fp16))
+        fast = _run(lambda: transcribe_short(model, audio, language=language, fp16=fp16, buckets=buckets))
+        if fast["result"] is None:
+            # Clip dài hơn bucket lớn nhất: production cũng dùng đường padded
+            fast = padded
+        rows.append({
+            "audio": str(item["audio_filepath"]),
+            "duration_s": len(audio) / SAMPLE_RATE,
+            "bucket_s": pick_bucket(len(audio), buckets),
+            "ref": normalize_text(item["text"]),
+            "padded": {"hyp": normalize_text(padded["result"]["text"]), "seconds": padded["seconds"]},
+            "fast": {"hyp": normalize_text(fast["result"]["text"]), "seconds": fast["seconds"]},
+        })
+
+    by_bucket = {}
+    for bucket in sorted({r["bucket_s"] for r in rows}, key=lambda b: (b is None, b)):
+        subset = [r for r in rows if r["bucket_s"] == bucket]
+        by_bucket[str(bucket or "full")] = {"padded": summarize(subset, "padded"), "fast": summarize(subset, "fast")}
+    return {
+        "padded": summarize(rows, "padded"),
+        "fast": summarize(rows, "fast"),
+        "by_bucket": by_bucket,
+        "mismatches": [
+            {"audio": r["audio"], "ref": " ".join(r["ref"]), "padded": " ".join(r["padded"]["hyp"]),
+             "fast": " ".join(r["fast"]["hyp"])}
+            for r in rows if r["padded"]["hyp"] != r["fast"]["hyp"]
+        ][:50],
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="WER/RTF: Whisper padded 30s vs fast path câu ngắn.")
+    parser.add_argument("--manifest", required=True, help="JSONL {audio_filepath, text}.")
+    parser.add_argument("--model", default=WHISPER_MODEL_NAME, help="Tên model Whisper (tải qua model_registry).")
+    parser.add_argument("--buckets", type=float, nargs="+", default=list(ASR_FASTPATH_BUCKETS_S))
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--max-wer-delta", type=float, default=None,
+                        help="Exit 1 nếu WER(fast) - WER(padded) vượt ngưỡng này.")
+    parser.add_argument("--output", default=None, help="Ghi báo cáo JSON ra file.")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    from model_registry import registry
+    model = registry.get_whisper(args.model)
+    if model is None:
+        print(json.dumps(registry.status(), ensure_ascii=False, indent=2), file=sys.stderr)
+        return 2
+    items = load_manifest(Path(args.manifest), args.limit)
+    report = {"model": args.model, "buckets": args.buckets, "device": registry.device,
+              **evaluate(model, items, args.buckets, registry.use_fp16)}
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+    if args.max_wer_delta is not None and report["fast"]["wer"] - report["padded"]["wer"] > args.max_wer_delta:
+        print(f"❌ WER fast path tăng {report['fast']['wer'] - report['padded']['wer']:.4f} "
+              f"(> {args.max_wer_delta})", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
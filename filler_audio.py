@@ -0,0 +1,179 @@
+# filler_audio.py
+"""
+Câu đệm (filler) che độ trễ. Khi DM đã có intent và sắp tra DB / gọi LLM, nếu thời gian dự kiến từ lúc có intent
+tới chunk TTS đầu tiên của intent đó >= FILLER_THRESHOLD_S thì client phát ngay một câu đệm ngắn
+("Dạ, em kiểm tra ngay ạ.") rồi nối phản hồi thật vào ngay sau.
+  - Dự kiến: EWMA theo intent của độ trễ đo được ở các lượt trước, khởi đầu bằng FILLER_INTENT_PRIORS_S.
+  - Clip: render trước bằng TTS một lần (WAV trong FILLER_CACHE_DIR, tên theo hash của câu, giữ qua các lần
+    khởi động), cắt lặng hai đầu và fade FILLER_FADE_MS để nối liền với phản hồi thật.
+Chưa render được clip nào (TTS lỗi / không có mạng) -> không phát filler, lượt chạy như cũ.
+"""
+import hashlib
+import io
+import itertools
+import threading
+import wave
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from audio_frontend import trim_silence, fade_edges, to_int16
+from logging_layer import get_logger
+from metrics_layer import FILLER_DECISIONS
+
+# --- SAFE IMPORT CONFIG ---
+try:
+    from config_db import (
+        FILLER_ENABLED, FILLER_THRESHOLD_S, FILLER_EWMA_ALPHA, FILLER_INTENT_PRIORS_S, FILLER_PHRASES,
+        FILLER_CACHE_DIR, FILLER_FADE_MS, SAMPLE_RATE
+    )
+except ImportError:
+    FILLER_ENABLED = False
+    FILLER_THRESHOLD_S = 1.2
+    FILLER_EWMA_ALPHA = 0.3
+    FILLER_INTENT_PRIORS_S = {}
+    FILLER_PHRASES = {"default": ["Dạ, em kiểm tra ngay ạ."]}
+    FILLER_CACHE_DIR = "filler_cache"
+    FILLER_FADE_MS = 20
+    SAMPLE_RATE = 16000
+
+_log = get_logger("filler")
+
+@dataclass(frozen=True)
+class FillerClip:
+    text: str
+    file_name: str
+    duration_s: float
+
+
+class LatencyProjector:
+    """Độ trễ dự kiến theo intent (EWMA), đọc từ thread DM, cập nhật từ event loop."""
+
+    def __init__(self, alpha: float = FILLER_EWMA_ALPHA, priors: Optional[Dict[str, float]] = None):
+        self.alpha = alpha
+        self._estimates: Dict[str, float] = dict(FILLER_INTENT_PRIORS_S if priors is None else priors)
+        self._lock = threading.Lock()
+
+    def observe(self, intent: str, seconds: float):
+        with self._lock:
+            previous = self._estimates.get(intent)
+            self._estimates[intent] = seconds if previous is None else previous + self.alpha * (seconds - previous)
+
+    def project(self, intent: str) -> Optional[float]:
+        with self._lock:
+            return self._estimates.get(intent)
+
+    def status(self) -> Dict[str, float]:
+        with self._lock:
+            return {intent: round(seconds, 3) for intent, seconds in self._estimates.items()}
+
+
+def _wav_duration(path: Path) -> float:
+    with wave.open(str(path), "rb") as wf:
+        return wf.getnframes() / float(wf.getframerate() or SAMPLE_RATE)
+
+
+class FillerCache:
+    """Clip câu đệm đã render theo intent ("default" cho intent không có câu riêng), chọn xoay vòng."""
+
+    def __init__(self, cache_dir: str = FILLER_CACHE_DIR, phrases: Optional[Dict[str, Sequence[str]]] = None,
+                 fade_ms: int = FILLER_FADE_MS):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(exist_ok=True)
+        self.phrases = FILLER_PHRASES if phrases is None else phrases
+        self.fade_ms = fade_ms
+        self._clips: Dict[str, List[FillerClip]] = {}
+        self._cursor: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def file_name(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16] + ".wav"
+
+    def _render_one(self, text: str, synthesize: Callable[[str], Optional[bytes]]) -> Optional[FillerClip]:
+        path = self.cache_dir / self.file_name(text)
+        if not path.exists():
+            wav_bytes = synthesize(text)
+            if not wav_bytes or len(wav_bytes) <= 44:
+                return None
+            with wave.open(io.BytesIO(wav_bytes), "rb") as wf:
+                rate = wf.getframerate()
+                samples = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16).astype(np.float32) / 32768.0
+            samples = to_int16(fade_edges(trim_silence(samples, rate), rate * self.fade_ms // 1000))
+            # Ghi file tạm rồi đổi tên: request /filler_audio không đọc phải file ghi dở
+            tmp = path.with_suffix(".tmp")
+            with wave.open(str(tmp), "wb") as wf:
+                wf.setnchannels(1)
+                wf.setsampwidth(2)
+                wf.setframerate(rate)
+                wf.writeframes(samples.tobytes())
+            tmp.replace(path)
+        return FillerClip(text, path.name, _wav_duration(path))
+
+    def render(self, synthesize: Callable[[str], Optional[bytes]]) -> int:
+        """Render (hoặc nạp từ cache đĩa) mọi câu đệm. Trả về số clip dùng được."""
+        rendered = 0
+        for intent, texts in self.phrases.items():
+            clips = []
+            for text in texts:
+                try:
+                    clip = self._render_one(text, synthesize)
+                except Exception as e:
+                    _log.warning("⚠️ [FILLER] Lỗi render câu đệm '%s': %s", text, e)
+                    clip = None
+                if clip is not None:
+                    clips.append(clip)
+            with self._lock:
+                self._clips[intent] = clips
+                self._cursor[intent] = itertools.cycle(range(len(clips))) if clips else None
+            rendered += len(clips)
+        _log("🗣️ [FILLER] %d/%d câu đệm sẵn sàng.", "green" if rendered else "orange",
+             rendered, sum(len(t) for t in self.phrases.values()))
+        return rendered
+
+    def start_prerender(self, synthesize: Callable[[str], Optional[bytes]]) -> threading.Thread:
+        """Render trong thread nền (TTS là blocking và có thể cần mạng), idempotent."""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self.render, args=(synthesize,), name="filler-prerender", daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def pick(self, intent: str) -> Optional[FillerClip]:
+        with self._lock:
+            for key in (intent, "default"):
+                clips, cursor = self._clips.get(key), self._cursor.get(key)
+                if clips and cursor is not None:
+                    return clips[next(cursor)]
+        return None
+
+    def status(self) -> Dict[str, int]:
+        with self._lock:
+            return {intent: len(clips) for intent, clips in self._clips.items()}
+
+
+def choose(intent: str, threshold_s: float = FILLER_THRESHOLD_S) -> Optional[FillerClip]:
+    """Intent đã biết (thread DM): clip câu đệm nếu độ trễ dự kiến >= threshold_s, ngược lại None."""
+    if not FILLER_ENABLED:
+        return None
+    projected = projector.project(intent)
+    if projected is None or projected < threshold_s:
+        FILLER_DECISIONS.labels(intent, "below_threshold").inc()
+        return None
+    clip = cache.pick(intent)
+    FILLER_DECISIONS.labels(intent, "played" if clip is not None else "no_clip").inc()
+    if clip is not None:
+        _log.debug("🗣️ [FILLER] Intent '%s' dự kiến %.2fs: phát '%s'.", intent, projected, clip.text)
+    return clip
+
+
+def status() -> Dict[str, Any]:
+    return {"enabled": FILLER_ENABLED, "threshold_s": FILLER_THRESHOLD_S, "clips": cache.status(),
+            "projected_s": projector.status()}
+
+
+# Dùng chung cho server
+projector = LatencyProjector()
+cache = FillerCache()
@@ -0,0 +1,270 @@
+# keyword_spotter.py
+"""
+Keyword spotting cho vài câu cố định (chào hỏi, tạm biệt, cảm ơn...): so khớp log-mel của audio
+đã qua VAD với template bằng DTW. Khớp tin cậy cao -> trả intent trực tiếp, bỏ qua Whisper và NLU.
+
+Template: <MODEL_ARTIFACT_DIR>/kws/<intent>/*.wav (16kHz mono PCM16), thêm file ghi âm thật vào cùng
+thư mục để tăng độ phủ. Tạo template từ gTTS:
+    python keyword_spotter.py build
+Chấm thử một file (để chỉnh KWS_MAX_DISTANCE / KWS_MIN_MARGIN):
+    python keyword_spotter.py score user.wav
+"""
+import argparse
+import io
+import json
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# --- SAFE IMPORT CONFIG ---
+try:
+    from config_db import (
+        SAMPLE_RATE, MODEL_ARTIFACT_DIR, KWS_PHRASES, KWS_MAX_SECONDS, KWS_MAX_DISTANCE, KWS_MIN_MARGIN
+    )
+except ImportError:
+    SAMPLE_RATE = 16000
+    MODEL_ARTIFACT_DIR = "models"
+    KWS_PHRASES = {"chao_hoi": ["xin chào", "chào bạn"], "tam_biet": ["tạm biệt"], "small_talk": ["cảm ơn"]}
+    KWS_MAX_SECONDS = 2.5
+    KWS_MAX_DISTANCE = 0.35
+    KWS_MIN_MARGIN = 0.15
+
+_N_FFT = 400     # 25ms @16kHz
+_HOP = 160       # 10ms
+_N_MELS = 40
+# Bỏ qua template dài/ngắn hơn audio quá tỉ lệ này (câu dài chứa từ khóa vẫn phải qua ASR)
+_MAX_LENGTH_RATIO = 1.6
+
+_mel_cache: Dict[int, np.ndarray] = {}
+
+
+# ==================== ĐẶC TRƯNG ====================
+def _mel_filterbank(sample_rate: int, n_fft: int = _N_FFT, n_mels: int = _N_MELS) -> np.ndarray:
+    if sample_rate in _mel_cache:
+        return _mel_cache[sample_rate]
+    hz_to_mel = lambda hz: 2595.0 * np.log10(1.0 + hz / 700.0)
+    mel_to_hz = lambda mel: 700.0 * (10 ** (mel / 2595.0) - 1.0)
+    mel_points = np.linspace(hz_to_mel(20.0), hz_to_mel(sample_rate / 2), n_mels + 2)
+    bins = np.floor((n_fft + 1) * mel_to_hz(mel_points) / sample_rate).astype(int)
+    bank = np.zeros((n_mels, n_fft // 2 + 1), dtype=np.float32)
+    for m in range(1, n_mels + 1):
+        left, center, right = bins[m - 1], bins[m], bins[m + 1]
+        if center > left:
+            bank[m - 1, left:center] = (np.arange(left, center) - left) / (center - left)
+        if right > center:
+            bank[m - 1, center:right] = (right - np.arange(center, right)) / (right - center)
+    _mel_cache[sample_rate] = bank
+    return bank
+
+
+def log_mel(audio: np.ndarray, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Log-mel (frame, mel) đã chuẩn hóa CMVN theo câu, mỗi frame chuẩn hóa L2 cho khoảng cách cosine."""
+    audio = np.asarray(audio, dtype=np.float32)
+    if len(audio) < _N_FFT:
+        audio = np.pad(audio, (0, _N_FFT - len(audio)))
+    frames = np.lib.stride_tricks.sliding_window_view(audio, _N_FFT)[::_HOP] * np.hanning(_N_FFT).astype(np.float32)
+    power = np.abs(np.fft.rfft(frames, axis=1)) ** 2
+    features = np.log(power @ _mel_filterbank(sample_rate).T + 1e-6)
+    features -= features.mean(axis=0)
+    features /= features.std(axis=0) + 1e-5
+    features /= np.linalg.norm(features, axis=1, keepdims=True) + 1e-8
+    return features.astype(np.float32)
+
+
+def dtw_distance(query: np.ndarray, template: np.ndarray) -> float:
+    """
+    DTW với chi phí cosine (1 - tích vô hướng của frame đã chuẩn hóa L2), chia cho độ dài đường đi.
+    Mỗi hàng tính vector hóa: bước ngang D[i,j] = min(t[j], c[i,j] + D[i,j-1]) tương đương
+    C[j] + min_{k<=j}(t[k] - C[k]) với C = cumsum(c[i]) -> np.minimum.accumulate, không lặp từng ô.
+    """
+    cost = 1.0 - query.astype(np.float64) @ template.T.astype(np.float64)
+    n, m = cost.shape
+    prev = np.full(m + 1, np.inf)
+    prev[0] = 0.0
+    for i in range(n):
+        vertical = cost[i] + np.minimum(prev[:-1], prev[1:])  # từ (i-1, j-1) hoặc (i-1, j)
+        cumulative = np.cumsum(cost[i])
+        row = np.empty(m + 1)
+        row[0] = np.inf
+        row[1:] = cumulative + np.minimum.accumulate(vertical - cumulative)
+        prev = row
+    return float(prev[m] / (n + m))
+
+
+# ==================== SPOTTER ====================
+@dataclass
+class KeywordMatch:
+    intent: str
+    text: str
+    distance: float
+    margin: float
+    template: str
+
+    @property
+    def confidence(self) -> float:
+        return float(min(1.0, max(0.0, 1.0 - self.distance)))
+
+    def as_nlu_result(self) -> Dict[str, Any]:
+        """Kết quả NLU thay thế cho DialogManager (source="kws" để audit lượt này)."""
+        return {"intent": self.intent, "entities": {}, "confidence": self.confidence, "source": "kws",
+                "kws": {"text": self.text, "distance": round(self.distance, 4), "margin": round(self.margin, 4),
+                        "template": self.template}}
+
+
+@dataclass
+class _Template:
+    intent: str
+    text: str
+    name: str
+    features: np.ndarray
+
+
+class KeywordSpotter:
+    """
+    So khớp template log-mel + DTW. Chấp nhận khi khoảng cách tốt nhất <= max_distance và tốt hơn
+    intent đứng thứ hai ít nhất min_margin (tương đối); ngược lại trả None để chạy ASR như thường.
+    """
+
+    def __init__(self, templates: List[_Template], max_distance: float = KWS_MAX_DISTANCE,
+                 min_margin: float = KWS_MIN_MARGIN, max_seconds: float = KWS_MAX_SECONDS,
+                 sample_rate: int = SAMPLE_RATE):
+        self.templates = templates
+        self.max_distance = max_distance
+        self.min_margin = min_margin
+        self.max_seconds = max_seconds
+        self.sample_rate = sample_rate
+
+    @property
+    def intents(self) -> List[str]:
+        return sorted({t.intent for t in self.templates})
+
+    @classmethod
+    def from_dir(cls, template_dir: Path, **kwargs) -> "KeywordSpotter":
+        """Đọc <template_dir>/<intent>/*.wav; text lấy từ phrases.json (nếu có), mặc định là tên file."""
+        from audio_frontend import load_audio
+        template_dir = Path(template_dir)
+        texts: Dict[str, str] = {}
+        manifest = template_dir / "phrases.json"
+        if manifest.exists():
+            texts = json.loads(manifest.read_text(encoding="utf-8"))
+        sample_rate = kwargs.get("sample_rate", SAMPLE_RATE)
+        templates = [
+            _Template(intent=wav.parent.name, name=f"{wav.parent.name}/{wav.name}",
+                      text=texts.get(f"{wav.parent.name}/{wav.name}", wav.stem.replace("_", " ")),
+                      features=log_mel(load_audio(wav, sample_rate), sample_rate))
+            for wav in sorted(template_dir.glob("*/*.wav"))
+        ]
+        if not templates:
+            raise FileNotFoundError(f"Không có template KWS trong '{template_dir}' (chạy: python keyword_spotter.py build).")
+        return cls(templates, **kwargs)
+
+    def score(self, audio: np.ndarray) -> List[Tuple[float, _Template]]:
+        """Khoảng cách DTW tới từng template có độ dài tương đương, tăng dần."""
+        query = log_mel(audio, self.sample_rate)
+        scores = []
+        for template in self.templates:
+            ratio = len(query) / len(template.features)
+            if 1.0 / _MAX_LENGTH_RATIO <= ratio <= _MAX_LENGTH_RATIO:
+                scores.append((dtw_distance(query, template.features), template))
+        return sorted(scores, key=lambda item: item[0])
+
+    def spot(self, audio: np.ndarray) -> Optional[KeywordMatch]:
+        if not len(audio) or len(audio) > self.max_seconds * self.sample_rate:
+            return None
+        scores = self.score(audio)
+        if not scores:
+            return None
+        best_distance, best = scores[0]
+        if best_distance > self.max_distance:
+            return None
+        # Intent khác gần nhất; chỉ có một intent trong tầm độ dài -> so với chính max_distance
+        rival = next((d for d, t in scores[1:] if t.intent != best.intent), self.max_distance)
+        margin = (rival - best_distance) / rival if rival > 0 else 0.0
+        if margin < self.min_margin:
+            return None
+        return KeywordMatch(intent=best.intent, text=best.text, distance=best_distance,
+                            margin=margin, template=best.name)
+
+
+# ==================== TẠO TEMPLATE TỪ TTS ====================
+def _render_gtts(text: str, slow: bool = False) -> np.ndarray:
+    from gtts import gTTS
+    from pydub import AudioSegment
+    mp3_buffer = io.BytesIO()
+    gTTS(text=text, lang="vi", slow=slow).write_to_fp(mp3_buffer)
+    mp3_buffer.seek(0)
+    audio = AudioSegment.from_file(mp3_buffer, format="mp3").set_channels(1).set_frame_rate(SAMPLE_RATE).set_sample_width(2)
+    return np.frombuffer(audio.raw_data, dtype=np.int16)
+
+
+def _trim_silence(samples: np.ndarray) -> np.ndarray:
+    """Cắt im lặng hai đầu bằng pre-gate năng lượng (giống audio đã qua VAD lúc chạy thật)."""
+    from audio_frontend import energy_gate
+    audio = samples.astype(np.float32) / 32768.0
+    gated, _ = energy_gate(audio, SAMPLE_RATE)
+    voiced = np.flatnonzero(np.abs(gated) > 1e-3)
+    return samples[voiced[0]:voiced[-1] + 1] if len(voiced) else samples[:0]
+
+
+def build_templates(output_dir: Path, phrases: Dict[str, List[str]] = KWS_PHRASES) -> List[Path]:
+    """Render mỗi câu bằng gTTS (tốc độ thường + chậm) thành <output_dir>/<intent>/<n>.wav."""
+    import wave
+    output_dir = Path(output_dir)
+    texts: Dict[str, str] = {}
+    written = []
+    for intent, intent_phrases in phrases.items():
+        (output_dir / intent).mkdir(parents=True, exist_ok=True)
+        index = 0
+        for text in intent_phrases:
+            for slow in (False, True):
+                samples = _trim_silence(_render_gtts(text, slow=slow))
+                if not len(samples):
+                    continue
+                name = f"tts_{index:02d}.wav"
+                with wave.open(str(output_dir / intent / name), "wb") as wf:
+                    wf.setnchannels(1)
+                    wf.setsampwidth(2)
+                    wf.setframerate(SAMPLE_RATE)
+                    wf.writeframes(samples.tobytes())
+                texts[f"{intent}/{name}"] = text
+                written.append(output_dir / intent / name)
+                index += 1
+    manifest = output_dir / "phrases.json"
+    if manifest.exists():
+        texts = {**json.loads(manifest.read_text(encoding="utf-8")), **texts}
+    manifest.write_text(json.dumps(texts, ensure_ascii=False, indent=2), encoding="utf-8")
+    return written
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Keyword spotting (log-mel + DTW) cho câu lệnh ngắn.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Tạo template từ gTTS (KWS_PHRASES).")
+    build.add_argument("--output", default=str(Path(MODEL_ARTIFACT_DIR) / "kws"))
+    score = sub.add_parser("score", help="In khoảng cách DTW của một file WAV tới các template.")
+    score.add_argument("audio")
+    score.add_argument("--templates", default=str(Path(MODEL_ARTIFACT_DIR) / "kws"))
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        written = build_templates(Path(args.output))
+        print(f"✅ [KWS] Đã tạo {len(written)} template trong {args.output}")
+        return 0
+
+    from audio_frontend import load_audio
+    spotter = KeywordSpotter.from_dir(Path(args.templates))
+    audio = load_audio(Path(args.audio), SAMPLE_RATE)
+    match = spotter.spot(audio)
+    report = {
+        "match": match.as_nlu_result() if match else None,
+        "scores": [{"template": t.name, "intent": t.intent, "distance": round(d, 4)} for d, t in spotter.score(audio)[:10]],
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,262 @@
+# logging_layer.py
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional, Union
+
+# --- SAFE IMPORT CONFIG ---
+try:
+    from config_db import LOG_LEVEL_DEFAULT, LOG_MODULE_LEVELS, LOG_QUEUE_SIZE
+except ImportError:
+    LOG_LEVEL_DEFAULT = "INFO"
+    LOG_MODULE_LEVELS = {}
+    LOG_QUEUE_SIZE = 10000
+
+ROOT_LOGGER_NAME = "voicebot"
+
+# Màu cũ của log_callback -> level. Các màu còn lại (green, cyan, yellow...) là INFO.
+COLOR_LEVELS: Dict[str, int] = {
+    "red": logging.ERROR,
+    "orange": logging.WARNING,
+}
+
+ANSI_COLORS: Dict[str, str] = {
+    "red": "\033[91m", "green": "\033[92m", "yellow": "\033[93m",
+    "blue": "\033[94m", "magenta": "\033[95m", "purple": "\033[95m",
+    "cyan": "\033[96m", "white": "\033[97m", "orange": "\033[33m"
+}
+ANSI_RESET = "\033[0m"
+
+
+# ==================== LAZY MESSAGE ====================
+class _LazyMessage:
+    """Bọc một callable trả về chuỗi; chỉ được gọi khi handler thực sự format record."""
+    __slots__ = ("_factory", "_value")
+
+    def __init__(self, factory: Callable[[], Any]):
+        self._factory = factory
+        self._value: Optional[str] = None
+
+    def __str__(self) -> str:
+        if self._value is None:
+            try:
+                self._value = str(self._factory())
+            except Exception as e:
+                self._value = f"<lỗi tạo log message: {e}>"
+        return self._value
+
+
+# ==================== HANDLERS ====================
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler không format ở luồng gọi (QueueHandler gốc format ngay trong prepare()).
+    Queue có giới hạn: khi đầy thì bỏ record và đếm, không bao giờ chặn luồng audio.
+    """
+    def __init__(self, log_queue: "queue.Queue[logging.LogRecord]"):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class ColorConsoleFormatter(logging.Formatter):
+    """Format giống _log_colored/styled_print cũ: màu ANSI theo thuộc tính 'color' của record."""
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+        color = getattr(record, "color", None) or ("red" if record.levelno >= logging.ERROR else "white")
+        return f"{ANSI_COLORS.get(color, ANSI_RESET)}{message}{ANSI_RESET}"
+
+
+class CallbackHandler(logging.Handler):
+    """Chuyển record đã format sang một callable (message, color), ví dụ textbox của Tkinter."""
+    def __init__(self, callback: Callable[[str, str], None], level: int = logging.NOTSET):
+        super().__init__(level)
+        self._callback = callback
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            self._callback(self.format(record), getattr(record, "color", "white"))
+        except Exception:
+            self.handleError(record)
+
+
+# ==================== CẤU HÌNH TOÀN CỤC ====================
+_config_lock = threading.Lock()
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[NonBlockingQueueHandler] = None
+
+
+def _to_level(level: Union[int, str]) -> int:
+    if isinstance(level, int):
+        return level
+    value = logging.getLevelName(str(level).upper())
+    return value if isinstance(value, int) else logging.INFO
+
+
+def configure_logging(handlers: Optional[Iterable[logging.Handler]] = None,
+                      level: Union[int, str, None] = None,
+                      module_levels: Optional[Dict[str, Union[int, str]]] = None,
+                      console: bool = True) -> NonBlockingQueueHandler:
+    """
+    Cấu hình (hoặc cấu hình lại) logger gốc 'voicebot'.
+    Mọi handler (console, file, UI) chạy trong luồng QueueListener riêng.
+    """
+    global _listener, _queue_handler
+    with _config_lock:
+        if _listener is not None:
+            _listener.stop()
+        root = logging.getLogger(ROOT_LOGGER_NAME)
+        if _queue_handler is not None:
+            root.removeHandler(_queue_handler)
+
+        sinks = list(handlers or [])
+        if console:
+            console_handler = logging.StreamHandler()
+            console_handler.setFormatter(ColorConsoleFormatter("%(message)s"))
+            sinks.append(console_handler)
+
+        log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        _queue_handler = NonBlockingQueueHandler(log_queue)
+        root.addHandler(_queue_handler)
+        root.propagate = False
+        root.setLevel(_to_level(level if level is not None else LOG_LEVEL_DEFAULT))
+
+        for module_name, module_level in {**LOG_MODULE_LEVELS, **(module_levels or {})}.items():
+            set_module_level(module_name, module_level)
+
+        _listener = logging.handlers.QueueListener(log_queue, *sinks, respect_handler_level=True)
+        _listener.start()
+        return _queue_handler
+
+
+def shutdown_logging():
+    """Xả queue và dừng luồng listener (gọi khi thoát ứng dụng)."""
+    global _listener
+    with _config_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def set_module_level(module_name: str, level: Union[int, str]):
+    """Lọc theo module, ví dụ set_module_level('rtc', 'DEBUG') hoặc set_module_level('dm.db', 'WARNING')."""
+    logging.getLogger(f"{ROOT_LOGGER_NAME}.{module_name}").setLevel(_to_level(level))
+
+
+def dropped_records() -> int:
+    """Số record bị bỏ do queue đầy."""
+    return _queue_handler.dropped if _queue_handler else 0
+
+
+def _ensure_configured():
+    if _listener is None:
+        configure_logging()
+
+
+atexit.register(shutdown_logging)
+
+# Level mặc định áp dụng ngay khi import (kể cả khi chỉ dùng CallbackLogger, chưa configure).
+logging.getLogger(ROOT_LOGGER_NAME).setLevel(_to_level(LOG_LEVEL_DEFAULT))
+for _module_name, _module_level in LOG_MODULE_LEVELS.items():
+    set_module_level(_module_name, _module_level)
+
+
+# ==================== FACADE ====================
+class VoiceLogger:
+    """
+    Facade thay cho log_callback.
+    - Vẫn gọi được như log_callback cũ: log("message", "red") (màu -> level).
+    - API theo level: log.debug("Kết quả: %s", db_result) hoặc log.debug(lambda: expensive()).
+      Message chỉ được format khi level được bật, và format trong luồng listener.
+    """
+    __slots__ = ("name", "_logger")
+
+    def __init__(self, name: str):
+        self.name = name
+        self._logger = logging.getLogger(f"{ROOT_LOGGER_NAME}.{name}")
+
+    def __call__(self, message: Any, color: str = "white", *args: Any):
+        self._emit(COLOR_LEVELS.get(color, logging.INFO), message, args, color)
+
+    def is_enabled(self, level: int) -> bool:
+        return self._logger.isEnabledFor(level)
+
+    def child(self, suffix: str) -> "VoiceLogger":
+        return self.renamed(f"{self.name}.{suffix}")
+
+    def renamed(self, name: str) -> "VoiceLogger":
+        """Cùng đích ghi log (handler chung / callback) nhưng đổi tên module (lọc level theo tên mới)."""
+        return VoiceLogger(name)
+
+    def debug(self, message: Any, *args: Any, color: str = "white"):
+        self._emit(logging.DEBUG, message, args, color)
+
+    def info(self, message: Any, *args: Any, color: str = "white"):
+        self._emit(logging.INFO, message, args, color)
+
+    def warning(self, message: Any, *args: Any, color: str = "orange"):
+        self._emit(logging.WARNING, message, args, color)
+
+    def error(self, message: Any, *args: Any, color: str = "red"):
+        self._emit(logging.ERROR, message, args, color)
+
+    def exception(self, message: Any, *args: Any, color: str = "red"):
+        """Như error() nhưng kèm traceback; traceback được format trong luồng listener."""
+        self._emit(logging.ERROR, message, args, color, exc_info=True)
+
+    def _emit(self, level: int, message: Any, args: tuple, color: str, exc_info: bool = False):
+        if not self._logger.isEnabledFor(level):
+            return
+        if callable(message):
+            message = _LazyMessage(message)
+        self._logger.log(level, message, *args, exc_info=exc_info, extra={"color": color})
+
+
+class CallbackLogger(VoiceLogger):
+    """
+    Adapter cho log_callback kiểu cũ (hàm (message, color)), ví dụ mock_log trong test.
+    Vẫn tôn trọng level/lọc module, nhưng gọi callback đồng bộ.
+    """
+    __slots__ = ("_callback",)
+
+    def __init__(self, name: str, callback: Callable):
+        super().__init__(name)
+        self._callback = callback
+
+    def renamed(self, name: str) -> "CallbackLogger":
+        return CallbackLogger(name, self._callback)
+
+    def _emit(self, level: int, message: Any, args: tuple, color: str, exc_info: bool = False):
+        if not self._logger.isEnabledFor(level):
+            return
+        text = str(message()) if callable(message) else str(message)
+        if args:
+            text = text % args
+        if exc_info:
+            import traceback
+            text = f"{text}\n{traceback.format_exc()}"
+        self._callback(text, color)
+
+
+def get_logger(name: str, log_callback: Optional[Callable] = None) -> VoiceLogger:
+    """
+    Lấy logger cho một module ('rtc', 'dm', 'server', ...).
+    - log_callback là None -> logger 'voicebot.<name>' dùng chung handler.
+    - log_callback là VoiceLogger -> cùng đích với logger đó (CallbackLogger giữ callback), tên '<name>'.
+    - log_callback là hàm kiểu cũ -> CallbackLogger bọc hàm đó.
+    """
+    if isinstance(log_callback, CallbackLogger):
+        return log_callback.renamed(name)
+    if log_callback is None or isinstance(log_callback, VoiceLogger):
+        _ensure_configured()
+        return VoiceLogger(name)
+    return CallbackLogger(name, log_callback)
@@ -14,6 +14,9 @@ from pathlib import Path
 from typing import Optional, Callable, AsyncGenerator, Tuple, Any 
 import traceback 
 import wave 
+import logging
+
+from logging_layer import get_logger, configure_logging, shutdown_logging, CallbackHandler
 
 # ==================== MOCK DEPENDENCIES (Cho tính Robust) =====================
 # Các class này được dùng nếu các file .py tương ứng không tồn tại.
@@ -52,7 +55,7 @@ except ImportError:
     class RTCStreamProcessor:
         def __init__(self, log_callback): self.log = log_callback
         async def handle_rtc_session(self, stream, session_id): 
-            self.log(f"MOCK RTC: Handling session {session_id}")
+            self.log("MOCK RTC: Handling session %s", "white", session_id)
             yield (False, {"user_text": "MOCK ASR Transcript", "bot_text": "MOCK Bot Response"})
             await asyncio.sleep(0.5) 
             yield (True, b"MOCK_TTS_RESPONSE")
@@ -62,21 +65,9 @@ except ImportError:
     CHANNELS = 1        
     print("❌ [App] RTCStreamProcessor not found. Using Mock.")
     
-# --- THƯ VIỆN NGOÀI (Prometheus) ---
-try:
-    from prometheus_client import start_http_server, Counter as PromCounter, Gauge
-    try:
-         from config_db import PROMETHEUS_PORT
-    except ImportError:
-         PROMETHEUS_PORT = 8000
-         
-    REQUEST_COUNTER = PromCounter('voicebot_requests_total', 'Total requests.'); ERROR_COUNTER = PromCounter('voicebot_errors_total', 'Total errors.'); RESPONSE_TIME_GAUGE = Gauge('voicebot_response_time_seconds', 'Response time.')
-except Exception: 
-    start_http_server = lambda *a: None; PROMETHEUS_PORT = 8000
-    class _MockMetric: 
-        def inc(self): pass; 
-        def set(self, v): pass
-    REQUEST_COUNTER = ERROR_COUNTER = RESPONSE_TIME_GAUGE = _MockMetric()
+# --- METRICS (Prometheus, qua metrics_layer) ---
+from model_registry import registry as model_registry
+from metrics_layer import REQUEST_COUNTER, ERROR_COUNTER, RESPONSE_TIME_GAUGE, start_metrics_server
 
 # ==================== PHẦN I: HÀM HỖ TRỢ & HẰNG SỐ ====================
 
@@ -116,13 +107,16 @@ def styled_print(message, color="white"):
     reset = "\033[0m"
     print(f"{colors.get(color.lower(), colors['white'])}{message}{reset}")
 
-def log_to_file(message, log_file_path):
-    """Ghi log vào file."""
-    timestamp = _dt.now().strftime("%Y-%m-%d %H:%M:%S")
+def create_file_log_handler(log_file_path) -> Optional[logging.Handler]:
+    """Handler ghi log vào file (chạy trong luồng listener của logging_layer)."""
     try:
         log_dir = Path(log_file_path).parent; log_dir.mkdir(parents=True, exist_ok=True)
-        with open(log_file_path, 'a', encoding='utf-8') as f: f.write(f"[{timestamp}] {message}\n")
-    except Exception as e: styled_print(f"❌ [LOG] Lỗi ghi file log '{log_file_path}': {e}", "red")
+        handler = logging.FileHandler(log_file_path, encoding='utf-8')
+        handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S"))
+        return handler
+    except Exception as e:
+        styled_print(f"❌ [LOG] Lỗi mở file log '{log_file_path}': {e}", "red")
+        return None
 
 def anonymize_text(text):
     """Rút gọn text cho mục đích log."""
@@ -159,6 +153,11 @@ class App(ctk.CTk):
         self.processing_thread: Optional[threading.Thread] = None 
         self.mic_stream = None # Lưu trữ luồng mic async
 
+        # Logging: console + file + textbox UI đều chạy trong luồng listener, không chặn luồng gọi
+        self.log = get_logger("app")
+        file_handler = create_file_log_handler(LOG_FILE_PATH)
+        configure_logging(handlers=[h for h in (file_handler, CallbackHandler(self._schedule_ui_log)) if h])
+
         self.scenario_intents = SCENARIOS_CONFIG.get("intents", [])
         self.selected_intent_var = tk.StringVar(value=self.scenario_intents[0]["intent_name"] if self.scenario_intents else "")
 
@@ -251,11 +250,11 @@ class App(ctk.CTk):
 
     # ... (các hàm log, _append_log_safe, _save_ui_config, _load_ui_config giữ nguyên) ...
 
-    def log(self, message: str, color: str = "white"):
-        """In log ra console và UI."""
-        styled_print(message, color)
-        log_to_file(message, LOG_FILE_PATH)
-        self.after(0, lambda: self._append_log_safe(message, color))
+    def _schedule_ui_log(self, message: str, color: str = "white"):
+        """Đẩy log lên textbox UI (được gọi từ luồng listener của logging_layer)."""
+        try:
+            self.after(0, lambda: self._append_log_safe(message, color))
+        except Exception: pass
 
     def _append_log_safe(self, message, tag):
         """Ghi log an toàn vào textbox của UI."""
@@ -282,7 +281,7 @@ class App(ctk.CTk):
             self.log("💾 [CONFIG] Cấu hình UI đã được lưu.", "green")
             return True
         except Exception as e:
-            self.log(f"❌ [CONFIG] Lỗi lưu cấu hình: {e}", "red")
+            self.log("❌ [CONFIG] Lỗi lưu cấu hình: %s", "red", e)
             return False
 
     def _load_ui_config(self):
@@ -295,7 +294,7 @@ class App(ctk.CTk):
                     self.audio_device_var.set(config.get("audio_device", "Default"))
                 self.log("✅ [CONFIG] Cấu hình UI đã được tải.", "green")
             except Exception as e:
-                self.log(f"⚠️ [CONFIG] Lỗi tải cấu hình: {e}", "orange")
+                self.log("⚠️ [CONFIG] Lỗi tải cấu hình: %s", "orange", e)
 
 
     # -------------------- CORE MODULE INITIALIZATION --------------------
@@ -319,6 +318,7 @@ class App(ctk.CTk):
 
             # 3. Khởi tạo RTC Processor (Phần quan trọng)
             self.rtc_processor = RTCStreamProcessor(log_callback=self.log)
+            model_registry.start_warmup() # VAD/Whisper tải + warm-up nền
             
             # Kiểm tra trạng thái sẵn sàng
             is_ready = self.dm.is_ready() and self.voice_io.is_ready() and self.rtc_processor is not None
@@ -331,12 +331,12 @@ class App(ctk.CTk):
                  error_io = self.voice_io.get_initial_error() if self.voice_io and not self.voice_io.is_ready() else "IO Sẵn Sàng. "
                  error_dm = self.dm.get_initial_error() if self.dm and not self.dm.is_ready() else ""
                  error_msg = f"IO Lỗi: {error_io} | DM Lỗi: {error_dm}"
-                 self.log(f"❌ [APP] Core modules lỗi. Lỗi: {error_msg}", "red")
+                 self.log("❌ [APP] Core modules lỗi. Lỗi: %s", "red", error_msg)
                  self.after(0, lambda: self.status_label.configure(text=f"Trạng Thái: 🔴 Lỗi Core"))
                  self.after(0, lambda: self._update_buttons(False))
 
         except Exception as e:
-            self.log(f"❌ [APP] Lỗi khởi tạo core modules: {e}. Vui lòng kiểm tra các file dependency.", "red")
+            self.log("❌ [APP] Lỗi khởi tạo core modules: %s. Vui lòng kiểm tra các file dependency.", "red", e)
             self.after(0, lambda: self.status_label.configure(text="Trạng Thái: 🔴 Lỗi Core"))
             self.dm_initialized = False 
             self.after(0, lambda: self._update_buttons(False))
@@ -360,11 +360,11 @@ class App(ctk.CTk):
 
     async def create_stream_from_file(self, file_path: str) -> AsyncGenerator[bytes, None]:
         """Tạo Async Generator từ file WAV đã tải lên."""
-        self.log(f"📥 [File Stream] Bắt đầu đọc file: {file_path}", "blue")
+        self.log("📥 [File Stream] Bắt đầu đọc file: %s", "blue", file_path)
         try:
             with wave.open(file_path, 'rb') as wf:
                 if wf.getframerate() != SAMPLE_RATE or wf.getnchannels() != CHANNELS or wf.getsampwidth() != 2:
-                    self.log(f"❌ [File Stream] Định dạng file WAV không đúng (cần {SAMPLE_RATE}Hz, mono, 16-bit).", "red")
+                    self.log("❌ [File Stream] Định dạng file WAV không đúng (cần %sHz, mono, 16-bit).", "red", SAMPLE_RATE)
                     return 
                 
                 while True:
@@ -374,7 +374,7 @@ class App(ctk.CTk):
                     await asyncio.sleep(0.001)
             self.log("📥 [File Stream] Hoàn tất truyền file.", "blue")
         except Exception as e:
-            self.log(f"❌ [File Stream] Lỗi khi đọc file audio: {e}", "red")
+            self.log("❌ [File Stream] Lỗi khi đọc file audio: %s", "red", e)
             
     async def _mic_rtc_stream_async(self) -> AsyncGenerator[bytes, None]:
         """Giả lập luồng audio từ microphone cho RTC."""
@@ -413,7 +413,7 @@ class App(ctk.CTk):
             loop.run_until_complete(self._handle_rtc_session_async(audio_stream_generator()))
             
         except Exception as e:
-            self.log(f"❌ [App Thread] Lỗi nghiêm trọng trong luồng xử lý RTC: {e}", "red")
+            self.log("❌ [App Thread] Lỗi nghiêm trọng trong luồng xử lý RTC: %s", "red", e)
             traceback.print_exc()
         finally:
             self.is_processing = False
@@ -427,7 +427,7 @@ class App(ctk.CTk):
         session_id = str(uuid.uuid4())
         
         try:
-            self.log(f"🚀 [RTC] Session ID: {session_id}. Bắt đầu gọi RTC Processor...", "green")
+            self.log("🚀 [RTC] Session ID: %s. Bắt đầu gọi RTC Processor...", "green", session_id)
             self.after(0, lambda: self.progress_bar.set(0.1))
             
             output_stream: AsyncGenerator[Tuple[bool, Any], None] = self.rtc_processor.handle_rtc_session(audio_stream, session_id=session_id)
@@ -443,16 +443,16 @@ class App(ctk.CTk):
                     self.after(0, lambda: self._append_chat_safe("User", full_transcript, "User"))
                     self.after(0, lambda: self._append_chat_safe("Bot", response_text, "Bot"))
                     
-                    self.log(f"📝 [Chat Log] User: {anonymize_text(full_transcript)} | Bot: {anonymize_text(response_text)}", "cyan")
+                    self.log("📝 [Chat Log] User: %s | Bot: %s", "cyan", anonymize_text(full_transcript), anonymize_text(response_text))
                     self.after(0, lambda: self.progress_bar.set(0.3)) 
                 
                 else:
-                    self.log(f"🔈 [TTS Out] Nhận chunk phản hồi ({len(data)} bytes)", "purple")
+                    self.log.debug("🔈 [TTS Out] Nhận chunk phản hồi (%d bytes)", len(data), color="purple")
                     self.after(0, lambda: self.progress_bar.set(0.5)) 
                 
             duration = time.time() - start_time
             RESPONSE_TIME_GAUGE.set(duration)
-            self.log(f"✅ [RTC] Phiên hoàn tất. Thời gian phản hồi: {duration:.3f}s. File ghi âm đã lưu tại: {RECORDING_DIR}", "green")
+            self.log("✅ [RTC] Phiên hoàn tất. Thời gian phản hồi: %.3fs. File ghi âm đã lưu tại: %s", "green", duration, RECORDING_DIR)
             
             if not self.process_stop_event.is_set():
                  self.after(0, lambda: self.asr_label.configure(text=f"User (Stream): Xử lý hoàn tất."))
@@ -460,7 +460,7 @@ class App(ctk.CTk):
             
         except Exception as e:
             ERROR_COUNTER.inc()
-            self.log(f"❌ [RTC] Lỗi xử lý session: {e}", "red")
+            self.log("❌ [RTC] Lỗi xử lý session: %s", "red", e)
             traceback.print_exc()
             
     # -------------------- ACTION HANDLERS --------------------
@@ -488,7 +488,7 @@ class App(ctk.CTk):
         is_ready = self.rtc_processor is not None
         if not is_ready:
             # Lỗi này đã được log, nhưng chúng ta vẫn cần dừng lại nếu biến là None
-            self.log(f"❌ [IO] RTC Processor chưa sẵn sàng. (biến rtc_processor là None)", "red")
+            self.log("❌ [IO] RTC Processor chưa sẵn sàng. (biến rtc_processor là None)", "red")
             messagebox.showerror("Lỗi RTC", "Hệ thống RTC chưa sẵn sàng. Vui lòng kiểm tra Log.")
             return
 
@@ -536,7 +536,7 @@ class App(ctk.CTk):
         )
 
         if file_path:
-            self.log(f"⬆️ [Upload] Đã chọn file: {file_path}", "blue")
+            self.log("⬆️ [Upload] Đã chọn file: %s", "blue", file_path)
             
             stream_generator_obj = self.create_stream_from_file(file_path)
             
@@ -611,19 +611,20 @@ class App(ctk.CTk):
 
         if self.dm and hasattr(self.dm, 'terminate'):
             try: self.dm.terminate()
-            except Exception as e: self.log(f"⚠️ [APP] Error terminating DM: {e}", "orange")
+            except Exception as e: self.log("⚠️ [APP] Error terminating DM: %s", "orange", e)
 
         if self.voice_io and hasattr(self.voice_io, 'terminate'):
             try: self.voice_io.terminate()
-            except Exception as e: self.log(f"⚠️ [APP] Error terminating Voice IO: {e}", "orange")
+            except Exception as e: self.log("⚠️ [APP] Error terminating Voice IO: %s", "orange", e)
             
-        self.log(f"💾 [Recorder] File ghi âm được lưu tại thư mục: {RECORDING_DIR}", "orange")
+        self.log("💾 [Recorder] File ghi âm được lưu tại thư mục: %s", "orange", RECORDING_DIR)
 
         for f in [AUDIO_FILE, TEMP_TTS_FILE]:
             if f and os.path.exists(f):
                 try: os.remove(f)
-                except Exception as e: self.log(f"⚠️ [APP] Error deleting temp file {f}: {e}", "orange")
+                except Exception as e: self.log("⚠️ [APP] Error deleting temp file %s: %s", "orange", f, e)
 
+        shutdown_logging()
         self.destroy() 
 
 # ==================== PHẦN III: KHỞI CHẠY ỨNG DỤNG ====================
@@ -634,13 +635,7 @@ if __name__ == "__main__":
             try: os.remove(f)
             except Exception: pass
     
-    try:
-        if 'start_http_server' in globals() and start_http_server is not None:
-            start_http_server(PROMETHEUS_PORT); styled_print(f"📈 [Metrics] Prometheus server on port {PROMETHEUS_PORT}", "green")
-    except OSError as e:
-         if "Address already in use" in str(e): styled_print(f"⚠️ [Metrics] Port {PROMETHEUS_PORT} in use.", "orange")
-         else: styled_print(f"❌ [Metrics] Error starting Prometheus: {e}", "red")
-    except Exception as e: styled_print(f"❌ [Metrics] Error starting Prometheus: {e}", "red")
+    start_metrics_server()
     
     app = App()
     app.protocol("WM_DELETE_WINDOW", app._on_closing)
@@ -0,0 +1,356 @@
+# metrics_layer.py
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, Optional, Tuple
+
+from logging_layer import get_logger
+
+# --- THƯ VIỆN NGOÀI (Prometheus) ---
+try:
+    from prometheus_client import Counter, Gauge, Histogram, start_http_server, make_asgi_app
+    PROMETHEUS_IS_READY = True
+except ImportError:
+    PROMETHEUS_IS_READY = False
+    start_http_server = None
+    make_asgi_app = None
+
+    class _MockMetric:
+        """Metric câm khi không cài prometheus_client."""
+        def __init__(self, *args, **kwargs): pass
+        def labels(self, *args, **kwargs): return self
+        def inc(self, amount: float = 1): pass
+        def dec(self, amount: float = 1): pass
+        def set(self, value: float): pass
+        def observe(self, value: float): pass
+        def set_function(self, f: Callable[[], float]): pass
+
+    Counter = Gauge = Histogram = _MockMetric
+
+# --- SAFE IMPORT CONFIG ---
+try:
+    from config_db import PROMETHEUS_PORT, APP_SERVICE_NAME, STAGE_LATENCY_BUCKETS, RECENT_LATENCY_WINDOW
+except ImportError:
+    PROMETHEUS_PORT = 9100
+    APP_SERVICE_NAME = "HybridVoiceBot"
+    STAGE_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0)
+    RECENT_LATENCY_WINDOW = 200
+
+_log = get_logger("metrics")
+
+# Các stage của pipeline một lượt hội thoại
+PIPELINE_STAGES = ("vad", "asr", "nlu", "db", "response", "tts_first_byte", "tts_total", "turn")
+
+# ==================== METRICS ====================
+REQUEST_COUNTER = Counter('voicebot_requests_total', 'Total requests.')
+ERROR_COUNTER = Counter('voicebot_errors_total', 'Total errors.')
+RESPONSE_TIME_GAUGE = Gauge('voicebot_response_time_seconds', 'Response time of the last turn.')
+
+SESSION_COUNTER = Counter(
+    'voicebot_sessions_total', 'Sessions started.', ['nlu_mode', 'db_mode'])
+SESSION_ERROR_COUNTER = Counter(
+    'voicebot_session_errors_total', 'Sessions ended with an error.', ['nlu_mode', 'db_mode'])
+
+RECORDING_DURATION = Histogram(
+    'voicebot_recording_duration_seconds', 'Duration of recorded user audio per turn.',
+    buckets=(0.5, 1.0, 2.0, 3.0, 4.0, 6.0, 8.0, 12.0, 20.0, 30.0, 60.0))
+STAGE_LATENCY = Histogram(
+    'voicebot_stage_latency_seconds', 'Latency of each pipeline stage.', ['stage'],
+    buckets=STAGE_LATENCY_BUCKETS)
+
+ACTIVE_SESSIONS = Gauge('voicebot_active_sessions', 'Live WebRTC sessions.')
+EXECUTOR_QUEUE_DEPTH = Gauge(
+    'voicebot_executor_queue_depth', 'Pending work items in a thread pool executor.', ['executor'])
+MODEL_POOL_UTILIZATION = Gauge(
+    'voicebot_model_pool_utilization', 'Busy model instances / pool capacity.', ['model'])
+PREGATE_FRAMES = Counter(
+    'voicebot_vad_pregate_frames_total', 'Frames seen by the energy pre-gate before Silero VAD.', ['result'])
+PREGATE_SKIPPED_TURNS = Counter(
+    'voicebot_vad_pregate_skipped_turns_total', 'Turns below the noise floor (VAD and ASR skipped).')
+ASR_TIER_RESULTS = Counter(
+    'voicebot_asr_tier_results_total', 'ASR cascade decodes per model tier and outcome (accepted/escalated/final).',
+    ['tier', 'outcome'])
+KWS_RESULTS = Counter(
+    'voicebot_kws_results_total', 'Keyword spotting results (matched turns skip ASR and NLU).', ['intent', 'outcome'])
+ASR_QUALITY_TIER = Gauge(
+    'voicebot_asr_quality_tier', 'Active adaptive ASR quality tier (0 = full quality, higher = degraded).')
+ASR_QUALITY_TIER_CHANGES = Counter(
+    'voicebot_asr_quality_tier_changes_total', 'Adaptive ASR quality tier changes.', ['direction'])
+PEER_CONNECTIONS_LIVE = Gauge(
+    'voicebot_peer_connections_live', 'RTCPeerConnections registered with the connection manager.')
+PEER_CONNECTIONS_LEAKED = Gauge(
+    'voicebot_peer_connections_leaked', 'Closed RTCPeerConnections still alive in memory (not garbage collected).')
+CONNECTION_TASKS_LIVE = Gauge(
+    'voicebot_connection_tasks_live', 'Unfinished asyncio tasks owned by live connections.')
+PEER_CONNECTIONS_CLOSED = Counter(
+    'voicebot_peer_connections_closed_total', 'RTCPeerConnections closed by the connection manager.', ['reason'])
+TURN_SCHED_WAIT = Histogram(
+    'voicebot_turn_scheduler_wait_seconds', 'Time a turn waited in the fair scheduler before running a stage.',
+    ['stage', 'tenant'], buckets=STAGE_LATENCY_BUCKETS)
+TURN_SCHED_QUEUED = Gauge(
+    'voicebot_turn_scheduler_queued', 'Turns waiting in the fair scheduler.', ['stage', 'tenant'])
+TURNS_CANCELLED = Counter(
+    'voicebot_turns_cancelled_total', 'Turns cancelled while processing.', ['reason'])
+CANCELLED_WORK_SECONDS = Counter(
+    'voicebot_cancelled_work_seconds_total', 'Worker seconds spent on turns that were cancelled (wasted compute).',
+    ['stage'])
+CANCEL_RELEASE_SECONDS = Histogram(
+    'voicebot_cancel_release_seconds', 'Time from cancellation until a busy worker released the turn.', ['stage'],
+    buckets=STAGE_LATENCY_BUCKETS)
+SPECULATIVE_PREFETCH = Counter(
+    'voicebot_speculative_prefetch_total',
+    'Speculative DB lookups from partial transcripts (fired/hit/discarded/stale).', ['outcome'])
+SPECULATIVE_DB_SAVED = Histogram(
+    'voicebot_speculative_db_saved_seconds', 'DB time hidden behind the utterance by a committed prefetch.',
+    buckets=STAGE_LATENCY_BUCKETS)
+FILLER_DECISIONS = Counter(
+    'voicebot_filler_decisions_total', 'Latency-masking filler decisions per intent (played/below_threshold/no_clip).',
+    ['intent', 'decision'])
+TTS_SPLICE = Counter(
+    'voicebot_tts_splice_total', 'Templated replies rendered from cached clips (spliced/no_template/missing_clips).',
+    ['outcome'])
+BARGE_INS = Counter(
+    'voicebot_barge_ins_total', 'Caller speech detected while the bot reply was being synthesized or played.', ['phase'])
+ADMISSION_DECISIONS = Counter(
+    'voicebot_admission_decisions_total', 'Call admission decisions at /offer.', ['decision', 'reason'])
+AUDIO_BUFFER_BYTES = Gauge('voicebot_audio_buffer_bytes', 'Bytes preallocated for audio ring buffers.')
+AUDIO_BUFFER_OVERFLOW_SAMPLES = Counter(
+    'voicebot_audio_buffer_overflow_samples_total', 'Samples dropped because an utterance exceeded its max length.')
+
+
+# Cửa sổ latency gần nhất mỗi stage (histogram Prometheus không đọc lại được percentile): (monotonic, giây)
+_recent_latency: Dict[str, Deque[Tuple[float, float]]] = {}
+_active_sessions = 0
+_sessions_lock = threading.Lock()
+_executors: Dict[str, Any] = {}
+_queues: Dict[str, Callable[[], int]] = {}
+
+
+# ==================== HÀM GHI METRIC ====================
+def observe_stage(stage: str, seconds: float):
+    """Ghi latency (giây) của một stage vào histogram."""
+    STAGE_LATENCY.labels(stage).observe(seconds)
+    window = _recent_latency.get(stage)
+    if window is None:
+        window = _recent_latency.setdefault(stage, deque(maxlen=RECENT_LATENCY_WINDOW))
+    window.append((time.monotonic(), seconds))
+
+
+def _percentile(sorted_values, q: float) -> float:
+    return sorted_values[max(0, math.ceil(q * len(sorted_values)) - 1)]
+
+
+def recent_stage_latencies() -> Dict[str, Dict[str, Any]]:
+    """p50/p95/last (ms) của RECENT_LATENCY_WINDOW mẫu gần nhất mỗi stage."""
+    report = {}
+    for stage, window in list(_recent_latency.items()):
+        values = [seconds for _, seconds in list(window)]
+        if not values:
+            continue
+        ordered = sorted(values)
+        report[stage] = {
+            "count": len(values),
+            "p50_ms": round(_percentile(ordered, 0.50) * 1000, 1),
+            "p95_ms": round(_percentile(ordered, 0.95) * 1000, 1),
+            "last_ms": round(values[-1] * 1000, 1),
+        }
+    return report
+
+
+def recent_stage_quantile(stage: str, q: float, last: int, max_age_s: Optional[float] = None) -> Optional[float]:
+    """
+    Quantile (giây) của `last` mẫu latency mới nhất của stage, chỉ tính mẫu không cũ hơn max_age_s;
+    None nếu không còn mẫu nào.
+    """
+    window = _recent_latency.get(stage)
+    if not window:
+        return None
+    samples = list(window)[-last:]
+    if max_age_s is not None:
+        oldest = time.monotonic() - max_age_s
+        samples = [sample for sample in samples if sample[0] >= oldest]
+    if not samples:
+        return None
+    return _percentile(sorted(seconds for _, seconds in samples), q)
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """Đo thời gian một khối code: with stage_timer("asr"): ..."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def observe_pregate(total_frames: int, passed_frames: int):
+    PREGATE_FRAMES.labels("passed").inc(passed_frames)
+    PREGATE_FRAMES.labels("gated").inc(total_frames - passed_frames)
+    if total_frames and not passed_frames:
+        PREGATE_SKIPPED_TURNS.inc()
+
+
+def observe_asr_tier(tier: str, outcome: str):
+    ASR_TIER_RESULTS.labels(tier, outcome).inc()
+
+
+def observe_kws(intent: Optional[str]):
+    """intent=None: không khớp, lượt đi tiếp qua ASR."""
+    KWS_RESULTS.labels(intent or "none", "matched" if intent else "rejected").inc()
+
+
+def observe_recording(duration_seconds: float):
+    RECORDING_DURATION.observe(duration_seconds)
+
+
+def record_session_start(nlu_mode: str, db_mode: str):
+    REQUEST_COUNTER.inc()
+    SESSION_COUNTER.labels(nlu_mode, db_mode).inc()
+
+
+def record_session_error(nlu_mode: str, db_mode: str):
+    ERROR_COUNTER.inc()
+    SESSION_ERROR_COUNTER.labels(nlu_mode, db_mode).inc()
+
+
+def session_opened() -> int:
+    """Tăng số session đang sống (gauge + bộ đếm đọc được cho /readyz)."""
+    global _active_sessions
+    with _sessions_lock:
+        _active_sessions += 1
+        ACTIVE_SESSIONS.set(_active_sessions)
+        return _active_sessions
+
+
+def session_closed() -> int:
+    global _active_sessions
+    with _sessions_lock:
+        _active_sessions = max(0, _active_sessions - 1)
+        ACTIVE_SESSIONS.set(_active_sessions)
+        return _active_sessions
+
+
+def active_session_count() -> int:
+    return _active_sessions
+
+
+def register_executor(name: str, executor) -> None:
+    """Theo dõi độ sâu queue của ThreadPoolExecutor (đọc lúc scrape, không tốn chi phí khi chạy)."""
+    _executors[name] = executor
+    EXECUTOR_QUEUE_DEPTH.labels(name).set_function(lambda: executor_queue_depth(executor))
+
+
+def executor_queue_depth(executor) -> int:
+    work_queue = getattr(executor, "_work_queue", None)
+    return work_queue.qsize() if work_queue is not None else 0
+
+
+def register_queue(name: str, depth_fn: Callable[[], int]) -> None:
+    """Queue không phải ThreadPoolExecutor (ví dụ turn_scheduler): tính chung vào executor_queue_depths."""
+    _queues[name] = depth_fn
+    EXECUTOR_QUEUE_DEPTH.labels(name).set_function(depth_fn)
+
+
+def executor_queue_depths() -> Dict[str, int]:
+    """Độ sâu queue hiện tại của mọi executor đã register_executor / register_queue."""
+    depths = {name: executor_queue_depth(executor) for name, executor in list(_executors.items())}
+    depths.update({name: depth_fn() for name, depth_fn in list(_queues.items())})
+    return depths
+
+
+class ModelPool:
+    """
+    Giới hạn số lượt dùng đồng thời một model (capacity = số instance) và đếm để tính utilization
+    (in_use / capacity, không vượt 1) cùng số lượt đang chờ model (waiting).
+    """
+    def __init__(self, name: str, capacity: int = 1):
+        self.name = name
+        self.capacity = max(1, capacity)
+        self._in_use = 0
+        self._waiting = 0
+        self._cond = threading.Condition()
+        MODEL_POOL_UTILIZATION.labels(name).set_function(self.utilization)
+
+    @property
+    def in_use(self) -> int:
+        return self._in_use
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    def utilization(self) -> float:
+        return self._in_use / self.capacity
+
+    @contextmanager
+    def acquire(self, blocking: bool = True) -> Iterator[bool]:
+        """Giữ một instance trong khối with. blocking=False: không chờ, yield False nếu pool đang bận hết."""
+        with self._cond:
+            if self._in_use >= self.capacity:
+                if not blocking:
+                    yield False
+                    return
+                self._waiting += 1
+                try:
+                    self._cond.wait_for(lambda: self._in_use < self.capacity)
+                finally:
+                    self._waiting -= 1
+            self._in_use += 1
+        try:
+            yield True
+        finally:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+
+
+_model_pools: Dict[str, ModelPool] = {}
+# Pool được tạo lười từ thread executor: tạo trong lock để hai thread không dựng hai pool cho cùng model
+_model_pools_lock = threading.Lock()
+
+
+def model_pool_backlog(prefix: str = "") -> int:
+    """Số lượt đang chờ model trên các pool có tên bắt đầu bằng prefix."""
+    return sum(pool.waiting for name, pool in list(_model_pools.items()) if name.startswith(prefix))
+
+
+def model_pool(name: str, capacity: int = 1) -> ModelPool:
+    """Lấy (hoặc tạo) ModelPool theo tên."""
+    pool = _model_pools.get(name)
+    if pool is None:
+        with _model_pools_lock:
+            pool = _model_pools.get(name)
+            if pool is None:
+                pool = _model_pools[name] = ModelPool(name, capacity)
+    return pool
+
+
+# ==================== HTTP EXPORT ====================
+_server_started = False
+
+
+def start_metrics_server(port: Optional[int] = None) -> bool:
+    """Mở endpoint Prometheus trên PROMETHEUS_PORT (idempotent)."""
+    global _server_started
+    if _server_started:
+        return True
+    if not PROMETHEUS_IS_READY:
+        _log.warning("⚠️ [Metrics] prometheus_client chưa được cài. Bỏ qua metrics server.")
+        return False
+    port = port or PROMETHEUS_PORT
+    try:
+        start_http_server(port)
+        _server_started = True
+        _log("📈 [Metrics] Prometheus server (%s) on port %d", "green", APP_SERVICE_NAME, port)
+        return True
+    except OSError as e:
+        _log.warning("⚠️ [Metrics] Không mở được port %d: %s", port, e)
+        return False
+
+
+def metrics_asgi_app():
+    """ASGI app cho route /metrics trên chính FastAPI server (None nếu thiếu prometheus_client)."""
+    return make_asgi_app() if PROMETHEUS_IS_READY else None
@@ -0,0 +1,335 @@
+# model_registry.py
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from logging_layer import get_logger
+
+# --- SAFE IMPORT CONFIG ---
+try:
+    from config_db import (
+        MODEL_ARTIFACT_DIR, ALLOW_MODEL_DOWNLOAD, WHISPER_MODEL_NAME, SAMPLE_RATE, MODEL_WARMUP_ON_START, VAD_ENGINE
+    )
+except ImportError:
+    MODEL_ARTIFACT_DIR = "models"
+    ALLOW_MODEL_DOWNLOAD = False
+    WHISPER_MODEL_NAME = "small"
+    SAMPLE_RATE = 16000
+    MODEL_WARMUP_ON_START = True
+    VAD_ENGINE = "torch"
+
+try:
+    from config_db import ASR_CASCADE_ENABLED, ASR_CASCADE_FIRST_MODEL
+except ImportError:
+    ASR_CASCADE_ENABLED = False
+    ASR_CASCADE_FIRST_MODEL = "tiny"
+
+try:
+    from config_db import KWS_ENABLED
+except ImportError:
+    KWS_ENABLED = False
+
+try:
+    from config_db import ASR_QUALITY_ADAPTIVE, ASR_QUALITY_TIERS
+except ImportError:
+    ASR_QUALITY_ADAPTIVE = False
+    ASR_QUALITY_TIERS = ()
+
+# Trạng thái của từng model
+STATE_NOT_LOADED = "not_loaded"
+STATE_LOADING = "loading"
+STATE_WARMING_UP = "warming_up"
+STATE_READY = "ready"
+STATE_FAILED = "failed"
+
+
+# ==================== VAD (giao diện numpy) ====================
+class SileroTorchVAD:
+    """
+    Silero VAD chạy bằng torch, giao diện numpy:
+    speech_timestamps(audio) -> [{"start", "end"}] (mẫu), collect_chunks(ts, audio) -> np.ndarray.
+    """
+    engine = "torch"
+
+    def __init__(self, model, get_speech_timestamps: Callable, collect_chunks: Callable, device: str):
+        import torch
+        self._torch = torch
+        self.model = model.to(device)
+        self._get_speech_timestamps = get_speech_timestamps
+        self._collect_chunks = collect_chunks
+        self.device = device
+
+    def speech_timestamps(self, audio: np.ndarray, sampling_rate: int = SAMPLE_RATE, threshold: float = 0.3) -> List[Dict[str, int]]:
+        audio_tensor = self._torch.from_numpy(np.ascontiguousarray(audio, dtype=np.float32))
+        return self._get_speech_timestamps(audio_tensor.to(self.device), self.model, sampling_rate=sampling_rate, threshold=threshold)
+
+    def collect_chunks(self, timestamps: List[Dict[str, int]], audio: np.ndarray) -> np.ndarray:
+        audio_tensor = self._torch.from_numpy(np.ascontiguousarray(audio, dtype=np.float32))
+        return self._collect_chunks(timestamps, audio_tensor).cpu().numpy()
+
+
+# ==================== REGISTRY ====================
+class _Entry:
+    __slots__ = ("state", "model", "error", "source", "load_seconds", "warmup_seconds", "lock")
+
+    def __init__(self):
+        self.state = STATE_NOT_LOADED
+        self.model: Any = None
+        self.error: Optional[str] = None
+        self.source: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self.lock = threading.Lock()
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"state": self.state, "source": self.source, "error": self.error,
+                "load_seconds": self.load_seconds, "warmup_seconds": self.warmup_seconds}
+
+
+class ModelRegistry:
+    """
+    Quản lý model VAD/Whisper: tìm weight trong thư mục artifact cục bộ (không cần mạng),
+    tải lười (lazy) khi cần, hoặc tải + chạy 1 inference giả (warm-up) trong thread nền.
+    Khóa model: "vad", "whisper:<tên>", "kws".
+    """
+
+    def __init__(self, artifact_dir: str = MODEL_ARTIFACT_DIR, allow_download: bool = ALLOW_MODEL_DOWNLOAD,
+                 vad_engine: str = VAD_ENGINE, log_callback: Optional[Callable] = None):
+        self.artifact_dir = Path(artifact_dir)
+        self.allow_download = allow_download
+        self.vad_engine = vad_engine.lower()
+        self._log = get_logger("models", log_callback)
+        self._entries: Dict[str, _Entry] = {}
+        self._entries_lock = threading.Lock()
+        self._device: Optional[str] = None
+        self._warmup_thread: Optional[threading.Thread] = None
+
+    # ---------- trạng thái ----------
+    def _entry(self, key: str) -> _Entry:
+        with self._entries_lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry()
+            return entry
+
+    @property
+    def device(self) -> str:
+        if self._device is None:
+            try:
+                import torch
+                self._device = "cuda" if torch.cuda.is_available() else "cpu"
+            except ImportError:
+                self._device = "cpu"
+        return self._device
+
+    @property
+    def use_fp16(self) -> bool:
+        return self.device == "cuda"
+
+    def state(self, key: str) -> str:
+        return self._entry(key).state
+
+    def is_ready(self, keys: Optional[List[str]] = None) -> bool:
+        keys = keys or ["vad", f"whisper:{WHISPER_MODEL_NAME}"]
+        return all(self.state(k) == STATE_READY for k in keys)
+
+    def status(self) -> Dict[str, Any]:
+        with self._entries_lock:
+            entries = dict(self._entries)
+        return {
+            "ready": self.is_ready(),
+            "device": self._device,
+            "warmup_running": bool(self._warmup_thread and self._warmup_thread.is_alive()),
+            "models": {key: entry.as_dict() for key, entry in entries.items()},
+        }
+
+    # ---------- inject (test/benchmark) ----------
+    def register(self, key: str, model: Any, source: str = "injected"):
+        """Đăng ký model có sẵn (ví dụ model giả lập) thay vì tải từ đĩa."""
+        entry = self._entry(key)
+        with entry.lock:
+            entry.model, entry.state, entry.source, entry.error = model, STATE_READY, source, None
+
+    # ---------- tải lười ----------
+    def _load(self, key: str, loader: Callable[[], Any]) -> Optional[Any]:
+        entry = self._entry(key)
+        if entry.state == STATE_READY:
+            return entry.model
+        with entry.lock:
+            if entry.model is not None:
+                return entry.model
+            if entry.state == STATE_FAILED:
+                return None
+            entry.state = STATE_LOADING
+            start = time.perf_counter()
+            try:
+                entry.model = loader()
+                entry.load_seconds = round(time.perf_counter() - start, 3)
+                entry.state = STATE_READY
+                self._log("✅ [MODELS] Đã tải %s (%s) trong %.2fs", "green", key, entry.source, entry.load_seconds)
+            except Exception as e:
+                entry.state, entry.error = STATE_FAILED, f"{type(e).__name__}: {e}"
+                self._log.error("❌ [MODELS] Lỗi tải %s: %s", key, e)
+                return None
+        return entry.model
+
+    def get_vad(self):
+        """VAD theo VAD_ENGINE (SileroOnnxVAD hoặc SileroTorchVAD; tải nếu chưa có). None nếu tải thất bại."""
+        return self._load("vad", self._load_vad)
+
+    def get_whisper(self, name: str = WHISPER_MODEL_NAME) -> Optional[Any]:
+        """Whisper model theo tên (tải nếu chưa có). None nếu tải thất bại."""
+        return self._load(f"whisper:{name}", lambda: self._load_whisper(name))
+
+    def get_keyword_spotter(self) -> Optional[Any]:
+        """KeywordSpotter từ <artifact_dir>/kws. None nếu chưa có template (lượt nói đi thẳng qua ASR)."""
+        return self._load("kws", self._load_keyword_spotter)
+
+    def retry_failed(self):
+        """Cho phép tải lại model đã FAILED (ví dụ sau khi copy weight vào artifact dir)."""
+        with self._entries_lock:
+            for entry in self._entries.values():
+                if entry.state == STATE_FAILED:
+                    entry.state, entry.error = STATE_NOT_LOADED, None
+
+    # ---------- loaders ----------
+    def _load_vad(self):
+        """onnx: chỉ onnxruntime + NumPy; torch: Silero qua torch.hub; auto: onnx nếu có, ngược lại torch."""
+        if self.vad_engine in ("onnx", "auto"):
+            try:
+                return self._load_silero_onnx()
+            except (ImportError, FileNotFoundError) as e:
+                if self.vad_engine == "onnx":
+                    raise
+                self._log.debug("[MODELS] Không dùng được Silero ONNX (%s), chuyển sang torch.", e)
+        return self._load_silero_vad()
+
+    def _load_silero_onnx(self):
+        from vad_engine import SileroOnnxVAD, find_silero_onnx
+        model_path = find_silero_onnx(self.artifact_dir)
+        if model_path is None:
+            raise FileNotFoundError(f"Không tìm thấy silero_vad.onnx trong '{self.artifact_dir}' hoặc package silero_vad.")
+        vad = SileroOnnxVAD(model_path)
+        self._entry("vad").source = f"onnx:{model_path}"
+        return vad
+
+    def _load_silero_vad(self) -> SileroTorchVAD:
+        import torch
+        entry = self._entry("vad")
+        local_repo = self.artifact_dir / "silero-vad"
+        # 1. Repo silero-vad đã clone sẵn trong artifact dir (hubconf.py + weights)
+        if (local_repo / "hubconf.py").exists():
+            model, utils = torch.hub.load(repo_or_dir=str(local_repo), model="silero_vad", source="local", onnx=False)
+            entry.source = f"local:{local_repo}"
+            return SileroTorchVAD(model, utils[0], utils[3], self.device)
+        # 2. Package pip 'silero-vad' (weight đóng gói sẵn trong package)
+        try:
+            from silero_vad import load_silero_vad, get_speech_timestamps, collect_chunks
+            entry.source = "package:silero_vad"
+            return SileroTorchVAD(load_silero_vad(onnx=False), get_speech_timestamps, collect_chunks, self.device)
+        except ImportError:
+            pass
+        # 3. Cache torch.hub có sẵn (lần tải trước, kể cả trước khi có artifact dir)
+        hub_repo = Path(torch.hub.get_dir()) / "snakers4_silero-vad_master"
+        if (hub_repo / "hubconf.py").exists():
+            model, utils = torch.hub.load(repo_or_dir=str(hub_repo), model="silero_vad", source="local", onnx=False)
+            entry.source = f"hub_cache:{hub_repo}"
+            return SileroTorchVAD(model, utils[0], utils[3], self.device)
+        # 4. torch.hub từ GitHub (chỉ khi cho phép tải)
+        if not self.allow_download:
+            raise FileNotFoundError(
+                f"Không tìm thấy Silero VAD trong '{local_repo}', package silero_vad hoặc cache '{hub_repo}' "
+                f"(ALLOW_MODEL_DOWNLOAD=False; đặt VOICEBOT_MODEL_DIR hoặc VOICEBOT_ALLOW_MODEL_DOWNLOAD=1)."
+            )
+        model, utils = torch.hub.load(repo_or_dir="snakers4/silero-vad", model="silero_vad",
+                                      force_reload=False, onnx=False, trust_repo=True)
+        entry.source = "hub:snakers4/silero-vad"
+        return SileroTorchVAD(model, utils[0], utils[3], self.device)
+
+    def _load_keyword_spotter(self):
+        from keyword_spotter import KeywordSpotter
+        template_dir = self.artifact_dir / "kws"
+        spotter = KeywordSpotter.from_dir(template_dir)
+        self._entry("kws").source = f"local:{template_dir} ({len(spotter.templates)} templates)"
+        return spotter
+
+    @staticmethod
+    def _whisper_cache_dir() -> Path:
+        """Thư mục cache mặc định của openai-whisper (download_root=None): $XDG_CACHE_HOME/whisper."""
+        return Path(os.getenv("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))) / "whisper"
+
+    def _whisper_checkpoints(self, name: str) -> List[Path]:
+        """Nơi tìm weight theo thứ tự: artifact dir, rồi cache chuẩn của whisper (weight đã tải từ trước)."""
+        import whisper
+        if name in getattr(whisper, "_MODELS", {}):
+            file_name = os.path.basename(whisper._MODELS[name])
+            return [self.artifact_dir / "whisper" / file_name, self._whisper_cache_dir() / file_name]
+        return [Path(name)]
+
+    def _load_whisper(self, name: str):
+        import whisper
+        entry = self._entry(f"whisper:{name}")
+        candidates = self._whisper_checkpoints(name)
+        checkpoint = next((path for path in candidates if path.exists()), None)
+        if checkpoint is not None:
+            model = whisper.load_model(str(checkpoint), device=self.device)
+            entry.source = f"local:{checkpoint}"
+        elif self.allow_download:
+            # Tải vào cache chuẩn của whisper: dùng lại được cho lần sau và cho công cụ khác
+            model = whisper.load_model(name, device=self.device)
+            entry.source = f"download:{name}"
+        else:
+            raise FileNotFoundError(
+                f"Không tìm thấy weight Whisper '{name}' trong {', '.join(str(path) for path in candidates)} "
+                f"(ALLOW_MODEL_DOWNLOAD=False; đặt VOICEBOT_MODEL_DIR hoặc VOICEBOT_ALLOW_MODEL_DOWNLOAD=1)."
+            )
+        if self.use_fp16:
+            model = model.half()
+        return model
+
+    # ---------- warm-up ----------
+    def _warm(self, key: str, run: Callable[[Any], Any], model: Any):
+        entry = self._entry(key)
+        if model is None or entry.warmup_seconds is not None:
+            return
+        entry.state = STATE_WARMING_UP
+        start = time.perf_counter()
+        try:
+            run(model)
+            entry.warmup_seconds = round(time.perf_counter() - start, 3)
+            self._log("🔥 [MODELS] Warm-up %s xong (%.2fs)", "green", key, entry.warmup_seconds)
+        except Exception as e:
+            self._log.warning("⚠️ [MODELS] Warm-up %s lỗi: %s", key, e)
+        finally:
+            entry.state = STATE_READY
+
+    def warm_up(self, whisper_names: Optional[List[str]] = None):
+        """Tải VAD/Whisper (cả model tầng đầu của ASR cascade / tầng giảm chất lượng) và chạy một inference giả (1 giây im lặng)."""
+        dummy = np.zeros(SAMPLE_RATE, dtype=np.float32)
+        self._warm("vad", lambda vad: vad.speech_timestamps(dummy), self.get_vad())
+        if KWS_ENABLED:
+            self._warm("kws", lambda spotter: spotter.spot(dummy), self.get_keyword_spotter())
+        default_names = ([ASR_CASCADE_FIRST_MODEL] if ASR_CASCADE_ENABLED else []) + [WHISPER_MODEL_NAME]
+        # Model của các tầng giảm chất lượng: tải sẵn để lúc quá tải không phải tải model mới
+        if ASR_QUALITY_ADAPTIVE:
+            default_names += [t["model"] for t in ASR_QUALITY_TIERS if t.get("model") and t["model"] not in default_names]
+        for name in whisper_names or default_names:
+            self._warm(f"whisper:{name}",
+                       lambda model: model.transcribe(dummy, language="vi", fp16=self.use_fp16),
+                       self.get_whisper(name))
+
+    def start_warmup(self, whisper_names: Optional[List[str]] = None) -> threading.Thread:
+        """Warm-up trong thread nền (idempotent); server vẫn nhận kết nối trong lúc đó."""
+        if self._warmup_thread is None or not self._warmup_thread.is_alive():
+            self._warmup_thread = threading.Thread(target=self.warm_up, args=(whisper_names,),
+                                                   name="model-warmup", daemon=True)
+            self._warmup_thread.start()
+        return self._warmup_thread
+
+
+# Registry dùng chung cho cả process
+registry = ModelRegistry()
@@ -25,6 +25,22 @@ try:
 except ImportError:
     gTTS = None
     
+# Mẫu phản hồi theo dữ liệu DB. tts_splicer dùng chung các mẫu này để tách câu mang (render sẵn) và slot.
+DB_RESPONSE_TEMPLATES: Dict[str, str] = {
+    "customer_info": (
+        "Thông tin khách hàng: **{customer_name}**. Lần đặt hàng gần nhất: {last_order}."
+        " Bạn cần hỗ trợ thêm về thông tin này không?"
+    ),
+    "product_discount": (
+        "Sản phẩm **{product_name}** hiện có giá {price}."
+        " Bạn sẽ được giảm giá {discount} phần trăm. Bạn có muốn đặt hàng ngay không?"
+    ),
+    "product_no_discount": (
+        "Sản phẩm **{product_name}** có giá {price}. Hiện sản phẩm này không có khuyến mãi nào đặc biệt."
+        " Bạn có muốn tôi kiểm tra thông tin khác không?"
+    ),
+}
+
 # ======================================================
 # LỚP TTS CƠ SỞ VÀ MOCK
 # ======================================================
@@ -132,25 +148,17 @@ class ResponseGenerator:
         product_data = db_result.get("product_data")
 
         if intent == "query_customer_info" and customer_data:
-            return (
-                f"Thông tin khách hàng: **{customer_data['customer_name']}**."
-                f" Lần đặt hàng gần nhất: {customer_data['last_order']}."
-                f" Bạn cần hỗ trợ thêm về thông tin này không?"
-            )
+            return DB_RESPONSE_TEMPLATES["customer_info"].format(
+                customer_name=customer_data['customer_name'], last_order=customer_data['last_order'])
         
         if intent == "query_product_info" and product_data:
             discount = product_data.get("discount")
             if discount and int(discount) > 0:
-                 return (
-                    f"Sản phẩm **{product_data['product_name']}** hiện có giá {product_data['price']}."
-                    f" Bạn sẽ được giảm giá {discount} phần trăm. Bạn có muốn đặt hàng ngay không?"
-                 )
+                 return DB_RESPONSE_TEMPLATES["product_discount"].format(
+                    product_name=product_data['product_name'], price=product_data['price'], discount=discount)
             else:
-                 return (
-                    f"Sản phẩm **{product_data['product_name']}** có giá {product_data['price']}. "
-                    f"Hiện sản phẩm này không có khuyến mãi nào đặc biệt. "
-                    f"Bạn có muốn tôi kiểm tra thông tin khác không?"
-                 )
+                 return DB_RESPONSE_TEMPLATES["product_no_discount"].format(
+                    product_name=product_data['product_name'], price=product_data['price'])
         
         return None
 
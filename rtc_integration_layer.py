@@ -1,16 +1,15 @@
 # rtc_integration_layer.py
 import asyncio
+import functools
 import os
 from pathlib import Path
-from typing import AsyncGenerator, Callable, Optional, Tuple, Any, Dict, ClassVar
+from typing import AsyncGenerator, Callable, Optional, Tuple, Any, Dict, ClassVar, List
 from datetime import datetime as _dt
 import numpy as np 
-import torch 
 import traceback 
 import time 
 import base64
 import httpx 
-import whisper # Cần cài đặt thư viện Whisper
 from concurrent.futures import ThreadPoolExecutor
 # Thêm import cho GTTS và chuyển đổi audio
 import io 
@@ -32,13 +31,14 @@ INTERNAL_API_KEY = "YOUR_DEFAULT_INTERNAL_API_KEY_HERE"
 
 # --- SAFE IMPORTS (CONFIG, DIALOG MANAGER VÀ RESPONSE GENERATOR) ---
 try:
-    from config_db import WHISPER_MODEL_NAME, SAMPLE_RATE 
+    from config_db import WHISPER_MODEL_NAME, SAMPLE_RATE, NLU_MODE_DEFAULT, DB_MODE_DEFAULT
     from dialog_manager import DialogManager 
     from response_generator import ResponseGenerator # ResponseGenerator được DialogManager sử dụng
 except ImportError:
     # Fallback/Mock nếu không tìm thấy các lớp cốt lõi
     WHISPER_MODEL_NAME = "tiny" 
     SAMPLE_RATE = 16000
+    NLU_MODE_DEFAULT = DB_MODE_DEFAULT = "MOCK"
     class ResponseGenerator:
         def __init__(self, *args, **kwargs): pass
     class DialogManager:
@@ -50,92 +50,281 @@ except ImportError:
             return {"response_text": res_text, "response_audio_path": None, "user_input_asr": user_input_asr}
 
 
+from logging_layer import get_logger
+from metrics_layer import register_executor, model_pool, model_pool_backlog, record_session_start, record_session_error, observe_pregate, observe_asr_tier, observe_kws
+from tracing_layer import span, record_span, run_in_context
+from model_registry import registry as model_registry, STATE_READY
+from audio_frontend import load_audio, energy_gate, PREGATE_ENABLED
+from asr_fastpath import transcribe_short
+from keyword_spotter import KeywordMatch
+from asr_quality import QualityTier, controller as quality_controller
+from turn_scheduler import scheduler as turn_scheduler
+import cancellation
+import filler_audio
+import tts_splicer
+from tts_splicer import normalize_vi
+from cancellation import CancelToken, check_cancelled, tracked
+
+try:
+    from config_db import (
+        ASR_FASTPATH_ENABLED, ASR_CASCADE_ENABLED, ASR_CASCADE_FIRST_MODEL,
+        ASR_CASCADE_MIN_AVG_LOGPROB, ASR_CASCADE_MAX_NO_SPEECH_PROB, NLU_CONFIDENCE_THRESHOLD
+    )
+except ImportError:
+    ASR_FASTPATH_ENABLED = ASR_CASCADE_ENABLED = False
+    ASR_CASCADE_FIRST_MODEL = "tiny"
+    ASR_CASCADE_MIN_AVG_LOGPROB, ASR_CASCADE_MAX_NO_SPEECH_PROB, NLU_CONFIDENCE_THRESHOLD = -0.6, 0.5, 0.6
+
+try:
+    from config_db import KWS_ENABLED
+except ImportError:
+    KWS_ENABLED = False
+
+try:
+    from config_db import FILLER_ENABLED
+except ImportError:
+    FILLER_ENABLED = False
+
+try:
+    from config_db import SPECULATIVE_PREFETCH_ENABLED, SPECULATIVE_PARTIAL_MODEL
+except ImportError:
+    SPECULATIVE_PREFETCH_ENABLED = False
+    SPECULATIVE_PARTIAL_MODEL = "tiny"
+
 RECORDING_DIR = Path("rtc_recordings"); RECORDING_DIR.mkdir(exist_ok=True) 
 
-def _log_colored(message, color="white"):
-    color_map = {
-        "red": "\033[91m", "green": "\033[92m", "yellow": "\033[93m", 
-        "blue": "\033[94m", "magenta": "\033[95m", "cyan": "\033[96m", "white": "\033[97m", "orange": "\033[33m"
-    }
-    RESET = "\033[0m"
-    print(f"{color_map.get(color, RESET)}{message}{RESET}", flush=True)
+_log_colored = get_logger("rtc")
+
+
+async def _drain_until(future: "asyncio.Future[Any]", queue: "asyncio.Queue[Any]") -> AsyncGenerator[Any, None]:
+    """Yield phần tử của queue trong lúc future chưa xong, rồi vét nốt phần tử còn lại khi future xong."""
+    while not future.done():
+        getter = asyncio.ensure_future(queue.get())
+        try:
+            await asyncio.wait({future, getter}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if not getter.done():
+                getter.cancel()
+        if getter.done() and not getter.cancelled():
+            yield getter.result()
+    # Phần tử tới cùng tick với future (cả hai qua call_soon_threadsafe) vẫn được giao
+    while not queue.empty():
+        yield queue.get_nowait()
+
+
+def _audio_seconds(audio_filepath: Path) -> float:
+    """Độ dài file WAV (đọc header) làm cost cho turn_scheduler; 0 nếu không đọc được."""
+    try:
+        with wave.open(str(audio_filepath), "rb") as wf:
+            return wf.getnframes() / float(wf.getframerate() or SAMPLE_RATE)
+    except (OSError, EOFError, wave.Error):
+        return 0.0
 
 
 # ==================== VAD/ASR LOGIC ====================
-WHISPER_IS_READY = False
-try:
-    DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-    USE_FP16 = (DEVICE == "cuda") 
-    
-    # Tải VAD (Silero)
-    VAD_MODEL, VAD_UTILS = torch.hub.load(
-        repo_or_dir='snakers4/silero-vad', model='silero_vad', force_reload=False, onnx=False, trust_repo=True 
-    )
-    VAD_MODEL = VAD_MODEL.to(DEVICE)
-    (get_speech_timestamps, save_audio, read_audio, VAD_collect_chunks, *vad_extra_utils) = VAD_UTILS 
-    
-    # Tải Whisper
-    WHISPER_MODEL = whisper.load_model(WHISPER_MODEL_NAME)
-    if USE_FP16: WHISPER_MODEL = WHISPER_MODEL.half()
-    WHISPER_MODEL.to(DEVICE)
-    WHISPER_IS_READY = True
-except Exception as e:
-    DEVICE = "cpu"
-    WHISPER_MODEL = None
-    _log_colored(f"❌ Lỗi khởi tạo ASR/VAD (Whisper/Torch): {e}", "red")
+# Model VAD/Whisper được tải lười qua model_registry (không còn tải lúc import module)
 
 def _apply_silero_vad(audio_filepath: Path, log_callback: Callable) -> Optional[np.ndarray]:
-    """Áp dụng VAD để loại bỏ khoảng lặng."""
-    if not WHISPER_IS_READY: return None
+    """Áp dụng VAD để loại bỏ khoảng lặng (pre-gate năng lượng trước, Silero sau)."""
+    audio_numpy = load_audio(audio_filepath, SAMPLE_RATE)
+    check_cancelled()
+    if PREGATE_ENABLED:
+        with span("vad_pregate") as gate_span:
+            audio_numpy, gate = energy_gate(audio_numpy, SAMPLE_RATE)
+            observe_pregate(gate.total_frames, gate.passed_frames)
+            if gate_span is not None:
+                gate_span.attributes.update(frames=gate.total_frames, gated=gate.gated_frames)
+        # Cả lượt dưới noise floor: không chạy Silero lẫn Whisper
+        if gate.is_silent: return None
+    vad = model_registry.get_vad()
+    if vad is None: return audio_numpy
+    check_cancelled()
     try:
-        audio_numpy = whisper.load_audio(str(audio_filepath))
-        audio_tensor = torch.from_numpy(audio_numpy).float()
-        speech_timestamps = get_speech_timestamps(audio_tensor.to(DEVICE), VAD_MODEL, sampling_rate=SAMPLE_RATE, threshold=0.3)
+        with span("vad", engine=vad.engine):
+            speech_timestamps = vad.speech_timestamps(audio_numpy, sampling_rate=SAMPLE_RATE, threshold=0.3)
+        check_cancelled()
         if not speech_timestamps: return None 
-        speech_audio_tensor = VAD_collect_chunks(speech_timestamps, audio_tensor)
-        speech_audio_numpy = speech_audio_tensor.cpu().numpy()
+        speech_audio_numpy = vad.collect_chunks(speech_timestamps, audio_numpy)
         MIN_SPEECH_DURATION_SECONDS = 0.5
         filtered_duration = len(speech_audio_numpy) / SAMPLE_RATE
         if filtered_duration < MIN_SPEECH_DURATION_SECONDS: return None 
         return speech_audio_numpy
     except Exception:
-        return whisper.load_audio(str(audio_filepath))
+        return audio_numpy
 
 class ASRServiceWhisper:
-    def __init__(self, log_callback: Callable, model):
-        self._log = log_callback 
-        self.model = model
-    async def transcribe(self, audio_filepath: Path) -> AsyncGenerator[str, None]:
-        if not WHISPER_IS_READY: yield ""; return
+    def __init__(self, log_callback: Callable, model=None, model_name: str = WHISPER_MODEL_NAME):
+        self._log = get_logger("rtc.asr", log_callback)
+        self._model = model
+        self.model_name = model_name
+        # Tầng ASR: model nhỏ trước (nếu bật cascade), model chính sau cùng
+        self.tiers = [model_name]
+        if ASR_CASCADE_ENABLED and ASR_CASCADE_FIRST_MODEL != model_name:
+            self.tiers.insert(0, ASR_CASCADE_FIRST_MODEL)
+
+    @property
+    def model(self):
+        """Model truyền vào trực tiếp, hoặc lấy (tải lười) từ model_registry."""
+        return self._model_for(self.model_name)
+
+    def _model_for(self, name: str):
+        if name == self.model_name and self._model is not None:
+            return self._model
+        return model_registry.get_whisper(name)
+
+    def _decode(self, model, name: str, audio_input: np.ndarray, tier: QualityTier) -> Dict[str, Any]:
+        # Mỗi forward encoder/decoder là một điểm dừng khi lượt bị hủy
+        cancellation.install_checkpoints(model)
+        with model_pool(f"whisper:{name}", capacity=1).acquire(), span("asr_tier", model=name, quality=tier.name) as asr_span:
+            # Câu ngắn: encoder theo bucket độ dài (asr_fastpath); câu dài: cửa sổ 30 giây như cũ
+            result = transcribe_short(model, audio_input, language="vi", fp16=model_registry.use_fp16, **tier.decode) if ASR_FASTPATH_ENABLED else None
+            if asr_span is not None:
+                asr_span.set_attribute("bucket_s", result["bucket_s"] if result else "full")
+            if result is None:
+                result = model.transcribe(audio_input, language="vi", fp16=model_registry.use_fp16, **tier.decode)
+            return result
+
+    @staticmethod
+    def _confidence(result: Dict[str, Any]) -> Tuple[float, float]:
+        """(avg_logprob trung bình, no_speech_prob lớn nhất) trên các segment."""
+        segments = result.get("segments") or []
+        if not segments:
+            return 0.0, 0.0
+        avg_logprob = sum(seg.get("avg_logprob", 0.0) for seg in segments) / len(segments)
+        return avg_logprob, max(seg.get("no_speech_prob", 0.0) for seg in segments)
+
+    def _accept(self, result: Dict[str, Any], nlu_scorer: Optional[Callable[[str], float]]) -> bool:
+        """Giữ kết quả tầng nhỏ khi ASR tự tin và NLU hiểu được câu."""
+        text = result.get("text", "").strip()
+        if not text:
+            return False
+        avg_logprob, no_speech_prob = self._confidence(result)
+        if avg_logprob < ASR_CASCADE_MIN_AVG_LOGPROB or no_speech_prob > ASR_CASCADE_MAX_NO_SPEECH_PROB:
+            return False
+        return nlu_scorer is None or nlu_scorer(text) >= NLU_CONFIDENCE_THRESHOLD
+
+    def _transcribe_blocking(self, audio_input: np.ndarray, nlu_scorer: Optional[Callable[[str], float]] = None,
+                             on_partial: Optional[Callable[[str], Any]] = None) -> Dict[str, Any]:
+        # Tầng chất lượng theo tải server: có thể ép model nhỏ (bỏ cascade), decode greedy, cắt audio
+        quality = quality_controller.current()
+        if quality.max_audio_s:
+            audio_input = audio_input[:int(quality.max_audio_s * SAMPLE_RATE)]
+        tiers = [quality.model] if quality.model else self.tiers
+        # Histogram "asr" nhận cả lượt (mọi tầng cascade), mỗi tầng là một span con "asr_tier"
+        with span("asr", quality=quality.name):
+            return self._run_tiers(tiers, audio_input, quality, nlu_scorer, on_partial)
+
+    def _run_tiers(self, tiers: List[str], audio_input: np.ndarray, quality: QualityTier,
+                   nlu_scorer: Optional[Callable[[str], float]], on_partial: Optional[Callable[[str], Any]]) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"text": ""}
+        for index, name in enumerate(tiers):
+            check_cancelled()
+            model = self._model_for(name)
+            if model is None:
+                self._log.debug("⚠️ [ASR] Model %s chưa sẵn sàng, bỏ qua tầng.", name)
+                continue
+            result = self._decode(model, name, audio_input, quality)
+            if index == len(tiers) - 1:
+                observe_asr_tier(name, "final")
+                return result
+            if self._accept(result, nlu_scorer):
+                observe_asr_tier(name, "accepted")
+                return result
+            observe_asr_tier(name, "escalated")
+            self._log.debug("🔁 [ASR] %s kém tin cậy %s, decode lại bằng model lớn hơn.", name, self._confidence(result))
+            if on_partial is not None and result.get("text", "").strip():
+                # Transcript tầng nhỏ làm transcript tạm: prefetch DB chồng lên lần decode bằng model lớn
+                on_partial(result["text"].strip())
+        # Tới đây: model tầng cuối (ví dụ "tiny" của tầng giảm chất lượng) không tải được.
+        # Dùng model chính: chậm hơn nhưng không trả transcript rỗng
+        if tiers[-1] != self.model_name:
+            model = self._model_for(self.model_name)
+            if model is not None:
+                self._log.warning("⚠️ [ASR] Model %s không sẵn sàng, dùng model chính %s.", tiers[-1], self.model_name)
+                result = self._decode(model, self.model_name, audio_input, quality)
+                observe_asr_tier(self.model_name, "fallback")
+        return result
+
+    def transcribe_partial(self, audio_input: np.ndarray) -> Optional[str]:
+        """
+        Transcript tạm khi người gọi còn đang nói (prefetch suy đoán), bằng SPECULATIVE_PARTIAL_MODEL.
+        Chỉ chạy khi model đã tải, đang rảnh và không có lượt ASR nào chờ model (không làm chậm lượt thật); None nếu bỏ qua.
+        """
+        name = SPECULATIVE_PARTIAL_MODEL
+        pool = model_pool(f"whisper:{name}", capacity=1)
+        if model_registry.state(f"whisper:{name}") != STATE_READY or model_pool_backlog("whisper:"):
+            return None
+        model = self._model_for(name)
+        if model is None:
+            return None
+        with pool.acquire(blocking=False) as acquired:
+            if not acquired:
+                return None
+            with span("asr_partial", model=name):
+                result = transcribe_short(model, audio_input, language="vi", fp16=model_registry.use_fp16, temperature=0.0) if ASR_FASTPATH_ENABLED else None
+                if result is None:
+                    result = model.transcribe(audio_input, language="vi", fp16=model_registry.use_fp16, temperature=0.0)
+        return result.get("text", "").strip()
+
+    @staticmethod
+    def _spot_keyword(audio_input: np.ndarray) -> Optional[KeywordMatch]:
+        spotter = model_registry.get_keyword_spotter()
+        if spotter is None: return None
+        with span("kws") as kws_span:
+            match = spotter.spot(audio_input)
+            if kws_span is not None and match is not None:
+                kws_span.attributes.update(intent=match.intent, distance=round(match.distance, 4))
+        observe_kws(match.intent if match else None)
+        return match
+
+    async def transcribe(self, audio_filepath: Path, nlu_scorer: Optional[Callable[[str], float]] = None,
+                         on_keyword: Optional[Callable[[KeywordMatch], None]] = None,
+                         on_partial: Optional[Callable[[str], Any]] = None) -> AsyncGenerator[str, None]:
+        """
+        on_keyword: nếu có, thử keyword spotting trên audio đã qua VAD trước; khớp thì gọi on_keyword(match),
+        trả về câu của template và không chạy Whisper.
+        on_partial: nhận transcript tầng cascade bị decode lại (transcript tạm, chạy trong thread ASR).
+        """
         try:
-            audio_input = await asyncio.to_thread(_apply_silero_vad, audio_filepath, self._log)
+            audio_input = await asyncio.to_thread(tracked("vad", _apply_silero_vad), audio_filepath, self._log)
             if audio_input is None: yield "[NO SPEECH DETECTED]"; return
-            result = await asyncio.to_thread(self.model.transcribe, audio_input, language="vi", fp16=USE_FP16)
+            if on_keyword is not None and KWS_ENABLED:
+                match = await asyncio.to_thread(tracked("kws", self._spot_keyword), audio_input)
+                if match is not None:
+                    self._log("🎯 [KWS] Khớp '%s' (intent=%s, d=%.3f), bỏ qua Whisper.", "green",
+                              match.text, match.intent, match.distance)
+                    on_keyword(match)
+                    yield match.text; return
+            # Lần gọi đầu (nếu warm-up chưa xong) sẽ tải model trong thread, không chặn event loop
+            model = await asyncio.to_thread(lambda: self.model)
+            if model is None: yield ""; return
+            result = await asyncio.to_thread(tracked("asr", self._transcribe_blocking), audio_input, nlu_scorer, on_partial)
             yield result.get("text", "").strip()
         except Exception as e:
-            self._log(f"❌ [ASR] LỖI WHISPER: {e}", "red")
+            self._log("❌ [ASR] LỖI WHISPER: %s", "red", e)
             yield "" 
 
 # ==================== DỊCH VỤ UPLOAD AUDIO ====================
 
 async def _upload_audio_to_internal_api(file_path: Path, session_id: str, log_callback: Callable, api_key: str = INTERNAL_API_KEY):
     """Giả lập/thực hiện upload file audio lên API nội bộ."""
+    log_callback = get_logger("rtc.upload", log_callback)
     if str(INTERNAL_UPLOAD_URL).startswith("http://internal.company.api"):
         log_callback("⚠️ [UPLOAD] Bỏ qua upload: URL vẫn là placeholder.", "orange")
         return False
         
     try:
-        log_callback(f"[{_dt.now().strftime('%H:%M:%S')}] 📤 [UPLOAD] Bắt đầu upload file: {file_path.name}...", "yellow")
+        log_callback("📤 [UPLOAD] Bắt đầu upload file: %s...", "yellow", file_path.name)
         async with httpx.AsyncClient(verify=False, timeout=30.0) as client: 
             with open(file_path, 'rb') as f:
                 files = {'file': (file_path.name, f, 'audio/wav')}
                 headers = {'X-API-Key': api_key, 'X-Session-ID': session_id} 
                 response = await client.post(INTERNAL_UPLOAD_URL, files=files, headers=headers)
                 response.raise_for_status() 
-                log_callback(f"[{_dt.now().strftime('%H:%M:%S')}] ✅ [UPLOAD] Upload thành công!", "green")
+                log_callback("✅ [UPLOAD] Upload thành công!", "green")
                 return True
     except Exception as e:
-        log_callback(f"[{_dt.now().strftime('%H:%M:%S')}] ❌ [UPLOAD] LỖI UPLOAD: {e}", "red")
+        log_callback("❌ [UPLOAD] LỖI UPLOAD: %s", "red", e)
         return False
 
 # ==================== DỊCH VỤ TTS (GTTS Streaming) ====================
@@ -146,7 +335,7 @@ class TTSServiceGTTS:
     TTS_LANG: ClassVar[str] = "vi" 
     
     def __init__(self, log_callback: Callable): 
-        self._log = log_callback
+        self._log = get_logger("rtc.tts", log_callback)
         self._is_ready = GTTS_IS_READY
         
         if not self._is_ready:
@@ -155,18 +344,35 @@ class TTSServiceGTTS:
             self._log("✅ [TTS] Dịch vụ gTTS sẵn sàng.", "green")
 
     def _synthesize_blocking(self, text: str) -> Optional[bytes]:
+        """Câu theo mẫu DB -> ghép clip render sẵn (tts_splicer); không ghép được -> gTTS cả câu đã chuẩn hóa số."""
+        if not tts_splicer.splicer.enabled:
+            # Tắt ghép clip: câu gửi gTTS nguyên văn như trước
+            return self._gtts_wav(text)
+        spliced = tts_splicer.splicer.splice(text)
+        if spliced is not None:
+            return spliced
+        return self._gtts_wav(normalize_vi(text))
+
+    def _gtts_wav(self, text: str) -> Optional[bytes]:
         """Hàm đồng bộ (Blocking) để gọi gTTS, tạo MP3, và chuyển đổi sang WAV/PCM 16kHz."""
         if not self._is_ready:
              return None 
              
-        self._log(f"🧠 [GTTS] Bắt đầu tổng hợp văn bản: '{text[:30]}...'", "magenta")
+        self._log.debug("🧠 [GTTS] Bắt đầu tổng hợp văn bản: '%s...'", text[:30], color="magenta")
         
         try:
             # 1. Tạo audio MP3 bằng gTTS (output stream)
             tts = gTTS(text=text, lang=self.TTS_LANG)
             mp3_buffer = io.BytesIO()
-            tts.write_to_fp(mp3_buffer)
+            if hasattr(tts, "stream"):
+                # Từng đoạn văn bản một request: dừng giữa các đoạn nếu lượt bị hủy
+                for part in tts.stream():
+                    check_cancelled()
+                    mp3_buffer.write(part)
+            else:
+                tts.write_to_fp(mp3_buffer)
             mp3_buffer.seek(0)
+            check_cancelled()
             
             # 2. Tải MP3 và chuyển đổi sang PCM 16kHz, 16-bit, Mono (Dùng pydub, cần FFmpeg)
             audio = AudioSegment.from_file(mp3_buffer, format="mp3")
@@ -183,22 +389,22 @@ class TTSServiceGTTS:
             # Trả về toàn bộ nội dung WAV (bao gồm header 44 bytes)
             wav_data = pcm_buffer.getvalue()
             
-            self._log(f"🎵 [GTTS] Đã tạo và chuyển đổi audio WAV/PCM {len(wav_data)} bytes.", "magenta")
+            self._log.debug("🎵 [GTTS] Đã tạo và chuyển đổi audio WAV/PCM %d bytes.", len(wav_data), color="magenta")
             return wav_data
 
         except Exception as e:
-            self._log(f"❌ [GTTS] Lỗi khi tạo/chuyển đổi audio gTTS (Kiểm tra FFmpeg/Pydub): {e}", "red")
-            self._log(traceback.format_exc(), "red") 
+            self._log.exception("❌ [GTTS] Lỗi khi tạo/chuyển đổi audio gTTS (Kiểm tra FFmpeg/Pydub): %s", e)
             return None
 
     async def synthesize_stream(self, text: str) -> AsyncGenerator[bytes, None]:
-        self._log(f"[{_dt.now().strftime('%H:%M:%S')}] 🎵 [TTS] Bắt đầu tổng hợp âm thanh...", "magenta")
+        self._log.debug("🎵 [TTS] Bắt đầu tổng hợp âm thanh...", color="magenta")
+        tts_start_ns = time.time_ns()
+        first_chunk_sent = False
         
         # Chạy tác vụ blocking trong Thread Pool
         audio_data_bytes = await asyncio.get_event_loop().run_in_executor(
             None, 
-            self._synthesize_blocking,
-            text
+            run_in_context(tracked("tts", self._synthesize_blocking), text)
         )
         
         if audio_data_bytes is None or len(audio_data_bytes) <= 44:
@@ -218,82 +424,169 @@ class TTSServiceGTTS:
             chunk = streamable_data[i:i + CHUNK_SIZE_BYTES]
             if not chunk: continue
             
+            chunk_start_ns = time.time_ns()
             base64_chunk = base64.b64encode(chunk) 
+            if not first_chunk_sent:
+                first_chunk_sent = True
+                record_span("tts_first_byte", tts_start_ns, chunk_start_ns)
             yield base64_chunk
+            record_span("tts_chunk", chunk_start_ns, index=i // CHUNK_SIZE_BYTES, bytes=len(chunk))
             
             await asyncio.sleep(0.01) # Giả lập độ trễ streaming (10ms)
             
-        self._log(f"[{_dt.now().strftime('%H:%M:%S')}] 🎵 [TTS] Kết thúc luồng audio TTS.", "magenta")
+        record_span("tts_total", tts_start_ns)
+        self._log.debug("🎵 [TTS] Kết thúc luồng audio TTS.", color="magenta")
 
 # ==================== LỚP XỬ LÝ RTC TÍCH HỢP MỚI (Đã sửa đổi) ====================
 
 class RTCStreamProcessor:
     
     def __init__(self, log_callback: Optional[Callable] = None):
-        # Đảm bảo sử dụng _log
-        self._log = log_callback if log_callback else _log_colored
-        self._asr_client = ASRServiceWhisper(self._log, WHISPER_MODEL) if WHISPER_IS_READY else type('ASRMock', (object,), {'transcribe': lambda self, fp: (yield "Transcript giả lập.")})()
+        # Facade logging_layer (vẫn nhận log_callback kiểu cũ)
+        self._log = get_logger("rtc", log_callback)
+        # Whisper được tải lười/warm-up nền qua model_registry; nếu tải lỗi, transcribe trả về ""
+        self._asr_client = ASRServiceWhisper(self._log)
         
         # ✅ SỬ DỤNG TTSServiceGTTS
         self._tts_client = TTSServiceGTTS(self._log)
         
         # Sử dụng ThreadPoolExecutor để chạy các tác vụ đồng bộ (DM)
         self._executor = ThreadPoolExecutor(max_workers=1)
+        register_executor("dm", self._executor)
     
+    def create_dialog_manager(self, api_key: str) -> DialogManager:
+        """DialogManager cho cả một cuộc gọi (giữ history/state giữa các lượt)."""
+        return DialogManager(log_callback=self._log, mode="RTC", api_key=api_key)
+
+    async def record_barge_in(self, dialog_manager: DialogManager, bot_text: Optional[str], heard_s: float):
+        """Ghi barge-in vào history của DM (qua executor DM: không chen giữa một lượt DM đang chạy)."""
+        if not hasattr(dialog_manager, "record_barge_in"):
+            return
+        await asyncio.get_event_loop().run_in_executor(
+            self._executor, dialog_manager.record_barge_in, bot_text, heard_s)
+
+    async def speculate(self, dialog_manager: DialogManager, audio: np.ndarray) -> bool:
+        """ASR tạm trên phần lượt đã ghi (người gọi còn nói) -> DM tra DB sớm nếu intent + entity đã ổn định."""
+        if not SPECULATIVE_PREFETCH_ENABLED or not hasattr(dialog_manager, "speculate"):
+            return False
+        text = await asyncio.to_thread(self._asr_client.transcribe_partial, audio)
+        if not text:
+            return False
+        return await asyncio.to_thread(dialog_manager.speculate, text)
+
+    def start_prerender(self):
+        """Render trước (thread nền) câu đệm và clip ghép TTS bằng gTTS của processor."""
+        if FILLER_ENABLED:
+            filler_audio.cache.start_prerender(self._tts_client._gtts_wav)
+        tts_splicer.splicer.start_prerender(self._tts_client._gtts_wav)
+
     async def handle_rtc_session(self, 
                                  record_file: Path,
                                  session_id: str,
-                                 api_key: str) \
+                                 api_key: str,
+                                 dialog_manager: Optional[DialogManager] = None,
+                                 cancel_token: Optional[CancelToken] = None) \
                                  -> AsyncGenerator[Tuple[bool, Any], None]:
+        """
+        Xử lý một lượt nói. dialog_manager: DM của cuộc gọi (None -> tạo DM mới chỉ cho lượt này).
+        cancel_token: token hủy của lượt (None -> token đang bind, hoặc tạo mới); lượt bị hủy giữa chừng thì
+        VAD/ASR/DM/TTS đang chạy trong thread dừng ở điểm kiểm tra kế tiếp. Task tiêu thụ generator (chủ lượt)
+        bind token bằng cancellation.bound(token) để thread nhìn thấy; generator không tự bind vì contextvar
+        set trong async generator rò sang task tiêu thụ.
+        """
+        token = cancel_token or cancellation.current_token() or CancelToken(session_id)
+        finished = False
         
-        self._log(f"▶️ [RTC] Bắt đầu phiên xử lý ASR/NLU. Session ID: {session_id}.", "cyan") 
+        self._log("▶️ [RTC] Bắt đầu phiên xử lý ASR/NLU. Session ID: %s.", "cyan", session_id)
         full_transcript = ""
         response_text = "Xin lỗi, tôi chưa thể xử lý yêu cầu."
         
         try: 
-            # KHỞI TẠO DIALOG MANAGER VỚI API KEY
-            dm_instance = DialogManager(log_callback=self._log, mode="RTC", api_key=api_key) 
+            record_session_start(NLU_MODE_DEFAULT, DB_MODE_DEFAULT)
+            # DIALOG MANAGER CỦA CUỘC GỌI (hoặc khởi tạo mới với API KEY)
+            dm_instance = dialog_manager if dialog_manager is not None else self.create_dialog_manager(api_key)
             
             yield (False, {"type": "generator_init", "user_text": "", "bot_text": ""}) 
             
             # 1. UPLOAD AUDIO (Bất đồng bộ)
-            await _upload_audio_to_internal_api(record_file, session_id, self._log, api_key)
+            with span("upload"):
+                await _upload_audio_to_internal_api(record_file, session_id, self._log, api_key)
             
             # 2. [ASR Engine] (Bất đồng bộ)
-            asr_stream = self._asr_client.transcribe(record_file)
-            async for partial_text in asr_stream:
-                 if partial_text: full_transcript = partial_text
+            # nlu_scorer: ASR cascade dùng confidence NLU của DM (kết quả được DM cache lại)
+            # on_keyword: câu lệnh ngắn khớp keyword spotting -> intent đi thẳng vào DM, không qua Whisper/NLU
+            keyword_matches = []
+            # turn_scheduler: chia ASR công bằng giữa các api_key (WFQ), audio ngắn trong cùng tenant chạy trước
+            audio_seconds = _audio_seconds(record_file)
+            async with turn_scheduler.slot("asr", api_key, cost=audio_seconds):
+                asr_stream = self._asr_client.transcribe(record_file, nlu_scorer=getattr(dm_instance, "nlu_confidence", None),
+                                                         on_keyword=keyword_matches.append,
+                                                         on_partial=getattr(dm_instance, "speculate", None) if SPECULATIVE_PREFETCH_ENABLED else None)
+                async for partial_text in asr_stream:
+                     if partial_text: full_transcript = partial_text
                      
             dm_input_asr = full_transcript.strip() if full_transcript.strip() and partial_text != "[NO SPEECH DETECTED]" else "[NO SPEECH DETECTED]"
             
             # 3-5. [Dialog Manager] (Đồng bộ)
-            self._log(f"[{_dt.now().strftime('%H:%M:%S')}] 🧠 [DM/NLU] Bắt đầu xử lý DialogManager...", "yellow")
+            self._log.debug("🧠 [DM/NLU] Bắt đầu xử lý DialogManager...", color="yellow")
             
             # SỬA LỖI 1: Thay keyword argument thành positional argument
-            dm_result = await asyncio.get_event_loop().run_in_executor(
-                 self._executor,
-                 dm_instance.process_audio_file, 
-                 str(record_file), 
-                 dm_input_asr # <--- POSITIONAL ARGUMENT
-            )
+            # run_in_context: giữ trace hiện tại để span NLU/DB/response trong DM gắn đúng turn
+            dm_args = (str(record_file), dm_input_asr) + ((keyword_matches[0].as_nlu_result(),) if keyword_matches else ())
+            # Câu đệm: DM báo intent (thread DM) -> intent dự kiến chậm thì gửi clip filler ngay khi DM còn chạy
+            loop = asyncio.get_running_loop()
+            fillers: "asyncio.Queue[filler_audio.FillerClip]" = asyncio.Queue()
+            intent_seen: Dict[str, Any] = {}
+
+            def on_intent(nlu_result: Dict[str, Any]):
+                intent_seen.update(intent=nlu_result.get("intent"), at=time.monotonic())
+                clip = filler_audio.choose(nlu_result.get("intent"))
+                if clip is not None:
+                    loop.call_soon_threadsafe(fillers.put_nowait, clip)
+
+            process = dm_instance.process_audio_file
+            if FILLER_ENABLED:
+                process = functools.partial(process, on_intent=on_intent)
+            async with turn_scheduler.slot("dm", api_key, cost=audio_seconds):
+                dm_future = loop.run_in_executor(
+                     self._executor,
+                     run_in_context(tracked("dm", process), *dm_args) # <--- POSITIONAL ARGUMENT
+                )
+                try:
+                    async for clip in _drain_until(dm_future, fillers):
+                        yield (False, {"type": "filler", "text": clip.text, "file_name": clip.file_name,
+                                       "duration_s": round(clip.duration_s, 3)})
+                    dm_result = await dm_future
+                finally:
+                    if not dm_future.done():
+                        dm_future.cancel()
             response_text = dm_result.get("response_text", response_text)
 
-            self._log(f"[{_dt.now().strftime('%H:%M:%S')}] 🧠 [DM] Hoàn tất. Response: '{response_text[:50]}...'", "green")
+            self._log("🧠 [DM] Hoàn tất. Response: '%s...'", "green", response_text[:50])
 
             yield (False, {"user_text": full_transcript.strip(), "bot_text": response_text})
 
             # 6. [TTS Engine] -> [Speaker Output] (Stream)
-            self._log(f"[{_dt.now().strftime('%H:%M:%S')}] 🎵 [TTS] Bắt đầu streaming audio phản hồi...", "magenta")
+            self._log.debug("🎵 [TTS] Bắt đầu streaming audio phản hồi...", color="magenta")
             tts_audio_stream = self._tts_client.synthesize_stream(response_text)
             async for audio_chunk in tts_audio_stream:
+                if intent_seen.get("intent"):
+                    # Độ trễ thật từ lúc có intent tới chunk TTS đầu tiên: cập nhật dự kiến cho lượt sau
+                    filler_audio.projector.observe(intent_seen.pop("intent"), time.monotonic() - intent_seen.pop("at"))
                 yield (True, audio_chunk)
+            finished = True
         
         except asyncio.CancelledError:
             raise
         except Exception as e:
-            self._log(f"[{_dt.now().strftime('%H:%M:%S')}] ❌ [RTC] LỖI XỬ LÝ CHUNG: {e}", "red")
-            # SỬA LỖI 2: self.log -> self._log
-            self._log(traceback.format_exc(), "red") 
+            finished = True
+            record_session_error(NLU_MODE_DEFAULT, DB_MODE_DEFAULT)
+            self._log.exception("❌ [RTC] LỖI XỬ LÝ CHUNG: %s", e)
             yield (False, {"type": "error", "user_text": full_transcript.strip(), "bot_text": f"Lỗi hệ thống: {e}"})
         finally: 
-             self._log(f"[{_dt.now().strftime('%H:%M:%S')}] [RTC] Kết thúc xử lý RTC.", "cyan")
\ No newline at end of file
+             if not finished:
+                 # Task bị hủy hoặc generator bị đóng giữa chừng: báo các thread đang chạy dừng lại
+                 token.cancel(token.reason or "aborted")
+                 self._log("🛑 [RTC] Lượt %s bị hủy (%s), bỏ %.2fs compute.", "orange",
+                           session_id, token.reason, token.wasted_seconds)
+             self._log.debug("[RTC] Kết thúc xử lý RTC.", color="cyan")
\ No newline at end of file
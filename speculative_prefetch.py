@@ -0,0 +1,147 @@
+# speculative_prefetch.py
+"""
+Prefetch DB suy đoán trên transcript tạm. DialogManager chỉ tra DB sau khi có transcript cuối; ở đây NLU
+(có cache) chạy trên transcript tạm của lượt: ASR định kỳ khi người gọi còn đang nói, và transcript của tầng
+cascade bị decode lại bằng model lớn. Khi intent + entity giống hệt nhau ở SPECULATIVE_STABLE_PARTIALS
+transcript tạm liên tiếp (tên sản phẩm, mã đơn ORD123...), lookup của SystemIntegrationManager được gửi
+sớm lên thread pool riêng -> round-trip DB chồng lên phần cuối câu nói / decode cuối.
+Khi có transcript cuối:
+  - cùng intent + entity, kết quả chưa quá SPECULATIVE_MAX_AGE_S -> dùng kết quả prefetch (commit);
+  - khác (hoặc quá cũ) -> bỏ kết quả prefetch (discard), tra DB như thường.
+Chỉ prefetch tra cứu đọc (query_data) và chỉ khi NLU có entity.
+"""
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from logging_layer import get_logger
+from metrics_layer import SPECULATIVE_PREFETCH, SPECULATIVE_DB_SAVED, register_executor
+
+# --- SAFE IMPORT CONFIG ---
+try:
+    from config_db import (
+        SPECULATIVE_PREFETCH_ENABLED, SPECULATIVE_STABLE_PARTIALS, SPECULATIVE_MAX_AGE_S, SPECULATIVE_PREFETCH_WORKERS,
+        NLU_CONFIDENCE_THRESHOLD
+    )
+except ImportError:
+    SPECULATIVE_PREFETCH_ENABLED = False
+    SPECULATIVE_STABLE_PARTIALS = 2
+    SPECULATIVE_MAX_AGE_S = 10.0
+    SPECULATIVE_PREFETCH_WORKERS = 2
+    NLU_CONFIDENCE_THRESHOLD = 0.6
+
+_log = get_logger("prefetch")
+
+# Lookup suy đoán chạy trên pool riêng: không chiếm executor DM (1 worker dùng chung mọi session)
+_executor = ThreadPoolExecutor(max_workers=SPECULATIVE_PREFETCH_WORKERS, thread_name_prefix="prefetch")
+register_executor("prefetch", _executor)
+
+LookupKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def lookup_key(intent: str, entities: Optional[Dict[str, Any]]) -> LookupKey:
+    """Khóa so khớp prefetch với transcript cuối: intent + entity (giá trị giữ nguyên, không chuẩn hóa)."""
+    return intent, tuple(sorted((str(k), str(v)) for k, v in (entities or {}).items()))
+
+
+class _Prefetch:
+    __slots__ = ("key", "future", "started_at", "duration_s")
+
+    def __init__(self, key: LookupKey):
+        self.key = key
+        self.future: Optional["Future[Dict[str, Any]]"] = None
+        self.started_at = time.monotonic()
+        self.duration_s = 0.0
+
+
+class SpeculativePrefetcher:
+    """Prefetch DB cho một DialogManager (một cuộc gọi). observe() nhận NLU transcript tạm, take() nhận NLU câu cuối."""
+
+    def __init__(self, lookup: Callable[[str, Dict[str, Any]], Dict[str, Any]], enabled: bool = SPECULATIVE_PREFETCH_ENABLED,
+                 stable_partials: int = SPECULATIVE_STABLE_PARTIALS, min_confidence: float = NLU_CONFIDENCE_THRESHOLD,
+                 max_age_s: float = SPECULATIVE_MAX_AGE_S):
+        self._lookup = lookup
+        self.enabled = enabled
+        self.stable_partials = max(1, stable_partials)
+        self.min_confidence = min_confidence
+        self.max_age_s = max_age_s
+        self._lock = threading.Lock()
+        self._last_key: Optional[LookupKey] = None
+        self._streak = 0
+        self._pending: Optional[_Prefetch] = None
+
+    def _run(self, prefetch: _Prefetch, intent: str, entities: Dict[str, Any]) -> Dict[str, Any]:
+        start = time.monotonic()
+        try:
+            return self._lookup(intent, entities)
+        finally:
+            prefetch.duration_s = time.monotonic() - start
+
+    def _discard(self, prefetch: Optional[_Prefetch], outcome: str = "discarded"):
+        if prefetch is None:
+            return
+        prefetch.future.cancel()
+        SPECULATIVE_PREFETCH.labels(outcome).inc()
+        _log.debug("🗑️ [PREFETCH] Bỏ kết quả prefetch %s (%s).", prefetch.key, outcome)
+
+    def observe(self, nlu_result: Dict[str, Any]) -> bool:
+        """NLU của một transcript tạm. True nếu vừa gửi lookup sớm (intent + entity đã ổn định)."""
+        if not self.enabled:
+            return False
+        entities = dict(nlu_result.get("entities") or {})
+        if not entities or nlu_result.get("confidence", 0.0) < self.min_confidence:
+            with self._lock:
+                self._last_key, self._streak = None, 0
+            return False
+        intent = nlu_result.get("intent", "")
+        key = lookup_key(intent, entities)
+        superseded = None
+        with self._lock:
+            self._streak = self._streak + 1 if key == self._last_key else 1
+            self._last_key = key
+            if self._streak < self.stable_partials:
+                return False
+            if self._pending is not None and self._pending.key == key:
+                return False
+            superseded = self._pending
+            prefetch = self._pending = _Prefetch(key)
+            prefetch.future = _executor.submit(self._run, prefetch, intent, entities)
+        self._discard(superseded)
+        SPECULATIVE_PREFETCH.labels("fired").inc()
+        _log.debug("🔮 [PREFETCH] Intent '%s' ổn định %d transcript tạm, tra DB sớm: %s", intent, self._streak, entities)
+        return True
+
+    def take(self, intent: str, entities: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Transcript cuối: trả kết quả prefetch nếu cùng intent + entity (chờ nếu lookup còn chạy);
+        None nếu không có prefetch, không khớp, quá cũ hoặc lookup lỗi (khi đó gọi DB như thường).
+        """
+        with self._lock:
+            prefetch, self._pending = self._pending, None
+            self._last_key, self._streak = None, 0
+        if prefetch is None:
+            return None
+        if prefetch.key != lookup_key(intent, entities):
+            self._discard(prefetch)
+            return None
+        if time.monotonic() - prefetch.started_at > self.max_age_s:
+            self._discard(prefetch, "stale")
+            return None
+        wait_start = time.monotonic()
+        try:
+            result = prefetch.future.result()
+        except Exception as e:
+            SPECULATIVE_PREFETCH.labels("failed").inc()
+            _log.warning("⚠️ [PREFETCH] Lookup suy đoán lỗi, tra lại: %s", e)
+            return None
+        SPECULATIVE_PREFETCH.labels("hit").inc()
+        SPECULATIVE_DB_SAVED.observe(max(0.0, prefetch.duration_s - (time.monotonic() - wait_start)))
+        return result
+
+    def reset(self):
+        """Hết lượt: prefetch chưa dùng tới không được mang sang lượt sau."""
+        with self._lock:
+            prefetch, self._pending = self._pending, None
+            self._last_key, self._streak = None, 0
+        self._discard(prefetch)
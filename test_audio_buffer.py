@@ -0,0 +1,124 @@
+# test_audio_buffer.py
+
+import pytest
+import asyncio
+import wave
+from types import SimpleNamespace
+
+import numpy as np
+
+import audio_buffer
+from audio_buffer import AudioRingBuffer, AudioBufferBudgetExceeded, memory_usage
+from backend_webrtc_server import AudioFileRecorder
+
+SAMPLE_RATE = 16000
+FRAME_SAMPLES = 320  # 20ms
+
+# ==================== CÁC HÀM HỖ TRỢ KIỂM THỬ ====================
+
+def ramp(start: int, n: int) -> np.ndarray:
+    """Mẫu int16 tăng dần: biết được mẫu nào của câu nói còn lại trong buffer."""
+    return np.arange(start, start + n, dtype=np.int16)
+
+
+class FakeFrame:
+    """av.AudioFrame giả lập: mono s16 packed 16kHz."""
+    def __init__(self, samples: np.ndarray):
+        self._samples = samples
+        self.layout = SimpleNamespace(channels=[0])
+        self.format = SimpleNamespace(is_planar=False)
+        self.sample_rate = SAMPLE_RATE
+
+    def to_ndarray(self) -> np.ndarray:
+        return self._samples.reshape(1, -1)
+
+
+class FakeTrack:
+    """Track giả lập: trả lần lượt các frame rồi chờ mãi (như người gọi im lặng nhưng track vẫn mở)."""
+    def __init__(self, frames):
+        self._frames = list(frames)
+
+    async def recv(self):
+        if self._frames:
+            await asyncio.sleep(0)
+            return self._frames.pop(0)
+        await asyncio.Event().wait()
+
+# ==================== RING BUFFER ====================
+
+def test_write_below_capacity_keeps_order():
+    buf = AudioRingBuffer(max_seconds=0.1, sample_rate=SAMPLE_RATE, owner="test_order")
+    assert buf.write(ramp(0, 500)) == 0
+    assert buf.write(ramp(500, 500).tobytes()) == 0
+    assert len(buf) == 1000 and not buf.is_full
+    assert np.array_equal(buf.array(), ramp(0, 1000))
+    assert len(buf.segments()) == 1
+    buf.release()
+
+
+def test_overflow_keeps_head_and_reports_dropped():
+    buf = AudioRingBuffer(max_seconds=0.1, sample_rate=SAMPLE_RATE, owner="test_overflow")  # 1600 mẫu
+    assert buf.write(ramp(0, 1200)) == 0
+    # Block vượt phần còn trống: chỉ phần đầu được ghi, phần cuối bị bỏ và đếm vào overflow
+    assert buf.write(ramp(1200, 1000)) == 600
+    assert buf.is_full
+    assert buf.overflow_samples == 600
+    # Đầu câu nói còn nguyên (không bị ghi đè bởi mẫu mới)
+    assert np.array_equal(buf.array(), ramp(0, 1600))
+    # Đầy rồi: ghi thêm bị bỏ toàn bộ
+    assert buf.write(ramp(2200, 100)) == 100
+    assert buf.overflow_samples == 700
+    buf.release()
+
+
+def test_block_larger_than_capacity_keeps_head():
+    buf = AudioRingBuffer(max_seconds=0.1, sample_rate=SAMPLE_RATE, owner="test_large_block")
+    assert buf.write(ramp(0, 5000)) == 3400
+    assert np.array_equal(buf.array(), ramp(0, 1600))
+    buf.release()
+
+
+def test_clear_reuses_buffer_after_overflow():
+    buf = AudioRingBuffer(max_seconds=0.1, sample_rate=SAMPLE_RATE, owner="test_clear")
+    buf.write(ramp(0, 2000))
+    data_before = buf._data
+    buf.clear()
+    assert len(buf) == 0 and not buf.is_full and buf.overflow_samples == 0
+    assert buf.segments() == []
+    buf.write(ramp(100, 300))
+    assert np.array_equal(buf.array(), ramp(100, 300))
+    assert buf._data is data_before, "clear() không được cấp phát lại buffer."
+    buf.release()
+
+
+def test_budget_exceeded_and_release(monkeypatch):
+    monkeypatch.setattr(audio_buffer, "AUDIO_BUFFER_BUDGET_MB", 0.1)
+    buf = AudioRingBuffer(max_seconds=2.0, sample_rate=SAMPLE_RATE, owner="test_budget")  # 64000 bytes
+    assert memory_usage()["by_session"]["test_budget"] == buf.nbytes
+    with pytest.raises(AudioBufferBudgetExceeded):
+        AudioRingBuffer(max_seconds=2.0, sample_rate=SAMPLE_RATE, owner="test_budget_2")
+    buf.release()
+    assert "test_budget" not in memory_usage()["by_session"]
+
+# ==================== RECORDER: CHẠM GIỚI HẠN LƯỢT ====================
+
+@pytest.mark.asyncio
+async def test_recorder_ends_turn_when_buffer_full(tmp_path):
+    """Lượt dài hơn MAX_UTTERANCE_SECONDS: recorder kết thúc lượt và giao phần ĐẦU câu cho ASR."""
+    frames = [FakeFrame(ramp(i * FRAME_SAMPLES, FRAME_SAMPLES)) for i in range(20)]  # 0.4s
+    recorder = AudioFileRecorder(pc=None, session_id="test_recorder_full")
+    recorder.buffer = AudioRingBuffer(max_seconds=0.1, sample_rate=SAMPLE_RATE, owner="test_recorder_full")
+    stopped = asyncio.get_event_loop().create_future()
+    recorder.on("stop", lambda path: stopped.done() or stopped.set_result(path))
+
+    wav_path = tmp_path / "turn.wav"
+    recorder.start(FakeTrack(frames), str(wav_path))
+    try:
+        path = await asyncio.wait_for(stopped, timeout=2.0)
+        assert path == str(wav_path)
+        assert not recorder.listening
+        with wave.open(path, "rb") as wf:
+            recorded = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+        assert np.array_equal(recorded, ramp(0, 1600))
+    finally:
+        recorder.close()
@@ -0,0 +1,102 @@
+# test_connection_manager.py
+
+import pytest
+import asyncio
+
+import httpx
+
+import backend_webrtc_server as server
+from admission_control import AdmissionController
+from connection_manager import ConnectionManager
+
+# ==================== CÁC HÀM HỖ TRỢ KIỂM THỬ ====================
+
+class FakePC:
+    """RTCPeerConnection giả lập: ghi nhận handler và số lần close()."""
+    def __init__(self):
+        self.connectionState = "new"
+        self.handlers = {}
+        self.close_calls = 0
+
+    def on(self, event):
+        def decorator(handler):
+            self.handlers[event] = handler
+            return handler
+        return decorator
+
+    def remove_all_listeners(self):
+        self.handlers.clear()
+
+    async def close(self):
+        self.close_calls += 1
+        self.connectionState = "closed"
+
+# ==================== ĐĂNG KÝ TRÙNG SESSION ====================
+
+@pytest.mark.asyncio
+async def test_register_same_session_closes_previous_pc():
+    manager = ConnectionManager()
+    old_pc, new_pc = FakePC(), FakePC()
+    old_conn = manager.register("dup_session", old_pc)
+    new_conn = manager.register("dup_session", new_pc)
+    # Đóng cuộc gọi cũ chạy nền: nhường event loop cho nó chạy xong
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+    assert old_pc.close_calls == 1
+    assert new_pc.close_calls == 0
+    assert old_conn.closed and not new_conn.closed
+    assert manager.get("dup_session") is new_conn
+    assert len(manager) == 1
+    await manager.close_all()
+
+
+@pytest.mark.asyncio
+async def test_replaced_connection_close_callbacks_do_not_touch_new_connection():
+    manager = ConnectionManager()
+    closed = []
+    old_conn = manager.register("dup_callbacks", FakePC())
+    old_conn.on_close(lambda: closed.append("old"))
+    new_conn = manager.register("dup_callbacks", FakePC())
+    new_conn.on_close(lambda: closed.append("new"))
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+    assert closed == ["old"]
+    await manager.close("dup_callbacks")
+    assert closed == ["old", "new"]
+    assert manager.get("dup_callbacks") is None
+
+# ==================== /offer TRÙNG SESSION_ID ====================
+
+def test_peer_token_identifies_owner():
+    manager = ConnectionManager()
+    conn = manager.register("owned_session", FakePC())
+    assert conn.owned_by(conn.peer_token)
+    assert not conn.owned_by(None)
+    assert not conn.owned_by("guess")
+
+
+@pytest.mark.asyncio
+async def test_offer_reusing_live_session_id_requires_peer_token(monkeypatch):
+    """Client tự khai session_id đang sống: không được bỏ qua admission, không được thay cuộc gọi của người khác."""
+    live = server.connections.register("live_session", FakePC())
+    admission = AdmissionController(enabled=True, max_sessions=1, sessions_fn=lambda: 1, queue_fn=lambda: 0,
+                                    latency_fn=lambda: None)
+    monkeypatch.setattr(server, "admission", admission)
+    offer = {"sdp": "v=0", "type": "offer", "session_id": "live_session"}
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as client:
+            # Quá tải: offer không có peer_token bị xét như cuộc gọi mới
+            response = await client.post("/offer", json=offer)
+            assert response.status_code == 503
+            assert response.json()["reason"] == "over_session_capacity"
+
+            # Còn chỗ: vẫn không được thay cuộc gọi đang sống
+            admission.max_sessions = 10
+            response = await client.post("/offer", json=offer)
+            assert response.status_code == 409
+        assert server.connections.get("live_session") is live and not live.closed
+        assert admission.admit("live_session", in_progress=live.owned_by(live.peer_token)).reason == "in_progress"
+    finally:
+        await server.connections.close("live_session")
@@ -0,0 +1,98 @@
+# test_model_registry.py
+
+import os
+
+import pytest
+import torch
+import whisper
+
+from model_registry import ModelRegistry
+
+# ==================== CÁC HÀM HỖ TRỢ KIỂM THỬ ====================
+
+class FakeModule:
+    """Model giả lập: chỉ cần .to()/.half() như model torch."""
+    def to(self, device):
+        return self
+
+    def half(self):
+        return self
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    """Registry không cho tải, artifact dir rỗng, cache whisper/torch.hub trỏ vào thư mục tạm."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setattr(torch.hub, "get_dir", lambda: str(tmp_path / "cache" / "torch" / "hub"))
+    return ModelRegistry(artifact_dir=str(tmp_path / "models"), allow_download=False, vad_engine="torch")
+
+
+def record_load_model(monkeypatch):
+    calls = []
+
+    def load_model(name, device=None, download_root=None):
+        calls.append((name, download_root))
+        return FakeModule()
+    monkeypatch.setattr(whisper, "load_model", load_model)
+    return calls
+
+# ==================== WHISPER ====================
+
+def test_whisper_loads_from_standard_cache(registry, tmp_path, monkeypatch):
+    """Weight đã có trong ~/.cache/whisper (deploy cũ): không cần artifact dir, không cần mạng."""
+    calls = record_load_model(monkeypatch)
+    cached = tmp_path / "cache" / "whisper" / os.path.basename(whisper._MODELS["tiny"])
+    cached.parent.mkdir(parents=True)
+    cached.write_bytes(b"weights")
+
+    registry._load_whisper("tiny")
+    assert calls == [(str(cached), None)]
+    assert registry._entry("whisper:tiny").source == f"local:{cached}"
+
+
+def test_whisper_artifact_dir_takes_precedence(registry, tmp_path, monkeypatch):
+    calls = record_load_model(monkeypatch)
+    file_name = os.path.basename(whisper._MODELS["tiny"])
+    for root in (tmp_path / "models" / "whisper", tmp_path / "cache" / "whisper"):
+        root.mkdir(parents=True)
+        (root / file_name).write_bytes(b"weights")
+
+    registry._load_whisper("tiny")
+    assert calls == [(str(tmp_path / "models" / "whisper" / file_name), None)]
+
+
+def test_whisper_missing_without_download_fails(registry, monkeypatch):
+    calls = record_load_model(monkeypatch)
+    with pytest.raises(FileNotFoundError, match="VOICEBOT_MODEL_DIR"):
+        registry._load_whisper("tiny")
+    assert calls == []
+
+
+def test_whisper_download_goes_to_standard_cache(registry, monkeypatch):
+    calls = record_load_model(monkeypatch)
+    registry.allow_download = True
+    registry._load_whisper("tiny")
+    assert calls == [("tiny", None)]
+
+# ==================== SILERO VAD ====================
+
+def test_vad_loads_from_torch_hub_cache(registry, tmp_path, monkeypatch):
+    hub_repo = tmp_path / "cache" / "torch" / "hub" / "snakers4_silero-vad_master"
+    hub_repo.mkdir(parents=True)
+    (hub_repo / "hubconf.py").write_text("")
+    loads = []
+
+    def hub_load(repo_or_dir, model, source="github", **kwargs):
+        loads.append((repo_or_dir, source))
+        return FakeModule(), (None, None, None, None)
+    monkeypatch.setattr(torch.hub, "load", hub_load)
+
+    registry._load_silero_vad()
+    assert loads == [(str(hub_repo), "local")]
+    assert registry._entry("vad").source == f"hub_cache:{hub_repo}"
+
+
+def test_vad_missing_without_download_fails(registry, monkeypatch):
+    monkeypatch.setattr(torch.hub, "load", lambda *args, **kwargs: pytest.fail("Không được gọi torch.hub khi cấm tải."))
+    with pytest.raises(FileNotFoundError, match="VOICEBOT_MODEL_DIR"):
+        registry._load_silero_vad()
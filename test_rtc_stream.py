@@ -2,115 +2,194 @@
 
 import pytest
 import asyncio
-from typing import AsyncGenerator, List, Tuple
-import time 
+import base64
+from pathlib import Path
+from typing import AsyncGenerator, List, Tuple, Any
+import time
 import os # THÊM
 import uuid # THÊM
+import wave
 
 # Import class cần kiểm thử và hằng số
-from rtc_integration_layer import RTCStreamProcessor, RECORDING_DIR 
+from rtc_integration_layer import RTCStreamProcessor, RECORDING_DIR, SAMPLE_RATE, _drain_until
+import cancellation
+from cancellation import CancelToken
+import numpy as np
+import rtc_integration_layer
+from rtc_integration_layer import ASRServiceWhisper
+from asr_quality import QualityTier
 
 # ==================== CÁC HÀM HỖ TRỢ KIỂM THỬ ====================
 
-async def mock_audio_stream(num_chunks: int, chunk_size: int = 4096) -> AsyncGenerator[bytes, None]:
-    """Tạo một Async Generator giả lập luồng audio (bytes)."""
-    for i in range(num_chunks):
-        yield b'\x00' * chunk_size
-        # Tối ưu: Chỉ nhường quyền điều khiển event loop
-        await asyncio.sleep(0) 
+def write_test_wav(file_path: Path, num_chunks: int, chunk_size: int = 4096, silent: bool = False) -> Path:
+    """Ghi file WAV 16kHz mono 16-bit giả lập bản ghi của AudioFileRecorder."""
+    sample = b'\x00\x00' if silent else b'\x10\x27'
+    with wave.open(str(file_path), 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(SAMPLE_RATE)
+        for _ in range(num_chunks):
+            wf.writeframes(sample * (chunk_size // 2))
+    return file_path
 
-async def collect_output_stream(output_stream: AsyncGenerator[bytes, None]) -> List[bytes]:
-    """Tiêu thụ và thu thập tất cả chunks từ luồng đầu ra."""
-    chunks = []
-    async for chunk in output_stream:
-        chunks.append(chunk)
-    return chunks
+async def collect_output_stream(output_stream: AsyncGenerator[Tuple[bool, Any], None]) -> List[Tuple[bool, Any]]:
+    """Tiêu thụ và thu thập tất cả (is_audio, data) từ luồng đầu ra."""
+    items = []
+    async for item in output_stream:
+        items.append(item)
+    return items
+
+def text_responses(items: List[Tuple[bool, Any]]) -> List[dict]:
+    return [data for is_audio, data in items if not is_audio and "bot_text" in data and data.get("type") != "generator_init"]
+
+# ==================== FAKE ASR/TTS (không cần Whisper/gTTS) ====================
+
+class FakeASR:
+    """ASR giả lập: file có frame khác 0 -> transcript cố định, file rỗng/im lặng -> NO SPEECH."""
+    async def transcribe(self, audio_filepath: Path, nlu_scorer=None, on_keyword=None, on_partial=None) -> AsyncGenerator[str, None]:
+        with wave.open(str(audio_filepath), 'rb') as wf:
+            frames = wf.readframes(wf.getnframes())
+        await asyncio.sleep(0)
+        yield "chào bạn, tôi muốn đặt hàng" if frames.strip(b'\x00') else "[NO SPEECH DETECTED]"
+
+class FakeTTS:
+    """TTS giả lập: 0.5 giây PCM im lặng, chia chunk 1600 bytes như TTSServiceGTTS."""
+    async def synthesize_stream(self, text: str) -> AsyncGenerator[bytes, None]:
+        pcm = b'\x00' * 16000
+        for i in range(0, len(pcm), 1600):
+            yield base64.b64encode(pcm[i:i + 1600])
+            await asyncio.sleep(0)
 
 # ==================== FIXTURES ====================
 
 @pytest.fixture
 def rtc_processor() -> RTCStreamProcessor:
-    """Fixture khởi tạo RTCStreamProcessor với hàm log câm."""
+    """Fixture khởi tạo RTCStreamProcessor với hàm log câm và ASR/TTS giả lập."""
     def mock_log(message, color=None):
-        pass 
-    return RTCStreamProcessor(log_callback=mock_log)
+        pass
+    processor = RTCStreamProcessor(log_callback=mock_log)
+    processor._asr_client = FakeASR()
+    processor._tts_client = FakeTTS()
+    return processor
+
+@pytest.fixture
+def record_file():
+    """Đường dẫn file ghi âm tạm trong RECORDING_DIR, tự xóa sau test."""
+    path = Path(RECORDING_DIR) / f"{uuid.uuid4()}_input.wav"
+    yield path
+    if path.exists():
+        os.remove(path)
 
 # ==================== CÁC TRƯỜNG HỢP KIỂM THỬ CHÍNH ====================
 
 @pytest.mark.asyncio
-async def test_successful_order_request(rtc_processor: RTCStreamProcessor):
-    NUM_CHUNKS = 100 
+async def test_successful_order_request(rtc_processor: RTCStreamProcessor, record_file: Path):
+    NUM_CHUNKS = 100
     session_id = str(uuid.uuid4())
-    expected_filename = os.path.join(RECORDING_DIR, f"{session_id}_input.wav")
-    
-    # Dọn dẹp môi trường
-    if os.path.exists(expected_filename):
-        os.remove(expected_filename)
-
-    input_stream = mock_audio_stream(NUM_CHUNKS)
-    # ⚠️ THAY ĐỔI: Truyền session_id
-    output_stream = rtc_processor.handle_rtc_session(input_stream, session_id=session_id)
-    output_chunks = await collect_output_stream(output_stream)
-    
-    # 1. Xác minh file ghi âm
-    assert os.path.exists(expected_filename), f"File ghi âm {expected_filename} không được tạo."
-    assert os.path.getsize(expected_filename) > 44, "File ghi âm quá nhỏ."
-    os.remove(expected_filename) # Xóa file sau khi kiểm thử
-
-    # 2. Xác minh logic RTC
-    assert len(output_chunks) > 0
-    full_output = b"".join(output_chunks).decode('utf-8')
-    assert "audio_chunk_for_Đã tìm thấy y" in full_output
+    write_test_wav(record_file, NUM_CHUNKS)
+
+    output_stream = rtc_processor.handle_rtc_session(record_file=record_file, session_id=session_id, api_key="TEST_KEY")
+    output_items = await collect_output_stream(output_stream)
+
+    # 1. Có phản hồi văn bản chứa transcript
+    responses = text_responses(output_items)
+    assert responses, "Không nhận được phản hồi văn bản."
+    assert responses[-1]["user_text"] == "chào bạn, tôi muốn đặt hàng"
+    assert responses[-1]["bot_text"]
+
+    # 2. Có audio TTS (base64) sau phản hồi văn bản
+    audio_chunks = [data for is_audio, data in output_items if is_audio]
+    assert len(audio_chunks) > 0
+    assert len(b"".join(base64.b64decode(c) for c in audio_chunks)) == 16000
 
 @pytest.mark.asyncio
-async def test_unrecognized_request(rtc_processor: RTCStreamProcessor):
-    NUM_CHUNKS = 0 
+async def test_unrecognized_request(rtc_processor: RTCStreamProcessor, record_file: Path):
+    NUM_CHUNKS = 0
     session_id = str(uuid.uuid4())
-    expected_filename = os.path.join(RECORDING_DIR, f"{session_id}_input.wav")
-    
-    if os.path.exists(expected_filename):
-        os.remove(expected_filename)
-
-    input_stream = mock_audio_stream(NUM_CHUNKS)
-    # ⚠️ THAY ĐỔI: Truyền session_id
-    output_stream = rtc_processor.handle_rtc_session(input_stream, session_id=session_id)
-    output_chunks = await collect_output_stream(output_stream)
-    
-    # 1. Xác minh file ghi âm (File sẽ rất nhỏ do không có chunk audio, nhưng vẫn phải có header)
-    assert os.path.exists(expected_filename), f"File ghi âm {expected_filename} không được tạo."
-    # Khi NUM_CHUNKS = 0, file vẫn được tạo với header WAV (44 bytes)
-    assert os.path.getsize(expected_filename) == 44, "File ghi âm phải có kích thước header chuẩn (44 bytes)."
-    os.remove(expected_filename) 
-    
-    # 2. Xác minh logic RTC
-    assert len(output_chunks) > 0
-    full_output = b"".join(output_chunks).decode('utf-8')
-    assert "audio_chunk_for_Tôi không h" in full_output
+    write_test_wav(record_file, NUM_CHUNKS)
+    # Khi NUM_CHUNKS = 0, file chỉ có header WAV (44 bytes)
+    assert os.path.getsize(record_file) == 44, "File ghi âm phải có kích thước header chuẩn (44 bytes)."
+
+    output_stream = rtc_processor.handle_rtc_session(record_file=record_file, session_id=session_id, api_key="TEST_KEY")
+    output_items = await collect_output_stream(output_stream)
+
+    responses = text_responses(output_items)
+    assert responses
+    assert "không nghe rõ" in responses[-1]["bot_text"]
 
 
 @pytest.mark.asyncio
-async def test_latency_is_acceptable(rtc_processor: RTCStreamProcessor):
+async def test_latency_is_acceptable(rtc_processor: RTCStreamProcessor, record_file: Path):
     """
     Kiểm tra tổng thời gian xử lý có nằm trong giới hạn đã xiết chặt (1.0s).
     """
     NUM_CHUNKS = 5
     session_id = str(uuid.uuid4())
-    expected_filename = os.path.join(RECORDING_DIR, f"{session_id}_input.wav")
-    
+    write_test_wav(record_file, NUM_CHUNKS)
+
     start_time = time.time()
-    
-    input_stream = mock_audio_stream(NUM_CHUNKS)
-    # ⚠️ THAY ĐỔI: Truyền session_id
-    output_stream = rtc_processor.handle_rtc_session(input_stream, session_id=session_id)
-    
+
+    output_stream = rtc_processor.handle_rtc_session(record_file=record_file, session_id=session_id, api_key="TEST_KEY")
     await collect_output_stream(output_stream)
-    
+
     duration = time.time() - start_time
-    MAX_DURATION_SECONDS = 1.0 
-    
-    # 1. Xác minh file ghi âm và xóa nó
-    assert os.path.exists(expected_filename), f"File ghi âm {expected_filename} không được tạo trong test latency."
-    os.remove(expected_filename)
-    
-    # 2. Xác minh latency
-    assert duration < MAX_DURATION_SECONDS, f"Thời gian xử lý quá lâu: {duration:.3f}s (Max: {MAX_DURATION_SECONDS}s)"
\ No newline at end of file
+    MAX_DURATION_SECONDS = 1.0
+
+    assert duration < MAX_DURATION_SECONDS, f"Thời gian xử lý quá lâu: {duration:.3f}s (Max: {MAX_DURATION_SECONDS}s)"
+
+
+# ==================== HỦY LƯỢT / CÂU ĐỆM ====================
+
+@pytest.mark.asyncio
+async def test_session_does_not_leak_cancel_token(rtc_processor: RTCStreamProcessor, record_file: Path):
+    """Generator không bind token vào context của task tiêu thụ; token do task chủ lượt bind thì được dùng lại."""
+    write_test_wav(record_file, 5)
+    await collect_output_stream(rtc_processor.handle_rtc_session(record_file=record_file, session_id="no_leak", api_key="TEST_KEY"))
+    assert cancellation.current_token() is None
+
+    token = CancelToken("owned")
+    with cancellation.bound(token):
+        await collect_output_stream(rtc_processor.handle_rtc_session(record_file=record_file, session_id="owned", api_key="TEST_KEY"))
+        assert cancellation.current_token() is token
+    assert cancellation.current_token() is None
+
+
+@pytest.mark.asyncio
+async def test_drain_until_keeps_item_arriving_with_future():
+    """Clip filler tới cùng tick với lúc DM xong vẫn được giao."""
+    loop = asyncio.get_running_loop()
+    future, queue = loop.create_future(), asyncio.Queue()
+    loop.call_soon(queue.put_nowait, "filler")
+    loop.call_soon(future.set_result, None)
+    assert [item async for item in _drain_until(future, queue)] == ["filler"]
+
+    done, queue = loop.create_future(), asyncio.Queue()
+    done.set_result(None)
+    queue.put_nowait("late")
+    assert [item async for item in _drain_until(done, queue)] == ["late"]
+
+
+# ==================== ASR: MODEL TẦNG CHẤT LƯỢNG CHƯA TẢI ====================
+
+class FakeWhisper:
+    """Model Whisper giả lập: ghi lại tham số decode, trả transcript cố định."""
+    def __init__(self, text: str):
+        self.text = text
+        self.calls = []
+
+    def transcribe(self, audio, **kwargs):
+        self.calls.append(kwargs)
+        return {"text": self.text, "segments": []}
+
+
+def test_degraded_tier_falls_back_to_main_model_when_missing(monkeypatch):
+    """Tầng giảm chất lượng cần "tiny" nhưng model chưa tải: dùng model chính thay vì trả transcript rỗng."""
+    main = FakeWhisper("tôi muốn đặt hàng")
+    asr = ASRServiceWhisper(log_callback=lambda *args, **kwargs: None, model=main, model_name="base")
+    monkeypatch.setattr(rtc_integration_layer.model_registry, "get_whisper", lambda name: None)
+    monkeypatch.setattr(rtc_integration_layer.quality_controller, "current",
+                        lambda: QualityTier(name="small_model", model="tiny", decode={"temperature": 0.0}))
+
+    result = asr._transcribe_blocking(np.zeros(SAMPLE_RATE, dtype=np.float32))
+    assert result["text"] == "tôi muốn đặt hàng"
+    assert main.calls and main.calls[-1]["temperature"] == 0.0
@@ -0,0 +1,79 @@
+# test_tts_splicer.py
+
+import pytest
+
+import tts_splicer
+from tts_splicer import number_words, normalize_vi, NUMBER_VOCAB
+from rtc_integration_layer import TTSServiceGTTS
+
+# ==================== SỐ NGUYÊN ====================
+
+@pytest.mark.parametrize("n, expected", [
+    (0, "không"),
+    (5, "năm"),
+    (10, "mười"),
+    (15, "mười lăm"),
+    (21, "hai mươi mốt"),
+    (24, "hai mươi tư"),
+    (25, "hai mươi lăm"),
+    (105, "một trăm linh năm"),
+    (1005000, "một triệu không trăm linh năm nghìn"),
+    (10 ** 9, "một tỷ"),
+    (10 ** 9 + 5, "một tỷ không trăm linh năm"),
+])
+def test_number_words(n, expected):
+    assert number_words(n) == expected
+
+# ==================== THẬP PHÂN / TIỀN TỆ / PHẦN TRĂM ====================
+
+@pytest.mark.parametrize("text, expected", [
+    ("0.05", "không phẩy không năm"),
+    ("0,05", "không phẩy không năm"),
+    ("3,14", "ba phẩy mười bốn"),
+    ("2,0", "hai phẩy không"),
+    ("1.000.000", "một triệu"),
+    ("1,000", "một nghìn"),
+    ("1,000.50 VND", "một nghìn phẩy năm mươi đồng"),
+    ("1.000,50 VND", "một nghìn phẩy năm mươi đồng"),
+    ("50.000đ", "năm mươi nghìn đồng"),
+    ("1.005.000 đồng", "một triệu không trăm linh năm nghìn đồng"),
+    ("10%", "mười phần trăm"),
+    ("2,5%", "hai phẩy năm phần trăm"),
+    ("Tổng **25** món", "Tổng hai mươi lăm món"),
+])
+def test_normalize_vi(text, expected):
+    assert normalize_vi(text) == expected
+
+
+# ==================== MÃ / SỐ ĐIỆN THOẠI / NGÀY GIỜ ====================
+
+@pytest.mark.parametrize("text, expected", [
+    ("Mã đơn ORD123", "Mã đơn ORD123"),                              # số dính chữ: giữ nguyên
+    ("SKU A12-B7", "SKU A12-B7"),
+    ("Gọi 0912345678", "Gọi không chín một hai ba bốn năm sáu bảy tám"),
+    ("mã 007", "mã không không bảy"),
+    ("mã vận đơn 123456789012", "mã vận đơn một hai ba bốn năm sáu bảy tám chín không một hai"),
+    ("ngày 12/05/2024", "ngày 12/05/2024"),                           # ngày/giờ: để TTS tự đọc
+    ("lúc 10:30", "lúc 10:30"),
+    ("nặng 3.5kg", "nặng 3.5kg"),
+    ("Giá 50.000đ.", "Giá năm mươi nghìn đồng."),
+    ("còn 5 sản phẩm, 10 món.", "còn năm sản phẩm, mười món."),
+])
+def test_normalize_vi_leaves_codes_and_dates_readable(text, expected):
+    assert normalize_vi(text) == expected
+
+
+def test_gtts_text_untouched_when_splicing_disabled(monkeypatch):
+    """Tắt ghép clip (mặc định): câu gửi gTTS nguyên văn, không qua normalize_vi."""
+    monkeypatch.setattr(tts_splicer.splicer, "enabled", False)
+    service = TTSServiceGTTS(log_callback=lambda *args, **kwargs: None)
+    sent = []
+    monkeypatch.setattr(service, "_gtts_wav", lambda text: sent.append(text) or b"")
+    service._synthesize_blocking("Đơn ORD123 giá 50.000đ")
+    assert sent == ["Đơn ORD123 giá 50.000đ"]
+
+
+def test_normalized_numbers_stay_in_vocab():
+    """Mọi từ đọc số phải có clip render sẵn (ghép slot số)."""
+    for text in ("0,05", "1,000.50 VND", "1.005.000 đồng", "2,5%"):
+        assert all(word in NUMBER_VOCAB for word in normalize_vi(text).split())
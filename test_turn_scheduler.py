@@ -0,0 +1,217 @@
+# test_turn_scheduler.py
+
+import pytest
+import asyncio
+import threading
+
+from turn_scheduler import StageScheduler, TenantPolicy, TurnScheduler
+import metrics_layer
+from admission_control import AdmissionController
+
+# ==================== CÁC HÀM HỖ TRỢ KIỂM THỬ ====================
+
+async def settle():
+    """Nhường event loop vài vòng để các lượt vừa được cấp slot chạy tới điểm chờ kế tiếp."""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def hold_slot(scheduler: StageScheduler, policy: TenantPolicy, cost: float, label: str, order: list):
+    """Một lượt: chờ slot, ghi nhận thứ tự được cấp rồi trả slot ngay."""
+    async with scheduler.slot(policy, cost):
+        order.append(label)
+        await asyncio.sleep(0)
+
+
+class Blocker:
+    """Giữ slot duy nhất của stage để các lượt sau xếp hàng đầy đủ trước khi dispatch."""
+    def __init__(self, scheduler: StageScheduler):
+        self.release = asyncio.Event()
+        self.task = asyncio.create_task(self._run(scheduler))
+
+    async def _run(self, scheduler: StageScheduler):
+        async with scheduler.slot(TenantPolicy(name="blocker")):
+            await self.release.wait()
+
+# ==================== WFQ / SJF ====================
+
+@pytest.mark.asyncio
+async def test_weighted_fair_share_between_tenants():
+    scheduler = StageScheduler("test_wfq", capacity=1)
+    blocker = Blocker(scheduler)
+    await settle()
+    heavy, light = TenantPolicy(name="heavy", weight=3.0), TenantPolicy(name="light", weight=1.0)
+    order = []
+    tasks = [asyncio.create_task(hold_slot(scheduler, light, 1.0, "light", order)) for _ in range(4)]
+    tasks += [asyncio.create_task(hold_slot(scheduler, heavy, 1.0, "heavy", order)) for _ in range(4)]
+    await settle()
+    assert scheduler.queued() == 8
+
+    blocker.release.set()
+    await asyncio.gather(blocker.task, *tasks)
+    # Trọng số 3:1 -> tenant nặng nhận 3 trong 4 slot đầu, tenant nhẹ không bị bỏ đói
+    assert order[:4].count("heavy") == 3
+    assert "light" in order[:4]
+    assert scheduler.running == 0 and scheduler.queued() == 0
+
+
+@pytest.mark.asyncio
+async def test_shortest_job_first_within_tenant():
+    scheduler = StageScheduler("test_sjf", capacity=1)
+    blocker = Blocker(scheduler)
+    await settle()
+    tenant = TenantPolicy(name="tenant")
+    order = []
+    tasks = [asyncio.create_task(hold_slot(scheduler, tenant, cost, f"{cost}s", order)) for cost in (3.0, 1.0, 2.0, 1.0)]
+    await settle()
+
+    blocker.release.set()
+    await asyncio.gather(blocker.task, *tasks)
+    assert order == ["1.0s", "1.0s", "2.0s", "3.0s"]
+
+
+@pytest.mark.asyncio
+async def test_tenant_max_concurrency_is_respected():
+    scheduler = StageScheduler("test_tenant_cap", capacity=2)
+    capped, other = TenantPolicy(name="capped", max_concurrency=1), TenantPolicy(name="other")
+    release = asyncio.Event()
+    order = []
+
+    async def run(policy, label):
+        async with scheduler.slot(policy):
+            order.append(label)
+            await release.wait()
+
+    tasks = [asyncio.create_task(run(capped, "capped")) for _ in range(2)] + [asyncio.create_task(run(other, "other"))]
+    await settle()
+    # Slot thứ hai của stage thuộc về tenant khác, lượt thứ hai của tenant bị chặn vẫn chờ
+    assert sorted(order) == ["capped", "other"]
+    assert scheduler.queued() == 1
+    release.set()
+    await asyncio.gather(*tasks)
+    assert order.count("capped") == 2
+
+# ==================== HỦY KHI ĐANG CHỜ ====================
+
+@pytest.mark.asyncio
+async def test_cancel_while_queued_releases_nothing_and_skips_job():
+    scheduler = StageScheduler("test_cancel", capacity=1)
+    blocker = Blocker(scheduler)
+    await settle()
+    tenant = TenantPolicy(name="tenant")
+    order = []
+    cancelled = asyncio.create_task(hold_slot(scheduler, tenant, 1.0, "cancelled", order))
+    survivor = asyncio.create_task(hold_slot(scheduler, tenant, 2.0, "survivor", order))
+    await settle()
+    assert scheduler.queued() == 2
+
+    cancelled.cancel()
+    await settle()
+    assert cancelled.cancelled()
+    assert scheduler.queued() == 1
+    assert scheduler.running == 1  # blocker vẫn giữ slot, lượt bị hủy không trả slot nào
+
+    blocker.release.set()
+    await asyncio.gather(blocker.task, survivor)
+    assert order == ["survivor"]
+    assert scheduler.running == 0 and scheduler.queued() == 0
+
+
+@pytest.mark.asyncio
+async def test_disabled_scheduler_does_not_wait():
+    scheduler = TurnScheduler(concurrency={"test_disabled": 1}, enabled=False)
+    async with scheduler.slot("test_disabled", "key") as waited:
+        async with scheduler.slot("test_disabled", "key") as waited_again:
+            assert waited == waited_again == 0.0
+
+
+def test_asr_capacity_clamped_to_model_instances():
+    scheduler = TurnScheduler(concurrency={"test_asr_clamp": 4, "test_dm_clamp": 2},
+                              limits={"test_asr_clamp": 1})
+    assert scheduler.stages["test_asr_clamp"].capacity == 1
+    assert scheduler.stages["test_dm_clamp"].capacity == 2
+
+# ==================== ADMISSION CONTROL ====================
+
+def make_controller(sessions=0, queue=0, p95=None, **kwargs):
+    return AdmissionController(enabled=True, max_sessions=10, max_queue_depth=8, max_turn_p95_s=4.0,
+                               headroom=0.75, retry_after_s=5, max_retry_after_s=60,
+                               sessions_fn=lambda: sessions, queue_fn=lambda: queue, latency_fn=lambda: p95, **kwargs)
+
+
+@pytest.mark.parametrize("sessions, queue, p95, admitted, reason", [
+    (0, 0, None, True, "ok"),
+    (9, 5, 2.9, True, "ok"),                        # ngay dưới mọi ngưỡng (queue < 6, p95 < 3.0)
+    (10, 0, None, False, "over_session_capacity"),
+    (0, 6, None, False, "queue_saturated"),          # 8 * 0.75 = 6
+    (1, 0, 3.0, False, "turn_latency_high"),         # 4.0 * 0.75 = 3.0
+    (0, 0, 30.0, True, "ok"),                        # không còn session: bỏ qua latency cũ
+])
+def test_admission_thresholds(sessions, queue, p95, admitted, reason):
+    decision = make_controller(sessions, queue, p95).admit("call")
+    assert decision.admitted == admitted
+    assert decision.reason == reason
+
+
+def test_admission_retry_after_scales_with_overload():
+    assert make_controller(queue=6).admit("call").retry_after_s == 5
+    assert make_controller(queue=12).admit("call").retry_after_s == 10
+    assert make_controller(sessions=1, p95=300.0).admit("call").retry_after_s == 60  # chặn trên max_retry_after_s
+
+
+def test_admission_in_progress_and_disabled_always_admitted():
+    overloaded = make_controller(sessions=99, queue=99, p95=99.0)
+    assert overloaded.admit("call", in_progress=True).reason == "in_progress"
+    assert overloaded.admit("call").admitted is False
+    assert overloaded.rejected == 1
+    disabled = AdmissionController(enabled=False, sessions_fn=lambda: 99)
+    assert disabled.admit("call").reason == "disabled"
+
+
+def test_admission_recovers_when_slow_samples_go_stale(monkeypatch):
+    """20 lượt chậm rồi node rảnh: p95 cũ hết hạn -> nhận cuộc gọi mới trở lại (không kẹt turn_latency_high)."""
+    now = [1000.0]
+    monkeypatch.setattr(metrics_layer.time, "monotonic", lambda: now[0])
+    monkeypatch.setitem(metrics_layer._recent_latency, "turn", metrics_layer.deque(maxlen=200))
+    for _ in range(20):
+        metrics_layer.observe_stage("turn", 5.0)
+    sessions = [1]
+    controller = AdmissionController(enabled=True, max_sessions=10, max_queue_depth=8, max_turn_p95_s=4.0,
+                                     headroom=0.75, sessions_fn=lambda: sessions[0], queue_fn=lambda: 0)
+    assert controller.admit("call").reason == "turn_latency_high"
+
+    sessions[0] = 0
+    assert controller.admit("call").admitted, "Không còn session: latency cũ không được chặn cuộc gọi mới."
+
+    sessions[0] = 1
+    now[0] += 3600
+    assert controller.admit("call").admitted, "Mẫu latency quá hạn phải bị bỏ."
+
+
+def test_model_pool_created_once_across_threads(monkeypatch):
+    """Hai thread executor cùng lấy pool lần đầu: chỉ một ModelPool được tạo (giữ đúng capacity)."""
+    created = []
+    barrier = threading.Barrier(8)
+    real_pool = metrics_layer.ModelPool
+
+    class SlowPool(real_pool):
+        def __init__(self, *args, **kwargs):
+            created.append(self)
+            threading.Event().wait(0.01)  # nới cửa sổ race
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(metrics_layer, "ModelPool", SlowPool)
+    pools = []
+
+    def worker():
+        barrier.wait()
+        pools.append(metrics_layer.model_pool("whisper:test_race", capacity=1))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    metrics_layer._model_pools.pop("whisper:test_race", None)
+    assert len(created) == 1
+    assert all(pool is pools[0] for pool in pools)
@@ -0,0 +1,347 @@
+# tracing_layer.py
+import contextvars
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+from logging_layer import get_logger
+from metrics_layer import PIPELINE_STAGES, observe_stage
+
+# --- SAFE IMPORT CONFIG ---
+try:
+    from config_db import (
+        TRACE_EXPORTER, TRACE_FILE_PATH, TRACE_FILE_MAX_BYTES, TRACE_FILE_BACKUPS, OTLP_ENDPOINT, APP_SERVICE_NAME
+    )
+except ImportError:
+    TRACE_EXPORTER = "NONE"
+    TRACE_FILE_PATH = "traces/otlp_traces.jsonl"
+    TRACE_FILE_MAX_BYTES = 50 * 1024 * 1024
+    TRACE_FILE_BACKUPS = 3
+    OTLP_ENDPOINT = ""
+    APP_SERVICE_NAME = "HybridVoiceBot"
+
+_DEFAULT_OTLP_ENDPOINT = "http://127.0.0.1:4318/v1/traces"
+
+_log = get_logger("tracing")
+
+# OTLP: SPAN_KIND_INTERNAL = 1, STATUS_CODE_OK = 1, STATUS_CODE_ERROR = 2
+_SPAN_KIND_INTERNAL = 1
+_STATUS_OK = 1
+_STATUS_ERROR = 2
+
+
+# ==================== SPAN / TRACE ====================
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_span_id: Optional[str]
+    start_ns: int
+    end_ns: Optional[int] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def duration_s(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+
+class TurnTrace:
+    """Trace của một lượt hội thoại (turn), gắn với session_id. Thread-safe khi thêm span."""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.trace_id = os.urandom(16).hex()
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+        self.root = self._new_span("turn", None, time.time_ns())
+        self.root.set_attribute("session.id", session_id)
+
+    def _new_span(self, name: str, parent_span_id: Optional[str], start_ns: int) -> Span:
+        span = Span(name, self.trace_id, os.urandom(8).hex(), parent_span_id, start_ns)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def start_span(self, name: str, parent: Optional[Span] = None, **attributes: Any) -> Span:
+        span = self._new_span(name, (parent or self.root).span_id, time.time_ns())
+        span.attributes.update(attributes)
+        return span
+
+    def record_span(self, name: str, start_ns: int, end_ns: int, parent: Optional[Span] = None, **attributes: Any) -> Span:
+        """Ghi một span đã biết thời điểm bắt đầu/kết thúc (ví dụ đo thủ công)."""
+        span = self._new_span(name, (parent or self.root).span_id, start_ns)
+        span.end_ns = end_ns
+        span.attributes.update(attributes)
+        return span
+
+    def finish(self):
+        if self.root.end_ns is None:
+            self.root.end_ns = time.time_ns()
+
+    def timeline(self) -> List[Dict[str, Any]]:
+        """Timeline dạng dễ đọc: offset (ms) và duration (ms) của từng span so với lúc bắt đầu turn."""
+        origin = self.root.start_ns
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start_ns)
+        return [
+            {"name": s.name, "offset_ms": round((s.start_ns - origin) / 1e6, 2),
+             "duration_ms": round(s.duration_s * 1000, 2), **s.attributes}
+            for s in spans
+        ]
+
+
+# ==================== CONTEXT ====================
+_current_trace: contextvars.ContextVar[Optional[TurnTrace]] = contextvars.ContextVar("voicebot_trace", default=None)
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("voicebot_span", default=None)
+
+
+def current_trace() -> Optional[TurnTrace]:
+    return _current_trace.get()
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.trace_id if trace else None
+
+
+@contextmanager
+def activate(trace: Optional[TurnTrace]) -> Iterator[Optional[TurnTrace]]:
+    """Đặt trace hiện tại cho task/thread đang chạy (span ở các tầng sâu hơn sẽ gắn vào trace này)."""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """
+    Ghi một span vào trace hiện tại (no-op nếu không có trace).
+    Nếu name là một stage của pipeline thì latency cũng được ghi vào histogram Prometheus, trừ span có
+    attribute source (NLU chấm điểm cascade, NLU suy đoán...): histogram chỉ nhận span chính của lượt.
+    """
+    trace = _current_trace.get()
+    start = time.perf_counter()
+    current = trace.start_span(name, _current_span.get(), **attributes) if trace else None
+    token = _current_span.set(current) if current else None
+    try:
+        yield current
+    except BaseException as e:
+        if current is not None:
+            current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        if token is not None:
+            _current_span.reset(token)
+        if current is not None:
+            current.end_ns = time.time_ns()
+        if _is_stage(name, attributes):
+            observe_stage(name, time.perf_counter() - start)
+
+
+def _is_stage(name: str, attributes: Dict[str, Any]) -> bool:
+    return name in PIPELINE_STAGES and "source" not in attributes
+
+
+def record_span(name: str, start_ns: int, end_ns: Optional[int] = None, **attributes: Any) -> Optional[Span]:
+    """Ghi span đo thủ công (time.time_ns()) vào trace hiện tại, kèm histogram nếu là stage."""
+    end_ns = end_ns or time.time_ns()
+    if _is_stage(name, attributes):
+        observe_stage(name, (end_ns - start_ns) / 1e9)
+    trace = _current_trace.get()
+    if trace is None:
+        return None
+    return trace.record_span(name, start_ns, end_ns, _current_span.get(), **attributes)
+
+
+def run_in_context(func: Callable, *args: Any) -> Callable[[], Any]:
+    """
+    Bọc func để chạy với contextvars hiện tại trong run_in_executor
+    (asyncio.to_thread đã tự copy context, run_in_executor thì không).
+    """
+    ctx = contextvars.copy_context()
+    return lambda: ctx.run(func, *args)
+
+
+# ==================== OTLP JSON ====================
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": k, "value": _otlp_value(v)} for k, v in attributes.items() if v is not None]
+
+
+def trace_to_otlp(trace: TurnTrace) -> Dict[str, Any]:
+    """Chuyển trace sang JSON tương thích OTLP (ExportTraceServiceRequest)."""
+    spans = []
+    for s in trace.spans:
+        otlp_span = {
+            "traceId": s.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": _SPAN_KIND_INTERNAL,
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns or s.start_ns),
+            "attributes": _otlp_attributes({"session.id": trace.session_id, **s.attributes}),
+            "status": {"code": _STATUS_ERROR, "message": s.error} if s.error else {"code": _STATUS_OK},
+        }
+        if s.parent_span_id:
+            otlp_span["parentSpanId"] = s.parent_span_id
+        spans.append(otlp_span)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": APP_SERVICE_NAME})},
+            "scopeSpans": [{"scope": {"name": "voicebot.tracing"}, "spans": spans}],
+        }]
+    }
+
+
+# ==================== EXPORTERS ====================
+class OTLPFileExporter:
+    """
+    Ghi mỗi trace thành một dòng JSON (OTLP) vào file .jsonl.
+    File vượt max_bytes -> xoay như RotatingFileHandler (path.1 ... path.<backups>, file cũ nhất bị xóa).
+    """
+    def __init__(self, path: str = TRACE_FILE_PATH, max_bytes: int = TRACE_FILE_MAX_BYTES,
+                 backups: int = TRACE_FILE_BACKUPS):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.backups = max(0, backups)
+
+    def _rotate(self):
+        for index in range(self.backups, 0, -1):
+            source = self.path if index == 1 else self.path.with_name(f"{self.path.name}.{index - 1}")
+            if source.exists():
+                source.replace(self.path.with_name(f"{self.path.name}.{index}"))
+        if self.path.exists():
+            self.path.unlink()
+
+    def export(self, payload: Dict[str, Any]):
+        line = json.dumps(payload, ensure_ascii=False) + "\n"
+        if self.max_bytes > 0 and self.path.exists() and self.path.stat().st_size + len(line.encode("utf-8")) > self.max_bytes:
+            self._rotate()
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+class OTLPHttpExporter:
+    """Gửi OTLP/HTTP JSON tới collector (ví dụ OpenTelemetry Collector ở :4318)."""
+    def __init__(self, endpoint: str = OTLP_ENDPOINT):
+        self.endpoint = endpoint or _DEFAULT_OTLP_ENDPOINT
+
+    def export(self, payload: Dict[str, Any]):
+        import httpx
+        httpx.post(self.endpoint, json=payload, timeout=5.0).raise_for_status()
+
+
+class InMemoryCollector:
+    """Collector stub: giữ N trace gần nhất trong bộ nhớ (debug/test)."""
+    def __init__(self, max_traces: int = 200):
+        self.traces: Deque[Dict[str, Any]] = deque(maxlen=max_traces)
+
+    def export(self, payload: Dict[str, Any]):
+        self.traces.append(payload)
+
+
+def _create_exporter(kind: str):
+    kind = (kind or "NONE").upper()
+    if kind == "FILE":
+        return OTLPFileExporter()
+    if kind == "OTLP_HTTP":
+        return OTLPHttpExporter()
+    if kind == "MEMORY":
+        return InMemoryCollector()
+    return None
+
+
+class _ExportWorker:
+    """Export trong luồng nền để không chặn event loop / luồng audio."""
+    _STOP = object()
+
+    def __init__(self, exporter):
+        self.exporter = exporter
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=1000)
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def submit(self, trace: TurnTrace):
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            _log.warning("⚠️ [TRACE] Queue export đầy, bỏ trace %s", trace.trace_id)
+
+    def stop(self):
+        """Export nốt các trace đã nhận rồi dừng luồng (không chờ)."""
+        self._queue.put(self._STOP)
+
+    def _run(self):
+        while True:
+            trace = self._queue.get()
+            if trace is self._STOP:
+                return
+            try:
+                self.exporter.export(trace_to_otlp(trace))
+            except Exception as e:
+                _log.warning("⚠️ [TRACE] Lỗi export trace %s: %s", trace.trace_id, e)
+
+
+_exporter = _create_exporter(TRACE_EXPORTER)
+_worker: Optional[_ExportWorker] = None
+
+
+def set_exporter(exporter) -> None:
+    """Thay exporter (FILE/OTLP_HTTP/MEMORY hoặc object có .export(payload))."""
+    global _exporter, _worker
+    _exporter = _create_exporter(exporter) if isinstance(exporter, str) else exporter
+    if _worker is not None:
+        _worker.stop()
+    _worker = None
+
+
+def get_exporter():
+    return _exporter
+
+
+# ==================== TURN API ====================
+def begin_turn(session_id: str) -> TurnTrace:
+    """Tạo trace mới cho một turn của session_id."""
+    return TurnTrace(session_id)
+
+
+def end_turn(trace: Optional[TurnTrace]):
+    """Đóng root span, log timeline (DEBUG) và đẩy trace cho exporter."""
+    global _worker
+    if trace is None:
+        return
+    trace.finish()
+    # Latency cả lượt (stop_recording -> end_of_session) cho admission control
+    observe_stage("turn", (trace.root.end_ns - trace.root.start_ns) / 1e9)
+    _log.debug(lambda: f"🧭 [TRACE] {trace.session_id} {trace.trace_id}: {json.dumps(trace.timeline(), ensure_ascii=False)}")
+    if _exporter is None:
+        return
+    if _worker is None or _worker.exporter is not _exporter:
+        if _worker is not None:
+            _worker.stop()
+        _worker = _ExportWorker(_exporter)
+    _worker.submit(trace)
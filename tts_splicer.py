@@ -0,0 +1,383 @@
+# tts_splicer.py
+"""
+Ghép TTS theo mẫu. Phản hồi DB (response_generator.DB_RESPONSE_TEMPLATES) luôn khác nhau ở tên/giá/phần trăm nên
+gTTS cả câu không bao giờ trúng cache. Ở đây câu phản hồi được so với các mẫu và tách thành:
+  - câu mang: phần chữ cố định của mẫu, render sẵn một lần;
+  - slot số (giá, phần trăm): chuẩn hóa sang chữ tiếng Việt ("5,000,000 VNĐ" -> "năm triệu đồng") rồi ghép từ
+    clip từng từ đọc số (vốn từ nhỏ, render sẵn), crossfade TTS_SPLICE_CROSSFADE_MS;
+  - slot khác (tên sản phẩm, khách hàng): clip cả cụm, cụm trong TTS_SPLICE_CATALOG render sẵn.
+Các đoạn nối bằng NumPy (cắt lặng, fade, chèn lặng/crossfade) thành WAV 16kHz như gTTS trả về.
+Câu không khớp mẫu, hoặc còn thiếu clip -> gTTS cả câu như cũ (clip thiếu được render nền cho lượt sau).
+"""
+import hashlib
+import io
+import re
+import string
+import threading
+import wave
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from audio_frontend import trim_silence, fade_edges, crossfade_concat, resample, to_int16
+from logging_layer import get_logger
+from metrics_layer import TTS_SPLICE, register_executor
+from response_generator import DB_RESPONSE_TEMPLATES
+
+# --- SAFE IMPORT CONFIG ---
+try:
+    from config_db import (
+        TTS_SPLICE_ENABLED, TTS_SPLICE_CACHE_DIR, TTS_SPLICE_CATALOG, TTS_SPLICE_CROSSFADE_MS, TTS_SPLICE_GAP_MS,
+        TTS_SPLICE_SENTENCE_GAP_MS, SAMPLE_RATE
+    )
+except ImportError:
+    TTS_SPLICE_ENABLED = False
+    TTS_SPLICE_CACHE_DIR = "tts_clip_cache"
+    TTS_SPLICE_CATALOG = []
+    TTS_SPLICE_CROSSFADE_MS = 15
+    TTS_SPLICE_GAP_MS = 60
+    TTS_SPLICE_SENTENCE_GAP_MS = 300
+    SAMPLE_RATE = 16000
+
+_log = get_logger("tts.splice")
+
+_CLIP_FADE_MS = 5
+
+# Render clip còn thiếu: một thread (gTTS cần mạng, không cần song song), không chiếm executor TTS của lượt
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts-splice")
+register_executor("tts_splice", _executor)
+
+# ==================== CHUẨN HÓA SỐ TIẾNG VIỆT ====================
+_DIGITS = ["không", "một", "hai", "ba", "bốn", "năm", "sáu", "bảy", "tám", "chín"]
+_SCALES = [(10 ** 6, "triệu"), (10 ** 3, "nghìn"), (1, "")]
+
+# Mọi từ number_words()/normalize_vi() có thể sinh cho một số: clip render sẵn để ghép slot số
+NUMBER_VOCAB = sorted(set(_DIGITS) | {"mười", "mươi", "mốt", "tư", "lăm", "linh", "trăm", "nghìn", "triệu", "tỷ",
+                                      "phẩy", "đồng", "phần"})
+
+# Một loại dấu phân cách nghìn ("1.000.000" / "1,000,000"); có cả hai loại dấu -> dấu cuối là dấu thập phân
+_THOUSANDS_RE = re.compile(r"\d{1,3}([.,])\d{3}(?:\1\d{3})*")
+_DECIMAL_RE = re.compile(r"(\d+)[.,](\d+)")
+# Chỉ số đứng riêng: không dính chữ ("ORD123"), không thuộc ngày/giờ ("12/05/2024", "10:30") -> để nguyên cho TTS
+_NUMBER_PATTERN = r"(?<![\w/:.,])\d+(?:[.,]\d+)*"
+_CURRENCY_RE = re.compile(r"(" + _NUMBER_PATTERN + r")\s*(?:VNĐ|VND|vnđ|vnd|đồng|đ)(?!\w)")
+_PERCENT_RE = re.compile(r"(" + _NUMBER_PATTERN + r")\s*%")
+_NUMBER_RE = re.compile(_NUMBER_PATTERN + r"(?![\w/:]|[.,]\d)")
+# Dãy số dài hơn (số điện thoại, mã đơn không có dấu phân cách) đọc từng chữ số
+_MAX_CARDINAL_DIGITS = 9
+
+
+def _read_triple(n: int, full: bool) -> List[str]:
+    """Đọc 0..999. full: nhóm không đứng đầu -> đọc cả "không trăm" ("một triệu không trăm linh năm nghìn")."""
+    hundreds, tens, units = n // 100, n // 10 % 10, n % 10
+    words = []
+    if hundreds or full:
+        words += [_DIGITS[hundreds], "trăm"]
+    if tens == 0:
+        if units and words:
+            words.append("linh")
+    elif tens == 1:
+        words.append("mười")
+    else:
+        words += [_DIGITS[tens], "mươi"]
+    if units:
+        if units == 1 and tens > 1:
+            words.append("mốt")
+        elif units == 4 and tens > 1:
+            words.append("tư")
+        elif units == 5 and tens > 0:
+            words.append("lăm")
+        else:
+            words.append(_DIGITS[units])
+    return words
+
+
+def _below_billion(n: int, full: bool) -> List[str]:
+    words = []
+    for scale, name in _SCALES:
+        group = n // scale % 1000
+        if group:
+            words += _read_triple(group, full)
+            if name:
+                words.append(name)
+            full = True
+    return words
+
+
+def number_words(n: int) -> str:
+    """Số nguyên không âm -> chữ tiếng Việt: 21 -> "hai mươi mốt", 1005000 -> "một triệu không trăm linh năm nghìn"."""
+    if n == 0:
+        return _DIGITS[0]
+    high, low = divmod(n, 10 ** 9)
+    words = (number_words(high).split() + ["tỷ"]) if high else []
+    if low:
+        words += _below_billion(low, full=bool(high))
+    return " ".join(words)
+
+
+def _decimal_words(integer: str, fraction: str) -> str:
+    """Số 0 đầu phần thập phân đọc từng chữ: "0,05" -> "không phẩy không năm", "3,14" -> "ba phẩy mười bốn"."""
+    significant = fraction.lstrip("0")
+    words = [number_words(int(re.sub(r"[.,]", "", integer))), "phẩy"] + [_DIGITS[0]] * (len(fraction) - len(significant))
+    if significant:
+        words.append(number_words(int(significant)))
+    return " ".join(words)
+
+
+def _number_text(token: str) -> str:
+    if _THOUSANDS_RE.fullmatch(token):
+        return number_words(int(re.sub(r"[.,]", "", token)))
+    point = max(token.rfind("."), token.rfind(","))
+    integer, fraction = token[:point], token[point + 1:]
+    if point > 0 and fraction.isdigit() and token[point] not in integer and _THOUSANDS_RE.fullmatch(integer):
+        # "1,000.50" / "1.000,50": nghìn + thập phân
+        return _decimal_words(integer, fraction)
+    decimal = _DECIMAL_RE.fullmatch(token)
+    if decimal:
+        return _decimal_words(decimal.group(1), decimal.group(2))
+    if token.isdigit():
+        if (len(token) > 1 and token[0] == "0") or len(token) > _MAX_CARDINAL_DIGITS:
+            # "007", "0912345678": mã/số điện thoại, không phải số lượng
+            return " ".join(_DIGITS[int(digit)] for digit in token)
+        return number_words(int(token))
+    return token
+
+
+def normalize_vi(text: str) -> str:
+    """Chuẩn hóa câu cho TTS: bỏ markdown **, số/tiền tệ/phần trăm -> chữ ("10%" -> "mười phần trăm")."""
+    text = text.replace("**", "")
+    text = _CURRENCY_RE.sub(lambda m: _number_text(m.group(1)) + " đồng", text)
+    text = _PERCENT_RE.sub(lambda m: _number_text(m.group(1)) + " phần trăm", text)
+    return _NUMBER_RE.sub(lambda m: _number_text(m.group(0)), text)
+
+
+# ==================== CACHE CLIP ====================
+class PhraseClipCache:
+    """Clip float32 đã cắt lặng + fade theo cụm chữ: trong bộ nhớ và WAV trên đĩa (giữ qua các lần khởi động)."""
+
+    def __init__(self, cache_dir: str = TTS_SPLICE_CACHE_DIR, sample_rate: int = SAMPLE_RATE,
+                 fade_ms: int = _CLIP_FADE_MS):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(exist_ok=True)
+        self.sample_rate = sample_rate
+        self.fade_ms = fade_ms
+        self._clips: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def path(self, text: str) -> Path:
+        return self.cache_dir / (hashlib.sha1(text.encode("utf-8")).hexdigest()[:16] + ".wav")
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        with self._lock:
+            clip = self._clips.get(text)
+        if clip is not None:
+            return clip
+        path = self.path(text)
+        if not path.exists():
+            return None
+        with wave.open(str(path), "rb") as wf:
+            rate = wf.getframerate()
+            samples = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16).astype(np.float32) / 32768.0
+        clip = resample(samples, rate, self.sample_rate)
+        with self._lock:
+            self._clips[text] = clip
+        return clip
+
+    def render(self, text: str, synthesize: Callable[[str], Optional[bytes]]) -> bool:
+        """Render một cụm (bỏ qua nếu đã có). False nếu TTS không trả về audio."""
+        if self.get(text) is not None:
+            return True
+        wav_bytes = synthesize(text)
+        if not wav_bytes or len(wav_bytes) <= 44:
+            return False
+        with wave.open(io.BytesIO(wav_bytes), "rb") as wf:
+            rate = wf.getframerate()
+            samples = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16).astype(np.float32) / 32768.0
+        samples = resample(samples, rate, self.sample_rate)
+        clip = fade_edges(trim_silence(samples, self.sample_rate), self.sample_rate * self.fade_ms // 1000)
+        path = self.path(text)
+        tmp = path.with_suffix(".tmp")
+        with wave.open(str(tmp), "wb") as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(self.sample_rate)
+            wf.writeframes(to_int16(clip).tobytes())
+        tmp.replace(path)
+        with self._lock:
+            self._clips[text] = clip
+        return True
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._clips)
+
+
+# ==================== GHÉP THEO MẪU ====================
+_SENTENCE_END = ".!?"
+
+# Một đoạn cần phát: (chữ của clip, lặng trước đoạn tính bằng ms; 0 -> crossfade với đoạn trước)
+Piece = Tuple[str, int]
+
+
+class _Template:
+    """Mẫu str.format đã biên dịch: regex khớp câu đã format + danh sách phần (chữ cố định hoặc tên slot)."""
+
+    def __init__(self, name: str, template: str):
+        self.name = name
+        self.parts: List[Tuple[str, Optional[str]]] = []
+        pattern = ""
+        for literal, field, _, _ in string.Formatter().parse(template):
+            pattern += re.escape(literal)
+            if field is not None:
+                pattern += f"(?P<{field}>.+?)"
+            self.parts.append((literal, field))
+        self.regex = re.compile(pattern + r"\s*$")
+
+    def carriers(self) -> List[str]:
+        return [text for text in (_carrier_text(literal) for literal, _ in self.parts) if text]
+
+
+def _carrier_text(literal: str) -> str:
+    return literal.replace("*", "").strip().lstrip(_SENTENCE_END + ",:; ").strip()
+
+
+def _slot_pieces(value: str) -> List[str]:
+    """Slot số -> từng từ đọc số (ghép crossfade); slot khác -> một clip cả cụm."""
+    spoken = normalize_vi(value).strip()
+    words = spoken.split()
+    if any(ch.isdigit() for ch in value) and words and all(word in NUMBER_VOCAB for word in words):
+        return words
+    return [spoken] if spoken else []
+
+
+def _log_prerender(future: "Future[int]"):
+    if future.exception() is None:
+        _log("🧩 [SPLICE] Đã render %d clip ghép TTS.", "green" if future.result() else "orange", future.result())
+
+
+class TemplateSplicer:
+    """Phản hồi theo mẫu -> WAV ghép từ clip render sẵn; None nếu không ghép được (gọi TTS cả câu)."""
+
+    def __init__(self, templates: Optional[Dict[str, str]] = None, catalog: Optional[Sequence[str]] = None,
+                 cache: Optional[PhraseClipCache] = None, enabled: bool = TTS_SPLICE_ENABLED,
+                 crossfade_ms: int = TTS_SPLICE_CROSSFADE_MS, gap_ms: int = TTS_SPLICE_GAP_MS,
+                 sentence_gap_ms: int = TTS_SPLICE_SENTENCE_GAP_MS):
+        self.templates = [_Template(name, text)
+                          for name, text in (DB_RESPONSE_TEMPLATES if templates is None else templates).items()]
+        self.catalog = list(TTS_SPLICE_CATALOG if catalog is None else catalog)
+        self.cache = cache or PhraseClipCache()
+        self.enabled = enabled
+        self.crossfade_ms = crossfade_ms
+        self.gap_ms = gap_ms
+        self.sentence_gap_ms = sentence_gap_ms
+        self._synthesize: Optional[Callable[[str], Optional[bytes]]] = None
+        self._pending: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def vocabulary(self) -> List[str]:
+        """Mọi cụm render sẵn: câu mang của các mẫu, từ đọc số, giá trị slot trong catalog."""
+        texts = [carrier for template in self.templates for carrier in template.carriers()]
+        texts += NUMBER_VOCAB
+        texts += [piece for value in self.catalog for piece in _slot_pieces(value)]
+        return list(dict.fromkeys(texts))
+
+    def plan(self, text: str) -> Optional[List[Piece]]:
+        """Câu khớp một mẫu -> danh sách đoạn cần phát theo thứ tự; None nếu không khớp mẫu nào."""
+        for template in self.templates:
+            match = template.regex.match(text.strip())
+            if match is None:
+                continue
+            pieces: List[Piece] = []
+            pause = 0
+            for literal, field in template.parts:
+                clean = literal.replace("*", "")
+                if clean.strip():
+                    if clean.strip()[0] in _SENTENCE_END:
+                        pause = max(pause, self.sentence_gap_ms)
+                    carrier = _carrier_text(literal)
+                    if carrier:
+                        pieces.append((carrier, max(pause, self.gap_ms) if pieces else 0))
+                        pause = self.sentence_gap_ms if carrier[-1] in _SENTENCE_END else 0
+                if field is not None:
+                    for index, word in enumerate(_slot_pieces(match.group(field))):
+                        gap = 0 if index else (max(pause, self.gap_ms) if pieces else 0)
+                        pieces.append((word, gap))
+                    pause = 0
+            return pieces
+        return None
+
+    def _render_missing(self, texts: Iterable[str]) -> int:
+        rendered = 0
+        for text in texts:
+            try:
+                if self._synthesize is not None and self.cache.render(text, self._synthesize):
+                    rendered += 1
+            except Exception as e:
+                _log.warning("⚠️ [SPLICE] Lỗi render clip '%s': %s", text, e)
+            finally:
+                with self._lock:
+                    self._pending.discard(text)
+        return rendered
+
+    def _queue(self, texts: Iterable[str]) -> Optional["Future[int]"]:
+        with self._lock:
+            if self._synthesize is None:
+                return None
+            missing = [text for text in dict.fromkeys(texts)
+                       if text not in self._pending and self.cache.get(text) is None]
+            self._pending.update(missing)
+        return _executor.submit(self._render_missing, missing) if missing else None
+
+    def start_prerender(self, synthesize: Callable[[str], Optional[bytes]]) -> Optional["Future[int]"]:
+        """Render nền các cụm còn thiếu (gTTS là blocking và cần mạng); cụm đã có trên đĩa chỉ được nạp khi cần."""
+        if not self.enabled:
+            return None
+        self._synthesize = synthesize
+        future = self._queue(self.vocabulary())
+        if future is not None:
+            future.add_done_callback(_log_prerender)
+        return future
+
+    def splice(self, text: str) -> Optional[bytes]:
+        """WAV (header 44 byte) ghép từ clip; None nếu tắt, không khớp mẫu hoặc còn thiếu clip."""
+        if not self.enabled:
+            return None
+        pieces = self.plan(text)
+        if pieces is None:
+            TTS_SPLICE.labels("no_template").inc()
+            return None
+        clips = [self.cache.get(piece) for piece, _ in pieces]
+        missing = [piece for (piece, _), clip in zip(pieces, clips) if clip is None]
+        if missing:
+            TTS_SPLICE.labels("missing_clips").inc()
+            _log.debug("🧩 [SPLICE] Thiếu %d clip (%s), dùng TTS cả câu.", len(missing), ", ".join(missing))
+            self._queue(missing)
+            return None
+        rate = self.cache.sample_rate
+        audio = crossfade_concat(clips, [rate * gap_ms // 1000 for _, gap_ms in pieces],
+                                 rate * self.crossfade_ms // 1000)
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(rate)
+            wf.writeframes(to_int16(audio).tobytes())
+        TTS_SPLICE.labels("spliced").inc()
+        _log.debug("🧩 [SPLICE] Ghép %d clip -> %.2fs audio.", len(clips), len(audio) / rate)
+        return buffer.getvalue()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = len(self._pending)
+        return {"enabled": self.enabled, "clips_loaded": len(self.cache), "pending": pending,
+                "vocabulary": len(self.vocabulary())}
+
+
+def status() -> Dict[str, Any]:
+    return splicer.status()
+
+
+# Dùng chung cho server
+splicer = TemplateSplicer()
@@ -0,0 +1,209 @@
+# turn_scheduler.py
+"""
+Lập lịch công bằng các lượt nói giữa các tenant (api_key) trước khi chạy ASR và DM.
+
+Mỗi stage ("asr", "dm") có capacity cố định. Lượt chờ nằm trong queue riêng của tenant:
+  - giữa các tenant: weighted fair queuing (self-clocked): tag = start + cost / weight, chọn tenant có tag
+    nhỏ nhất; start = tag trước đó khi tenant còn lượt chờ liên tục, = max(V, tag cuối) khi tenant vừa có lượt
+    chờ trở lại (V: tag của lượt được cấp gần nhất) -> tenant im lặng một lúc không tích được "tín dụng";
+  - trong một tenant: shortest-job-first theo cost (độ dài audio), cùng cost thì FIFO;
+  - tenant đã chạm max_concurrency bị bỏ qua cho tới khi trả slot.
+Chỉ dùng trên event loop (không cần lock).
+"""
+import asyncio
+import hashlib
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from logging_layer import get_logger
+from metrics_layer import TURN_SCHED_WAIT, TURN_SCHED_QUEUED, register_queue
+
+# --- SAFE IMPORT CONFIG ---
+try:
+    from config_db import (
+        TURN_SCHED_ENABLED, TURN_SCHED_CONCURRENCY, TURN_SCHED_DEFAULT_WEIGHT, TURN_SCHED_DEFAULT_MAX_CONCURRENCY,
+        TURN_SCHED_TENANTS, ASR_MODEL_INSTANCES
+    )
+except ImportError:
+    TURN_SCHED_ENABLED = False
+    ASR_MODEL_INSTANCES = 1
+    TURN_SCHED_CONCURRENCY = {"asr": ASR_MODEL_INSTANCES, "dm": 1}
+    TURN_SCHED_DEFAULT_WEIGHT = 1.0
+    TURN_SCHED_DEFAULT_MAX_CONCURRENCY = None
+    TURN_SCHED_TENANTS = {}
+
+# Trần capacity theo tài nguyên thật: lượt ASR đồng thời không vượt số bản Whisper đã nạp
+STAGE_CAPACITY_LIMITS = {"asr": ASR_MODEL_INSTANCES}
+
+_log = get_logger("scheduler")
+
+
+@dataclass(frozen=True)
+class TenantPolicy:
+    name: str                              # nhãn metrics (không bao giờ là api_key thô)
+    weight: float = TURN_SCHED_DEFAULT_WEIGHT
+    max_concurrency: Optional[int] = TURN_SCHED_DEFAULT_MAX_CONCURRENCY
+
+
+def tenant_policy(api_key: Optional[str]) -> TenantPolicy:
+    """Chính sách của api_key theo TURN_SCHED_TENANTS; key lạ -> trọng số mặc định, nhãn là hash ngắn."""
+    config = TURN_SCHED_TENANTS.get(api_key or "")
+    if config is not None:
+        return TenantPolicy(name=config.get("name") or _anonymous_name(api_key),
+                            weight=float(config.get("weight", TURN_SCHED_DEFAULT_WEIGHT)),
+                            max_concurrency=config.get("max_concurrency", TURN_SCHED_DEFAULT_MAX_CONCURRENCY))
+    return TenantPolicy(name=_anonymous_name(api_key))
+
+
+def _anonymous_name(api_key: Optional[str]) -> str:
+    if not api_key:
+        return "anonymous"
+    return "key-" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:8]
+
+
+@dataclass(order=True)
+class _Job:
+    cost: float
+    seq: int
+    future: "asyncio.Future[None]" = field(compare=False)
+    enqueued_at: float = field(compare=False)
+    cancelled: bool = field(default=False, compare=False)
+
+
+class _TenantQueue:
+    def __init__(self, policy: TenantPolicy):
+        self.policy = policy
+        self.jobs: List[_Job] = []
+        self.running = 0
+        self.finish_tag = 0.0
+        self.start_tag = 0.0
+        self.queued = 0
+
+    def head(self) -> Optional[_Job]:
+        while self.jobs and self.jobs[0].cancelled:
+            heapq.heappop(self.jobs)
+        return self.jobs[0] if self.jobs else None
+
+    def eligible(self) -> bool:
+        cap = self.policy.max_concurrency
+        return self.head() is not None and (cap is None or self.running < cap)
+
+
+class StageScheduler:
+    """Cấp slot chạy một stage cho các lượt theo WFQ giữa tenant, SJF trong tenant."""
+
+    def __init__(self, stage: str, capacity: int):
+        self.stage = stage
+        self.capacity = max(1, capacity)
+        self.running = 0
+        self._virtual_time = 0.0
+        self._tenants: Dict[str, _TenantQueue] = {}
+        self._seq = itertools.count()
+        register_queue(f"sched:{stage}", self.queued)
+
+    def queued(self) -> int:
+        return sum(tenant.queued for tenant in self._tenants.values())
+
+    def _tenant(self, policy: TenantPolicy) -> _TenantQueue:
+        tenant = self._tenants.get(policy.name)
+        if tenant is None:
+            tenant = self._tenants[policy.name] = _TenantQueue(policy)
+        else:
+            tenant.policy = policy
+        return tenant
+
+    def _dispatch(self):
+        while self.running < self.capacity:
+            best, best_tag = None, 0.0
+            for tenant in self._tenants.values():
+                if not tenant.eligible():
+                    continue
+                tag = tenant.start_tag + max(tenant.head().cost, 1e-3) / max(tenant.policy.weight, 1e-6)
+                if best is None or tag < best_tag:
+                    best, best_tag = tenant, tag
+            if best is None:
+                return
+            job = heapq.heappop(best.jobs)
+            best.finish_tag = best.start_tag = self._virtual_time = best_tag
+            best.queued -= 1
+            best.running += 1
+            self.running += 1
+            TURN_SCHED_QUEUED.labels(self.stage, best.policy.name).dec()
+            TURN_SCHED_WAIT.labels(self.stage, best.policy.name).observe(time.monotonic() - job.enqueued_at)
+            job.future.set_result(None)
+
+    def _release(self, tenant: _TenantQueue):
+        tenant.running -= 1
+        self.running -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, policy: TenantPolicy, cost: float = 1.0) -> AsyncIterator[float]:
+        """Chờ tới lượt rồi giữ một slot của stage trong khối with; yield thời gian đã chờ (giây)."""
+        tenant = self._tenant(policy)
+        job = _Job(cost, next(self._seq), asyncio.get_running_loop().create_future(), time.monotonic())
+        if tenant.head() is None:
+            # Tenant vừa có lượt chờ trở lại
+            tenant.start_tag = max(self._virtual_time, tenant.finish_tag)
+        heapq.heappush(tenant.jobs, job)
+        tenant.queued += 1
+        TURN_SCHED_QUEUED.labels(self.stage, policy.name).inc()
+        self._dispatch()
+        try:
+            await job.future
+        except asyncio.CancelledError:
+            if job.future.done() and not job.future.cancelled():
+                # Đã được cấp slot đúng lúc bị hủy: trả lại slot
+                self._release(tenant)
+            else:
+                job.cancelled = True
+                tenant.queued -= 1
+                TURN_SCHED_QUEUED.labels(self.stage, policy.name).dec()
+            raise
+        try:
+            yield time.monotonic() - job.enqueued_at
+        finally:
+            self._release(tenant)
+
+    def status(self) -> Dict[str, Any]:
+        return {"capacity": self.capacity, "running": self.running, "queued": self.queued(),
+                "tenants": {name: {"queued": t.queued, "running": t.running, "weight": t.policy.weight}
+                            for name, t in self._tenants.items() if t.queued or t.running}}
+
+
+class TurnScheduler:
+    """Các StageScheduler theo tên stage; disabled -> slot() không chờ gì."""
+
+    def __init__(self, concurrency: Dict[str, int] = TURN_SCHED_CONCURRENCY, enabled: bool = TURN_SCHED_ENABLED,
+                 limits: Dict[str, int] = STAGE_CAPACITY_LIMITS):
+        self.enabled = enabled
+        self.stages = {}
+        for stage, capacity in concurrency.items():
+            limit = limits.get(stage)
+            if limit is not None and capacity > limit:
+                _log.warning("⚠️ [SCHED] Capacity stage %s (%d) vượt số bản model (%d): hạ xuống %d.",
+                             stage, capacity, limit, limit)
+                capacity = limit
+            self.stages[stage] = StageScheduler(stage, capacity)
+
+    @asynccontextmanager
+    async def slot(self, stage: str, api_key: Optional[str], cost: float = 1.0) -> AsyncIterator[float]:
+        scheduler = self.stages.get(stage)
+        if not self.enabled or scheduler is None:
+            yield 0.0
+            return
+        async with scheduler.slot(tenant_policy(api_key), cost) as waited:
+            if waited > 1.0:
+                _log.debug("⏳ [SCHED] Lượt chờ %.2fs trước stage %s.", waited, stage)
+            yield waited
+
+    def status(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, **{stage: s.status() for stage, s in self.stages.items()}}
+
+
+# Scheduler dùng chung cho mọi session
+scheduler = TurnScheduler()
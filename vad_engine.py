@@ -0,0 +1,135 @@
+# vad_engine.py
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# --- SAFE IMPORT CONFIG ---
+try:
+    from config_db import SAMPLE_RATE
+except ImportError:
+    SAMPLE_RATE = 16000
+
+# Silero v5: cửa sổ 512 mẫu @16kHz (256 @8kHz), kèm 64/32 mẫu context của cửa sổ trước
+_WINDOW = {16000: 512, 8000: 256}
+_CONTEXT = {16000: 64, 8000: 32}
+
+
+def find_silero_onnx(artifact_dir: Path) -> Optional[Path]:
+    """Tìm silero_vad.onnx: artifact dir trước, sau đó file đóng gói trong package pip 'silero-vad'."""
+    for candidate in (artifact_dir / "silero_vad.onnx", artifact_dir / "silero-vad" / "files" / "silero_vad.onnx"):
+        if candidate.exists():
+            return candidate
+    try:
+        from importlib.resources import files
+        packaged = files("silero_vad").joinpath("data", "silero_vad.onnx")
+        if packaged.is_file():
+            return Path(str(packaged))
+    except (ImportError, ModuleNotFoundError, FileNotFoundError):
+        pass
+    return None
+
+
+class SileroOnnxStream:
+    """Trạng thái streaming của một luồng audio (hidden state + context); mỗi session/lượt dùng một stream riêng."""
+
+    def __init__(self, vad: "SileroOnnxVAD", sampling_rate: int = SAMPLE_RATE):
+        self._vad = vad
+        self.sampling_rate = sampling_rate
+        self.window = _WINDOW[sampling_rate]
+        self.reset()
+
+    def reset(self):
+        self._state = np.zeros((2, 1, 128), dtype=np.float32)
+        self._h = np.zeros((2, 1, 64), dtype=np.float32)
+        self._c = np.zeros((2, 1, 64), dtype=np.float32)
+        self._context = np.zeros(_CONTEXT[self.sampling_rate], dtype=np.float32)
+
+    def frame_probability(self, frame: np.ndarray) -> float:
+        """Xác suất tiếng nói của một cửa sổ đúng self.window mẫu float32."""
+        vad = self._vad
+        sr = np.array(self.sampling_rate, dtype=np.int64)
+        if vad.version == 5:
+            x = np.concatenate((self._context, frame))[None, :]
+            out, self._state = vad.session.run(None, {"input": x, "state": self._state, "sr": sr})
+            self._context = frame[-len(self._context):]
+        else:
+            out, self._h, self._c = vad.session.run(None, {"input": frame[None, :], "h": self._h, "c": self._c, "sr": sr})
+        return float(out.reshape(-1)[0])
+
+    def probabilities(self, audio: np.ndarray) -> np.ndarray:
+        """Xác suất cho từng cửa sổ của audio (cửa sổ cuối được pad 0)."""
+        n = -(-len(audio) // self.window)
+        padded = np.zeros(n * self.window, dtype=np.float32)
+        padded[:len(audio)] = audio
+        frames = padded.reshape(n, self.window)
+        return np.fromiter((self.frame_probability(f) for f in frames), dtype=np.float32, count=n)
+
+
+class SileroOnnxVAD:
+    """
+    Silero VAD chạy bằng onnxruntime, chỉ cần NumPy (không torch).
+    Cùng giao diện với model_registry.SileroTorchVAD: speech_timestamps() / collect_chunks().
+    """
+    engine = "onnx"
+
+    def __init__(self, model_path: Path, threads: int = 1):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        # Nhiều worker process: mỗi session 1 thread để không tranh CPU
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(str(model_path), sess_options=options,
+                                                    providers=["CPUExecutionProvider"])
+        inputs = {i.name for i in self.session.get_inputs()}
+        self.version = 5 if "state" in inputs else 4
+        self.model_path = model_path
+
+    def stream(self, sampling_rate: int = SAMPLE_RATE) -> SileroOnnxStream:
+        return SileroOnnxStream(self, sampling_rate)
+
+    def speech_timestamps(self, audio: np.ndarray, sampling_rate: int = SAMPLE_RATE, threshold: float = 0.3,
+                          min_speech_duration_ms: int = 250, min_silence_duration_ms: int = 100,
+                          speech_pad_ms: int = 30) -> List[Dict[str, int]]:
+        """Tương đương get_speech_timestamps của Silero (đơn vị: mẫu)."""
+        stream = self.stream(sampling_rate)
+        probs = stream.probabilities(np.asarray(audio, dtype=np.float32))
+        window = stream.window
+        min_speech = sampling_rate * min_speech_duration_ms // 1000
+        min_silence = sampling_rate * min_silence_duration_ms // 1000
+        pad = sampling_rate * speech_pad_ms // 1000
+        neg_threshold = max(threshold - 0.15, 0.01)
+
+        speeches: List[Dict[str, int]] = []
+        start: Optional[int] = None
+        temp_end = 0
+        for i, p in enumerate(probs):
+            pos = i * window
+            if p >= threshold:
+                temp_end = 0
+                if start is None:
+                    start = pos
+                continue
+            if p < neg_threshold and start is not None:
+                if not temp_end:
+                    temp_end = pos
+                if pos - temp_end < min_silence:
+                    continue
+                if temp_end - start > min_speech:
+                    speeches.append({"start": start, "end": temp_end})
+                start, temp_end = None, 0
+        if start is not None and len(audio) - start > min_speech:
+            speeches.append({"start": start, "end": len(audio)})
+
+        # Pad hai đầu, gộp đoạn chồng nhau
+        merged: List[Dict[str, int]] = []
+        for s in speeches:
+            s = {"start": max(0, s["start"] - pad), "end": min(len(audio), s["end"] + pad)}
+            if merged and s["start"] <= merged[-1]["end"]:
+                merged[-1]["end"] = max(merged[-1]["end"], s["end"])
+            else:
+                merged.append(s)
+        return merged
+
+    def collect_chunks(self, timestamps: List[Dict[str, int]], audio: np.ndarray) -> np.ndarray:
+        return np.concatenate([audio[t["start"]:t["end"]] for t in timestamps]) if timestamps else audio[:0]
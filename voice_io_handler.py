@@ -8,6 +8,9 @@ import threading
 from pathlib import Path
 from typing import Optional, Dict, Callable 
 
+from logging_layer import get_logger
+from audio_buffer import AudioRingBuffer
+
 try:
     # Import necessary constants safely
     from config_db import (
@@ -18,6 +21,11 @@ except ImportError:
     SAMPLE_RATE, CHANNELS, AUDIO_FILE, CHUNK_SIZE = 16000, 1, "user_input.wav", 1024
     print("⚠️ [IO] Failed to import from config_db, using fallback audio settings.")
 
+try:
+    from config_db import MAX_UTTERANCE_SECONDS
+except ImportError:
+    MAX_UTTERANCE_SECONDS = 30.0
+
 
 class VoiceIOHandler:
     """
@@ -26,12 +34,12 @@ class VoiceIOHandler:
     """
 
     def __init__(self, log_callback: Callable, audio_file: str):
-        self.log = log_callback
+        self.log = get_logger("io", log_callback)
         self.audio_file = audio_file
         self.p: Optional[pyaudio.PyAudio] = None
         self.record_stream = None
         self.play_stream = None
-        self.audio_frames = []
+        self.audio_frames: Optional[AudioRingBuffer] = None # Ring buffer cấp phát 1 lần, dùng lại mỗi lượt
         self.is_recording_active = threading.Event()
         self.stop_event = threading.Event() # For stopping recording thread
         self.initial_error: Optional[str] = None # Store initialization error
@@ -45,7 +53,7 @@ class VoiceIOHandler:
 
         except Exception as e:
             self.initial_error = f"PyAudio Init Error: {e}"
-            self.log(f"❌ [IO] PyAudio initialization failed: {e}", "red")
+            self.log("❌ [IO] PyAudio initialization failed: %s", "red", e)
             self._is_ready = False
 
     def is_ready(self) -> bool:
@@ -60,7 +68,9 @@ class VoiceIOHandler:
         if not self._is_ready or self.is_recording_active.is_set():
             return False
 
-        self.audio_frames = []
+        if self.audio_frames is None:
+            self.audio_frames = AudioRingBuffer(MAX_UTTERANCE_SECONDS, SAMPLE_RATE, CHANNELS, owner="local_mic")
+        self.audio_frames.clear()
         self.is_recording_active.set()
         self.stop_event.clear() # Clear stop signal
 
@@ -76,17 +86,21 @@ class VoiceIOHandler:
             return True
         except Exception as e:
             self.is_recording_active.clear()
-            self.log(f"❌ [IO] Error starting recording stream: {e}", "red")
+            self.log("❌ [IO] Error starting recording stream: %s", "red", e)
             self.initial_error = f"Recording Start Error: {e}"
             return False
 
     def _recording_callback(self, in_data, frame_count, time_info, status):
         """Hàm callback của PyAudio stream."""
         if status:
-            self.log(f"⚠️ [IO] Recording stream status warning: {status}", "orange")
+            self.log.warning("⚠️ [IO] Recording stream status warning: %s", status)
         
         if self.is_recording_active.is_set():
-            self.audio_frames.append(in_data)
+            self.audio_frames.write(in_data)
+            if self.audio_frames.is_full:
+                # Chạm MAX_UTTERANCE_SECONDS: dừng stream, giữ phần đã ghi (stop_recording vẫn lưu file như thường)
+                self.log.warning("⚠️ [IO] Đạt giới hạn %.0fs ghi âm, dừng ghi.", self.audio_frames.max_seconds)
+                return (in_data, pyaudio.paComplete)
             return (in_data, pyaudio.paContinue)
         else:
             return (in_data, pyaudio.paComplete)
@@ -110,9 +124,9 @@ class VoiceIOHandler:
                 self.record_stream.close()
                 self.record_stream = None
             except Exception as e:
-                self.log(f"⚠️ [IO] Error closing recording stream: {e}", "orange")
+                self.log("⚠️ [IO] Error closing recording stream: %s", "orange", e)
 
-        if not self.audio_frames:
+        if self.audio_frames is None or not len(self.audio_frames):
             self.log("❌ [IO] No audio frames were recorded.", "red")
             return None
             
@@ -122,26 +136,27 @@ class VoiceIOHandler:
                 wf.setnchannels(CHANNELS)
                 wf.setsampwidth(self.p.get_sample_size(pyaudio.paInt16))
                 wf.setframerate(SAMPLE_RATE)
-                wf.writeframes(b''.join(self.audio_frames))
+                for segment in self.audio_frames.segments():
+                    wf.writeframes(segment)
             
-            self.log(f"💾 [IO] Audio saved to: {self.audio_file}", "green")
+            self.log("💾 [IO] Audio saved to: %s", "green", self.audio_file)
             return self.audio_file
         except Exception as e:
-            self.log(f"❌ [IO] Error saving WAV file: {e}", "red")
+            self.log("❌ [IO] Error saving WAV file: %s", "red", e)
             self.initial_error = f"WAV Save Error: {e}"
             return None
         finally:
-            self.audio_frames = [] # Clear frames
+            self.audio_frames.clear() # Clear frames (giữ buffer đã cấp phát)
 
     # -------------------- Phát Audio --------------------
     
     def play_audio_response(self, file_path: str):
         """Phát file WAV (blocking)."""
         if not os.path.exists(file_path):
-            self.log(f"❌ [IO] Playback file not found: {file_path}", "red")
+            self.log("❌ [IO] Playback file not found: %s", "red", file_path)
             return
 
-        self.log(f"🔈 [IO] Playing audio: {Path(file_path).name}", "purple")
+        self.log("🔈 [IO] Playing audio: %s", "purple", Path(file_path).name)
         
         wf = None
         stream = None
@@ -167,7 +182,7 @@ class VoiceIOHandler:
             self.log("✅ [IO] Playback finished.", "green")
 
         except Exception as e:
-            self.log(f"❌ [IO] Error playing audio file '{file_path}': {e}", "red")
+            self.log("❌ [IO] Error playing audio file '%s': %s", "red", file_path, e)
             self.initial_error = f"Playback Error: {e}" 
         finally:
             # Ensure resources are closed
@@ -201,10 +216,14 @@ class VoiceIOHandler:
              except Exception: pass
              self.play_stream = None
 
+        if self.audio_frames is not None:
+            self.audio_frames.release()
+            self.audio_frames = None
+
         if self.p:
             self.log("🧹 [IO] Terminating PyAudio.", "yellow")
             try:
                 self.p.terminate()
             except Exception as e:
-                 self.log(f"⚠️ [IO] Error terminating PyAudio: {e}", "orange")
+                 self.log("⚠️ [IO] Error terminating PyAudio: %s", "orange", e)
             self.p = None
\ No newline at end of file